@@ -1,19 +1,54 @@
 import os
+import re
 import asyncio
+import itertools
+import tempfile
+import time
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import TELEGRAM_TOKEN
+from config import (
+    TELEGRAM_TOKEN, EXTRACTION_BATCHING, EXTRACTION_BATCH_DELAY_MS, EXTRACTION_BATCH_SIZE,
+    JOB_WORKERS, BOT_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+    WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY, FSM_STORAGE, FSM_STATE_TTL, FSM_FLUSH_INTERVAL,
+    DATABASE_SHARDS, DB_GROUP_COMMIT_WINDOW_MS, DB_GROUP_COMMIT_MAX_BATCH, LIST_PAGE_SIZE,
+    ICS_MAX_BYTES, ICS_MAX_EVENTS, ICS_IMPORT_CHUNK, VOICE_DIR, VOICE_RETENTION_DAYS,
+    VOICE_USER_QUOTA_MB, VOICE_SWEEP_INTERVAL, IDEMPOTENCY_PENDING_TIMEOUT,
+    RATE_LIMIT_USER_PER_MINUTE, RATE_LIMIT_USER_BURST, RATE_LIMIT_GLOBAL_PER_MINUTE,
+    RATE_LIMIT_GLOBAL_BURST, RATE_LIMIT_VOICE_COST, OVERLOAD_QUEUE_THRESHOLDS,
+    OVERLOAD_LAG_THRESHOLDS, OVERLOAD_COOLDOWN, OVERLOAD_VOICE_MAX_SECONDS, OVERLOAD_MAX_TOKENS,
+    METRICS_HOST, METRICS_PORT, WATCHDOG_STALL_THRESHOLD, WATCHDOG_INTERVAL, SCHEDULER_ENABLED,
+    WATCHDOG_LIVENESS_TIMEOUT, LIVENESS_PORT
+)
 from database import Database
 from speech_recognition import SpeechRecognizer
 from event_extractor_mistral import EventExtractorMistral
+from extraction_batcher import ExtractionBatcher
 from notification_manager import NotificationManager
+from circuit_breaker import CircuitOpenError
+from job_queue import JobQueue
+from webhook_server import WebhookServer
+from fsm_storage import SQLiteStorage
+from ics_calendar import ICSError, parse_events, export_lines
+from voice_storage import VoiceStorage
+from rate_limiter import RateLimiter
+from load_shedding import LoadShedder
+from time_parser import parse_event
+from metrics_server import MetricsServer
+from metrics import Counter, Histogram
+from tracing import tracer
+from loop_watchdog import LoopWatchdog
 import pytz
 from datetime import datetime
 from aiogram.filters import StateFilter
 
+HANDLER_SECONDS = Histogram('reminderbot_handler_seconds', 'Длительность обработки обновления (метка update_type)')
+HANDLER_ERRORS = Counter('reminderbot_handler_errors_total', 'Обновления, обработка которых завершилась исключением')
+LOCAL_PARSER_RESULTS = Counter('reminderbot_local_parser_total', 'Попытки локального разбора времени (hit - без модели)')
+REPLAYED_MESSAGES = Counter('reminderbot_replayed_messages_total', 'Повторные доставки, обслуженные сохраненным ответом')
+
 class TimezoneStates(StatesGroup):
     waiting_for_timezone = State()
 
@@ -21,29 +56,128 @@ class ManualReminderStates(StatesGroup):
     waiting_for_description = State()
     waiting_for_datetime = State()
 
+class EditReminderStates(StatesGroup):
+    waiting_for_datetime = State()
+
 class ReminderBot:
+    # Сколько неподтвержденных списков событий хранить на пользователя
+    PENDING_EVENTS_LIMIT = 5
+
     def __init__(self):
         self.bot = Bot(token=TELEGRAM_TOKEN)
-        self.dp = Dispatcher(storage=MemoryStorage())
-        self.db = Database('reminders.db')
+        self.db = Database('reminders.db', shards=DATABASE_SHARDS)
+        if FSM_STORAGE == 'sqlite':
+            # Состояния диалогов хранятся в той же базе и общие для всех процессов бота
+            storage = SQLiteStorage(self.db.db_path, ttl=FSM_STATE_TTL, flush_interval=FSM_FLUSH_INTERVAL,
+                                    database=self.db)
+        else:
+            storage = MemoryStorage()
+        self.dp = Dispatcher(storage=storage)
         self.speech_recognizer = SpeechRecognizer()
         self.event_extractor = EventExtractorMistral()
+        if EXTRACTION_BATCHING:
+            # Одновременные запросы пользователей уходят в модель одним пакетом
+            self.event_extractor = ExtractionBatcher(
+                self.event_extractor,
+                max_delay=EXTRACTION_BATCH_DELAY_MS / 1000,
+                max_batch_size=EXTRACTION_BATCH_SIZE
+            )
         self.notification_manager = NotificationManager(TELEGRAM_TOKEN, self.db)
+        # Пул воркеров для голосовых сообщений и запросов к модели
+        self.job_queue = JobQueue(workers=JOB_WORKERS)
+        # Частота запросов к распознаванию и модели: на пользователя и общая
+        self.rate_limiter = RateLimiter(
+            user_rate=RATE_LIMIT_USER_PER_MINUTE / 60,
+            user_burst=RATE_LIMIT_USER_BURST,
+            global_rate=RATE_LIMIT_GLOBAL_PER_MINUTE / 60,
+            global_burst=RATE_LIMIT_GLOBAL_BURST
+        )
+        # Ступенчатая деградация по глубине очереди и задержке цикла событий
+        self.load_shedder = LoadShedder(
+            self.job_queue.depth,
+            depth_thresholds=OVERLOAD_QUEUE_THRESHOLDS,
+            lag_thresholds=OVERLOAD_LAG_THRESHOLDS,
+            cooldown=OVERLOAD_COOLDOWN
+        )
+        self.load_shedder.on_change(self.apply_degradation)
+        # Сторож цикла событий: находит вызовы, блокирующие цикл
+        self.watchdog = LoopWatchdog(threshold=WATCHDOG_STALL_THRESHOLD, interval=WATCHDOG_INTERVAL)
         self.register_handlers()
         
-        # Создаем директорию для голосовых сообщений, если её нет
-        self.voice_dir = "voice_messages"
-        os.makedirs(self.voice_dir, exist_ok=True)
+        # Голосовые сообщения: раскладка по каталогам, срок хранения и квота
+        self.voice_storage = VoiceStorage(
+            self.db,
+            root=VOICE_DIR,
+            retention_days=VOICE_RETENTION_DAYS,
+            quota_bytes=int(VOICE_USER_QUOTA_MB * 1024 * 1024),
+            sweep_interval=VOICE_SWEEP_INTERVAL
+        )
+
+    def liveness(self) -> tuple:
+        """Процесс жив, если цикл событий не завис надолго; загруженный цикл
+        с задержками меньше WATCHDOG_LIVENESS_TIMEOUT считается живым.
+        Вызывается из потока сторожа, поэтому читает только его отметки"""
+        details = {'heartbeat_age': round(self.watchdog.heartbeat_age(), 3)}
+        if self.watchdog.last_stall is not None:
+            ended_at, duration = self.watchdog.last_stall
+            details['last_stall'] = {
+                'duration': round(duration, 3),
+                'seconds_ago': round(time.monotonic() - ended_at, 1)
+            }
+        return self.watchdog.is_responsive(WATCHDOG_LIVENESS_TIMEOUT), details
+
+    def readiness(self) -> tuple:
+        """Бот готов принимать сообщения: база и планировщик работают, нет
+        перегрузки. Проверку обслуживает цикл событий, так что зависший цикл
+        виден как отсутствие ответа. Недоступность внешних сервисов готовность
+        не снимает - команды и уведомления работают без них"""
+        scheduler = self.notification_manager.scheduler
+        checks = {
+            'database_writer': self.db.writer is not None,
+            # Процесс без планировщика только принимает сообщения
+            'scheduler': bool(scheduler and scheduler.running) or not SCHEDULER_ENABLED,
+            'not_overloaded': self.load_shedder.level < LoadShedder.REJECT,
+        }
+        details = {
+            'checks': checks,
+            'degradation': LoadShedder.LEVEL_NAMES[self.load_shedder.level],
+            'job_queue_depth': self.job_queue.depth(),
+            'dependencies': {
+                breaker.name: breaker.is_available()
+                for breaker in (self.speech_recognizer.breaker, self.event_extractor.breaker)
+            },
+        }
+        return all(checks.values()), details
+
+    async def observe_update(self, handler, event: types.Update, data: dict):
+        """Промежуточный слой: длительность и ошибки обработки каждого обновления"""
+        update_type = event.event_type
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(update_type=update_type)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.monotonic() - started, update_type=update_type)
 
     def register_handlers(self):
+        self.dp.update.outer_middleware(self.observe_update)
+        
         # Бзовые команды
         self.dp.message.register(self.start_command, Command("start"))
         self.dp.message.register(self.list_command, Command("list"))
+        self.dp.message.register(self.find_command, Command("find"))
+        self.dp.message.register(self.export_command, Command("export"))
         self.dp.message.register(self.settings_command, Command("settings"))
+        self.dp.message.register(self.storage_command, Command("storage"))
         
         # Обработка голосовых сообщений
         self.dp.message.register(self.handle_voice, F.voice)
         
+        # Импорт календаря из файла .ics
+        self.dp.message.register(self.handle_document, F.document)
+        
         # Обработка установки часового пояса
         self.dp.message.register(
             self.process_timezone_setting,
@@ -83,6 +217,29 @@ class ReminderBot:
             F.data == "cancel_manual"
         )
         
+        # Перенос напоминания без повторного разбора текста моделью
+        self.dp.message.register(
+            self.process_edit_datetime,
+            F.text,
+            StateFilter(EditReminderStates.waiting_for_datetime)
+        )
+        self.dp.callback_query.register(
+            self.snooze_reminder,
+            F.data.startswith("snooze_")
+        )
+        self.dp.callback_query.register(
+            self.edit_reminder_time,
+            F.data.startswith("edit_")
+        )
+        self.dp.callback_query.register(
+            self.abort_edit,
+            F.data == "abort_edit"
+        )
+        self.dp.callback_query.register(
+            self.manage_reminder,
+            F.data.startswith("manage_")
+        )
+        
         # Общий обработчик текста должен быть последним
         self.dp.message.register(
             self.handle_text,
@@ -91,18 +248,33 @@ class ReminderBot:
             and message.text
         )
         
-        # Добавляем обработчики для удаления напоминаний
+        # Страницы списка напоминаний и удаление из списка
+        self.dp.callback_query.register(
+            self.show_list_page,
+            F.data.startswith("lpage_") | F.data.startswith("lback_")
+            | F.data.in_({"show_delete_buttons", "save_deletions", "show_edit_buttons"})
+        )
+        self.dp.callback_query.register(
+            self.delete_from_list,
+            F.data.startswith("ldel_")
+        )
         self.dp.callback_query.register(
-            self.show_delete_buttons,
-            F.data == "show_delete_buttons"
+            self.show_find_page,
+            F.data.startswith("find_")
         )
         self.dp.callback_query.register(
             self.delete_reminder_by_id,
             F.data.startswith("delete_")
         )
+        
+        # Подтверждение нескольких событий из одного сообщения
         self.dp.callback_query.register(
-            self.save_deletions,
-            F.data == "save_deletions"
+            self.confirm_events,
+            F.data.startswith("confirm_events")
+        )
+        self.dp.callback_query.register(
+            self.discard_events,
+            F.data.startswith("discard_events")
         )
         
         # Добавляем обработчик для кнопки смены часового пояса
@@ -132,7 +304,10 @@ class ReminderBot:
             "👋 Привет! Я бот для создания напоминаний.\n\n"
             "📝 Команды:\n"
             "/list - показать все напоминания\n"
-            "/settings - настроить часовой пояс\n\n"
+            "/find <слова> - найти напоминание или голосовое сообщение\n"
+            "/export - выгрузить напоминания в календарь (.ics)\n"
+            "/settings - настроить часовой пояс\n"
+            "/storage - место, занятое голосовыми сообщениями\n\n"
             "🎤 Отправ мне голосовое сообщение или напиши текстом описание события и дату, "
             "например:\n"
             "- 'Запись к терапевту 25 марта в 14:30'\n"
@@ -142,23 +317,24 @@ class ReminderBot:
         )
         await message.answer(text)
 
-    async def list_command(self, message: types.Message):
-        user_id = message.from_user.id
-        reminders = self.db.get_user_reminders(user_id)
-        
+    def render_reminders_page(self, user_id: int, start: tuple = None, before: tuple = None):
+        """Текст и кнопки одной страницы /list; (None, None), если напоминаний нет.
+        Из базы читается только запрошенная страница"""
+        reminders, has_prev, has_next = self.db.get_reminders_page(
+            user_id, start=start, before=before, limit=LIST_PAGE_SIZE
+        )
         if not reminders:
-            await message.answer("У вас пока нет напоминаний.")
-            return
+            return None, None
         
         user_timezone = self.db.get_user_timezone(user_id)
         text = "📋 Ваши напоминания:\n\n"
         
-        for unique_key, reminder_data in reminders.items():
+        for number, reminder_data in enumerate(reminders, 1):
             formatted_datetime = self.format_datetime(
                 reminder_data['event_datetime'], 
                 user_timezone
             )
-            text += f"🎯 Основное событие (ID: {reminder_data['display_id']}):\n"
+            text += f"🎯 Основное событие (ID: {number}):\n"
             text += f"└ {reminder_data['description']}\n"
             text += f"└ {formatted_datetime}\n"
             
@@ -172,65 +348,95 @@ class ReminderBot:
                     text += f"  └ {notif['timing']} ({formatted_notif_time})\n"
             text += "\n"
         
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        # Ключ первой записи: после удаления страница перерисовывается с того же места
+        first = f"{reminders[0]['event_datetime']}_{reminders[0]['id']}"
+        buttons = [
             [types.InlineKeyboardButton(
-                text="🗑 Удалить по ID",
-                callback_data="show_delete_buttons"
-            )]
-        ])
+                text=f"🗑 {number}",
+                callback_data=f"ldel_{reminder_data['id']}_{first}"
+            ) for number, reminder_data in enumerate(reminders, 1)],
+            [types.InlineKeyboardButton(
+                text=f"✏️ {number}",
+                callback_data=f"manage_{reminder_data['id']}"
+            ) for number, reminder_data in enumerate(reminders, 1)]
+        ]
         
-        await message.answer(text, reply_markup=keyboard)
+        navigation = []
+        if has_prev:
+            navigation.append(types.InlineKeyboardButton(
+                text="⬅️ Назад",
+                callback_data=f"lback_{first}"
+            ))
+        if has_next:
+            last = reminders[-1]
+            navigation.append(types.InlineKeyboardButton(
+                text="Вперед ➡️",
+                callback_data=f"lpage_{last['event_datetime']}_{last['id'] + 1}"
+            ))
+        if navigation:
+            buttons.append(navigation)
+        
+        return text, types.InlineKeyboardMarkup(inline_keyboard=buttons)
 
-    async def show_delete_buttons(self, callback: types.CallbackQuery):
-        user_id = callback.from_user.id
-        reminders = self.db.get_user_reminders(user_id)
+    @staticmethod
+    def parse_page_key(data: str) -> tuple:
+        """Ключ страницы (event_datetime, id) из callback_data вида prefix_..._datetime_id"""
+        parts = data.split('_')
+        return parts[-2], int(parts[-1])
+
+    async def list_command(self, message: types.Message):
+        text, keyboard = self.render_reminders_page(message.from_user.id)
         
-        if not reminders:
-            await callback.answer("Нет напоминаний для удаления")
+        if text is None:
+            await message.answer("У вас пока нет напоминаний.")
             return
         
-        # Создаем текст списка напоминаний
-        user_timezone = self.db.get_user_timezone(user_id)
-        text = "📋 Ваши напоминания:\n\n"
+        await message.answer(text, reply_markup=keyboard)
+
+    async def show_list_page(self, callback: types.CallbackQuery):
+        user_id = callback.from_user.id
+        if callback.data.startswith("lpage_"):
+            text, keyboard = self.render_reminders_page(user_id, start=self.parse_page_key(callback.data))
+        elif callback.data.startswith("lback_"):
+            text, keyboard = self.render_reminders_page(user_id, before=self.parse_page_key(callback.data))
+        else:
+            # Кнопки из сообщений, отправленных до появления страниц, открывают первую страницу
+            text, keyboard = self.render_reminders_page(user_id)
         
-        # Создаем кнопи для каждого ID напоминания
-        buttons = []
-        for unique_key, reminder_data in reminders.items():
-            formatted_datetime = self.format_datetime(
-                reminder_data['event_datetime'], 
-                user_timezone
-            )
-            text += f"🎯 Основное событие (ID: {reminder_data['display_id']}):\n"
-            text += f"└ {reminder_data['description']}\n"
-            text += f"└ {formatted_datetime}\n"
+        if text is None:
+            await callback.message.edit_text("У вас нет напоминаний.")
+        else:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+
+    async def delete_from_list(self, callback: types.CallbackQuery):
+        reminder_id = int(callback.data.split('_')[1])
+        user_id = callback.from_user.id
+        
+        try:
+            # Напоминание другого пользователя удалить нельзя
+            if self.db.get_reminder(reminder_id, user_id) is None:
+                await callback.answer("Напоминание не найдено")
+                return
+            await self.db.delete_reminder(reminder_id, user_id=user_id)
             
-            if reminder_data['notifications']:
-                text += "├ Дополнительные уведомления:\n"
-                for notif in reminder_data['notifications']:
-                    formatted_notif_time = self.format_datetime(
-                        notif['datetime'],
-                        user_timezone
-                    )
-                    text += f"  └ {notif['timing']} ({formatted_notif_time})\n"
-            text += "\n"
+            # Перерисовываем ту же страницу; если она опустела - предыдущую
+            key = self.parse_page_key(callback.data)
+            text, keyboard = self.render_reminders_page(user_id, start=key)
+            if text is None:
+                text, keyboard = self.render_reminders_page(user_id, before=key)
             
-            buttons.append([types.InlineKeyboardButton(
-                text=f"🗑 ID: {reminder_data['display_id']}",
-                callback_data=f"delete_{reminder_data['display_id']}"
-            )])
-        
-        # Добавляем кнопку "Сохранит��" внизу
-        buttons.append([types.InlineKeyboardButton(
-            text="✅ Сохранить",
-            callback_data="save_deletions"
-        )])
-        
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=buttons)
-        
-        await callback.message.edit_text(text, reply_markup=keyboard)
-        await callback.answer()
+            if text is None:
+                await callback.message.edit_text("У вас больше нет напоминаний.")
+            else:
+                await callback.message.edit_text(text, reply_markup=keyboard)
+            await callback.answer("Напоминание удалено")
+            
+        except Exception as e:
+            await callback.answer(f"Ошибка при удалении: {str(e)}")
 
     async def delete_reminder_by_id(self, callback: types.CallbackQuery):
+        """Кнопки удаления по отображаемому ID из сообщений старого формата"""
         display_id = int(callback.data.split('_')[1])
         user_id = callback.from_user.id
         
@@ -242,99 +448,97 @@ class ReminderBot:
                 return
             
             # Удаляем напоминание по реальному ID
-            self.db.delete_reminder(real_id)
+            await self.db.delete_reminder(real_id, user_id=user_id)
             
-            # Обновляем список напоминаний
-            reminders = self.db.get_user_reminders(user_id)
-            
-            if not reminders:
+            text, keyboard = self.render_reminders_page(user_id)
+            if text is None:
                 await callback.message.edit_text("У вас больше нет напоминаний.")
-                await callback_query.answer("Напоминание удалено")
-                return
-            
-            # Обновляем текст и кнопки с новыми display_id
-            user_timezone = self.db.get_user_timezone(user_id)
-            text = "📋 Ваши напоминания:\n\n"
-            
-            buttons = []
-            for unique_key, reminder_data in reminders.items():
-                formatted_datetime = self.format_datetime(
-                    reminder_data['event_datetime'], 
-                    user_timezone
-                )
-                text += f"🎯 Основное событие (ID: {reminder_data['display_id']}):\n"
-                text += f"└ {reminder_data['description']}\n"
-                text += f"└ {formatted_datetime}\n"
-                
-                if reminder_data['notifications']:
-                    text += "├ Дополнительные уведомления:\n"
-                    for notif in reminder_data['notifications']:
-                        formatted_notif_time = self.format_datetime(
-                            notif['datetime'],
-                            user_timezone
-                        )
-                        text += f"  └ {notif['timing']} ({formatted_notif_time})\n"
-                text += "\n"
-                
-                buttons.append([types.InlineKeyboardButton(
-                    text=f"🗑 ID: {reminder_data['display_id']}",
-                    callback_data=f"delete_{reminder_data['display_id']}"
-                )])
-            
-            buttons.append([types.InlineKeyboardButton(
-                text="✅ Сохранить",
-                callback_data="save_deletions"
-            )])
-            
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=buttons)
-            
-            await callback.message.edit_text(text, reply_markup=keyboard)
+            else:
+                await callback.message.edit_text(text, reply_markup=keyboard)
             await callback.answer("Напоминание удалено")
             
         except Exception as e:
             await callback.answer(f"Ошибка при удалении: {str(e)}")
 
-    async def save_deletions(self, callback: types.CallbackQuery):
-        user_id = callback.from_user.id
-        reminders = self.db.get_user_reminders(user_id)
-        
-        if not reminders:
-            await callback.message.edit_text("У вас нет напоминаний.")
-            await callback.answer()
-            return
+    def render_find_page(self, user_id: int, query: str, offset: int = 0):
+        """Текст и кнопки страницы результатов поиска; (None, None), если ничего не найдено"""
+        words = re.findall(r'\w+', query.lower())[:10]
+        if not words:
+            return None, None
+        # Одна лишняя строка показывает, есть ли следующая страница
+        results = self.db.search(user_id, words, limit=LIST_PAGE_SIZE + 1, offset=offset)
+        if not results:
+            return None, None
+        has_next = len(results) > LIST_PAGE_SIZE
+        results = results[:LIST_PAGE_SIZE]
         
-        # Создаем обычный писок с одной кнопкой "Удалить по ID"
         user_timezone = self.db.get_user_timezone(user_id)
-        text = "📋 Ваши напоминания:\n\n"
+        text = f"🔎 Результаты поиска «{query}»:\n\n"
+        for kind, item_id, item_text, dt in results:
+            if kind == 'reminder':
+                text += f"🎯 {item_text}\n└ {self.format_datetime(dt, user_timezone)}\n\n"
+            else:
+                try:
+                    formatted = datetime.strptime(dt, "%Y%m%d_%H%M%S").strftime('%d.%m.%Y %H:%M')
+                except ValueError:
+                    formatted = dt
+                excerpt = item_text if len(item_text) <= 200 else item_text[:200] + "…"
+                text += f"🎤 {excerpt}\n└ голосовое сообщение от {formatted}\n\n"
         
-        for unique_key, reminder_data in reminders.items():
-            formatted_datetime = self.format_datetime(
-                reminder_data['event_datetime'], 
-                user_timezone
-            )
-            text += f"🎯 Основное событие (ID: {reminder_data['display_id']}):\n"
-            text += f"└ {reminder_data['description']}\n"
-            text += f"└ {formatted_datetime}\n"
-            
-            if reminder_data['notifications']:
-                text += "Дополнительные уведомления:\n"
-                for notif in reminder_data['notifications']:
-                    formatted_notif_time = self.format_datetime(
-                        notif['datetime'],
-                        user_timezone
-                    )
-                    text += f"  └ {notif['timing']} ({formatted_notif_time})\n"
-            text += "\n"
+        navigation = []
+        if offset > 0:
+            navigation.append(types.InlineKeyboardButton(
+                text="⬅️ Назад",
+                callback_data=f"find_{max(offset - LIST_PAGE_SIZE, 0)}"
+            ))
+        if has_next:
+            navigation.append(types.InlineKeyboardButton(
+                text="Вперед ➡️",
+                callback_data=f"find_{offset + LIST_PAGE_SIZE}"
+            ))
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+        return text, keyboard
+
+    async def find_command(self, message: types.Message, state: FSMContext):
+        parts = message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            await message.answer("🔎 Укажите, что искать, например: /find врач")
+            return
         
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(
-                text="🗑 Удалить по ID",
-                callback_data="show_delete_buttons"
-            )]
-        ])
+        query = parts[1].strip()
+        text, keyboard = self.render_find_page(message.from_user.id, query)
+        if text is None:
+            await message.answer(f"🔎 По запросу «{query}» ничего не найдено.")
+            return
+        
+        # Запрос может не поместиться в callback_data - кнопки страниц берут его из состояния
+        await state.update_data(find_query=query)
+        await message.answer(text, reply_markup=keyboard)
+
+    async def show_find_page(self, callback: types.CallbackQuery, state: FSMContext):
+        query = (await state.get_data()).get('find_query')
+        if not query:
+            await callback.answer("Повторите поиск командой /find")
+            return
         
+        offset = int(callback.data.split('_')[1])
+        text, keyboard = self.render_find_page(callback.from_user.id, query, offset)
+        if text is None:
+            await callback.answer("Больше ничего не найдено")
+            return
         await callback.message.edit_text(text, reply_markup=keyboard)
-        await callback.answer("Изменения сохранены")
+        await callback.answer()
+
+    async def storage_command(self, message: types.Message):
+        count, used = await asyncio.to_thread(self.voice_storage.usage, message.from_user.id)
+        quota = self.voice_storage.quota_bytes
+        text = (
+            f"🎤 Голосовых сообщений хранится: {count}\n"
+            f"💾 Занято: {used / 1024 / 1024:.1f} из {quota / 1024 / 1024:.0f} МБ\n\n"
+            f"Записи хранятся {self.voice_storage.retention.days} дн., при превышении квоты "
+            f"сначала удаляются самые старые. Расшифровки остаются и доступны через /find."
+        )
+        await message.answer(text)
 
     async def settings_command(self, message: types.Message):
         user_timezone = self.db.get_user_timezone(message.from_user.id)
@@ -414,7 +618,9 @@ class ReminderBot:
                 raise ValueError("Недопустимое смещение")
             
             timezone_name = f"Etc/GMT{'-' if offset > 0 else '+'}{abs(offset)}"
-            self.db.set_user_timezone(message.from_user.id, timezone_name)
+            await self.db.set_user_timezone(message.from_user.id, timezone_name)
+            # Готовые тексты уведомлений содержат местное время - обновляем их
+            await self.notification_manager.rerender_notifications(message.from_user.id, timezone_name)
             
             # Отправляем новое сообщение с обновленными настройкаи
             text = f"⚙️ Настройки\n\n🌍 Часовой пояс: {timezone_str}"
@@ -456,44 +662,198 @@ class ReminderBot:
         await state.clear()
         await callback.answer("Настройки сохранены")
 
-    async def handle_voice(self, message: types.Message):
+    def apply_degradation(self, level: int):
+        """Настройки, зависящие от уровня деградации"""
+        reduced = level >= LoadShedder.REDUCED_TOKENS
+        self.event_extractor.set_max_tokens(OVERLOAD_MAX_TOKENS if reduced else None)
+
+    async def check_overload(self, message: types.Message) -> bool:
+        """Отклоняет новую тяжелую задачу при перегрузке; возвращает False, если отклонена"""
+        level = self.load_shedder.level
+        if level >= LoadShedder.REJECT:
+            await message.answer(
+                f"⏳ Сейчас я перегружен и не успею обработать сообщение. "
+                f"Пожалуйста, отправьте его еще раз через {max(1, round(OVERLOAD_COOLDOWN / 60))} мин.\n"
+                f"Создать напоминание без ожидания можно командой /manual."
+            )
+            return False
+        if (message.voice and level >= LoadShedder.SHORT_VOICE
+                and message.voice.duration > OVERLOAD_VOICE_MAX_SECONDS):
+            await message.answer(
+                f"⏳ Сейчас я перегружен и принимаю голосовые сообщения не длиннее "
+                f"{OVERLOAD_VOICE_MAX_SECONDS} сек. Отправьте сообщение короче или напишите текстом."
+            )
+            return False
+        return True
+
+    async def extract_events(self, text: str, user_timezone: str) -> list:
+        """События из текста. При перегрузке и при недоступной модели сначала
+        пробуем локальный разбор и обращаемся к модели, только если он не справился"""
+        with tracer.span('extract_events') as span:
+            if (self.load_shedder.level >= LoadShedder.LOCAL_PARSER
+                    or not self.event_extractor.breaker.is_available()):
+                event = parse_event(text, user_timezone)
+                LOCAL_PARSER_RESULTS.inc(result='miss' if event is None else 'hit')
+                if event is not None:
+                    print(f"Событие разобрано локально: {event}")
+                    span.set(backend='local', events=1)
+                    return [event]
+            span.set(backend='mistral', batching=EXTRACTION_BATCHING)
+            events = await self.event_extractor.extract_events(text, user_timezone)
+            span.set(events=len(events))
+            return events
+
+    async def admit(self, message: types.Message, cost: float = 1) -> bool:
+        """Проверки перед тяжелой задачей: перегрузка, повторная доставка, лимит частоты"""
+        if not await self.check_overload(message):
+            return False
+        if not await self.claim_message(message):
+            return False
+        if not await self.check_rate_limit(message, cost):
+            await self.release_message(message)
+            return False
+        return True
+
+    async def run_traced(self, root, job):
+        """Выполняет фоновую задачу в трассе обновления и завершает трассу"""
+        if root is not None:
+            root.set(queued_ms=round((time.time() - root.start) * 1000, 2))
+        error = None
+        with tracer.activate(root):
+            try:
+                await job()
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                tracer.finish(root, error)
+
+    async def check_rate_limit(self, message: types.Message, cost: float = 1) -> bool:
+        """Списывает стоимость запроса из лимита; если лимит исчерпан, сообщает,
+        сколько подождать, и возвращает False"""
+        wait = self.rate_limiter.acquire(message.from_user.id, cost)
+        if not wait:
+            return True
+        if wait == float('inf'):
+            await message.answer("⏳ Сейчас я не могу обработать такой запрос. Пожалуйста, попробуйте позже.")
+        else:
+            await message.answer(
+                f"⏳ Слишком много запросов. Пожалуйста, повторите через {max(1, round(wait))} сек.\n"
+                f"Команды (/list, /find, /settings) работают без ограничений."
+            )
+        return False
+
+    async def claim_message(self, message: types.Message) -> bool:
+        """Принимает сообщение в обработку. Telegram может доставить его повторно
+        (например, после перезапуска бота) - тогда повторяем сохраненный ответ
+        без повторной обработки и возвращаем False"""
+        claimed, result = await self.db.claim_message(
+            message.from_user.id, message.chat.id, message.message_id,
+            stale_after=IDEMPOTENCY_PENDING_TIMEOUT
+        )
+        if claimed:
+            return True
+        REPLAYED_MESSAGES.inc()
+        text, reply_markup = result
+        if text is None:
+            await message.answer("⏳ Это сообщение уже обрабатывается.")
+        else:
+            keyboard = types.InlineKeyboardMarkup.model_validate_json(reply_markup) if reply_markup else None
+            await message.answer(text, reply_markup=keyboard)
+        return False
+
+    async def reply_result(self, message: types.Message, ack: types.Message, text: str,
+                           reply_markup: types.InlineKeyboardMarkup = None):
+        """Итоговый ответ на сообщение: заменяет текст ack и сохраняется для повторных доставок"""
+        with tracer.span('reply'):
+            await ack.edit_text(text, reply_markup=reply_markup)
+        await self.db.save_message_result(
+            message.from_user.id, message.chat.id, message.message_id, text,
+            reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        )
+
+    async def release_message(self, message: types.Message):
+        """Обработка не удалась - повторная доставка сообщения обработает его заново"""
+        try:
+            await self.db.release_message(message.from_user.id, message.chat.id, message.message_id)
+        except Exception as e:
+            print(f"Ошибка при снятии отметки об обработке сообщения: {str(e)}")
+
+    async def handle_voice(self, message: types.Message, state: FSMContext):
+        # Если одна из зависимостей недоступна, отвечаем сразу, не скачивая и не конвертируя файл
+        for breaker in (self.speech_recognizer.breaker, self.event_extractor.breaker):
+            if not breaker.is_available():
+                await message.answer(self.dependency_unavailable_text(CircuitOpenError(breaker.name)))
+                return
+        
+        # Трасса охватывает обработку от получения сообщения до ответа; отклоненные не записываются
+        root = tracer.start_trace(
+            'voice', user_id=message.from_user.id, audio_duration=message.voice.duration
+        )
+        with tracer.activate(root):
+            if not await self.admit(message, RATE_LIMIT_VOICE_COST):
+                return
+            # Тяжелую обработку выполняем в фоне, чтобы она не задерживала команды и кнопки
+            with tracer.span('ack'):
+                ack = await message.answer("⏳ Обрабатываю голосовое сообщение…")
+        self.job_queue.submit(
+            message.from_user.id,
+            lambda: self.run_traced(root, lambda: self.process_voice(message, state, ack))
+        )
+
+    async def process_voice(self, message: types.Message, state: FSMContext, ack: types.Message):
+        """Скачивание, конвертация, распознавание и извлечение событий; результат
+        заменяет текст сообщения-подтверждения ack"""
+        voice_ogg = None
+        reminder_id = None
         try:
-            # Создаем уникальные имена файлов с user_id и timestamp
+            # Создаем уникальные имена файлов с timestamp и id сообщения
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             user_id = message.from_user.id
-            base_filename = f"{user_id}_{timestamp}"
+            voice_ogg, voice_wav = self.voice_storage.paths(user_id, f"{timestamp}_{message.message_id}")
             
-            voice_ogg = os.path.join(self.voice_dir, f"{base_filename}.ogg")
-            voice_wav = os.path.join(self.voice_dir, f"{base_filename}.wav")
-            
-            file = await self.bot.get_file(message.voice.file_id)
-            file_path = file.file_path
-            
-            # Скачиваем файл
-            await self.bot.download_file(file_path, voice_ogg)
+            with tracer.span('download', file_size=message.voice.file_size):
+                file = await self.bot.get_file(message.voice.file_id)
+                file_path = file.file_path
+                
+                # Скачиваем файл
+                await self.bot.download_file(file_path, voice_ogg)
             
-            # Конвертируем и распознаем
-            self.speech_recognizer.convert_ogg_to_wav(voice_ogg, voice_wav)
-            recognized_text = self.speech_recognizer.transcribe(voice_wav)
+            # Конвертируем и распознаем в потоке: ffmpeg и HTTP-запрос блокирующие.
+            # WAV нужен только для распознавания - удаляем его сразу
+            try:
+                with tracer.span('convert_ogg_to_wav'):
+                    await asyncio.to_thread(self.speech_recognizer.convert_ogg_to_wav, voice_ogg, voice_wav)
+                with tracer.span('transcribe') as span:
+                    recognized_text = await asyncio.to_thread(self.speech_recognizer.transcribe, voice_wav)
+                    span.set(text_length=len(recognized_text))
+            finally:
+                self.voice_storage.discard(voice_wav)
             
             # Получаем данные о событии
             user_timezone = self.db.get_user_timezone(message.from_user.id)
-            event_data = await self.event_extractor.extract_event_data(recognized_text, user_timezone)
+            events = await self.extract_events(recognized_text, user_timezone)
             
             # Сохраняем информацию о голосовом сообщении в базу данных
-            self.db.save_voice_message(
+            await self.db.save_voice_message(
                 user_id=user_id,
                 ogg_path=voice_ogg,
-                wav_path=voice_wav,
+                wav_path='',
                 recognized_text=recognized_text,
-                timestamp=timestamp
+                timestamp=timestamp,
+                file_size=os.path.getsize(voice_ogg)
             )
             
-            # Сначала сохраняем напоминание и получаем его ID
-            reminder_id = self.db.save_reminder(
-                message.from_user.id,
-                event_data["description"],
-                event_data["datetime"]
+            # Несколько событий в одном сообщении - предлагаем создать их разом
+            if len(events) > 1:
+                await self.ask_events_confirmation(message, ack, state, events, user_timezone, recognized_text)
+                return
+            event_data = events[0]
+            
+            # Напоминание и его уведомления сохраняются одной транзакцией до ответа:
+            # пользователь не увидит "создано" для напоминания без уведомлений
+            reminder_id, = await self.notification_manager.schedule_events(
+                message.from_user.id, [event_data], user_timezone
             )
             
             # Создаем клавиатуру с кнопкой отмены
@@ -512,22 +872,118 @@ class ReminderBot:
                 f"Событие: {event_data['description']}\n"
                 f"Дата и время: {formatted_datetime}"
             )
-            await message.answer(text, reply_markup=keyboard)
+            await self.reply_result(message, ack, text, reply_markup=keyboard)
             
-            # Планируем уведомления с существующим reminder_id
-            self.notification_manager.schedule_notifications(
-                message.from_user.id,
-                event_data,
-                user_timezone,
-                reminder_id
-            )
+        except Exception as e:
+            # Если напоминание уже сохранено, повторная доставка создала бы дубликат
+            if reminder_id is None:
+                await self.release_message(message)
+            if isinstance(e, CircuitOpenError):
+                await ack.edit_text(self.dependency_unavailable_text(e))
+            else:
+                await ack.edit_text(f"❌ Произошла ошибка: {str(e)}")
+            # Удаляем файл в случае ошибки
+            self.voice_storage.discard(voice_ogg)
+
+    async def handle_document(self, message: types.Message):
+        document = message.document
+        file_name = (document.file_name or '').lower()
+        if not (file_name.endswith('.ics') or document.mime_type == 'text/calendar'):
+            await message.answer("📎 Из файлов я понимаю только календари в формате .ics")
+            return
+        if document.file_size and document.file_size > ICS_MAX_BYTES:
+            await message.answer(f"❌ Файл слишком большой (максимум {ICS_MAX_BYTES // 1024} КБ)")
+            return
+        if not await self.claim_message(message):
+            return
+        
+        ack = await message.answer("⏳ Импортирую календарь…")
+        self.job_queue.submit(message.from_user.id, lambda: self.import_calendar(message, ack))
+
+    async def import_calendar(self, message: types.Message, ack: types.Message):
+        """Потоковый разбор .ics: события проверяются и сохраняются пачками по
+        ICS_IMPORT_CHUNK, каждая пачка - одна транзакция"""
+        fd, path = tempfile.mkstemp(suffix='.ics')
+        os.close(fd)
+        try:
+            file = await self.bot.get_file(message.document.file_id)
+            await self.bot.download_file(file.file_path, path)
+            
+            user_id = message.from_user.id
+            user_timezone = self.db.get_user_timezone(user_id)
+            now = datetime.utcnow().strftime('%Y-%m-%d %H:%M')
+            imported = past = invalid = over_limit = 0
+            
+            with open(path, encoding='utf-8', errors='replace') as f:
+                events = parse_events(f, user_timezone)
+                while True:
+                    # Разбираем файл в потоке, не больше одной пачки за раз
+                    chunk = await asyncio.to_thread(lambda: list(itertools.islice(events, ICS_IMPORT_CHUNK)))
+                    if not chunk:
+                        break
+                    
+                    valid = []
+                    for event in chunk:
+                        if isinstance(event, ICSError):
+                            invalid += 1
+                        elif event['datetime'] <= now:
+                            past += 1
+                        elif imported + len(valid) >= ICS_MAX_EVENTS:
+                            over_limit += 1
+                        else:
+                            valid.append(event)
+                    
+                    if valid:
+                        await self.notification_manager.schedule_events(user_id, valid, user_timezone)
+                        imported += len(valid)
             
+            text = f"📥 Импортировано напоминаний: {imported}"
+            if past:
+                text += f"\n⏭ Пропущено прошедших событий: {past}"
+            if invalid:
+                text += f"\n⚠️ Некорректных событий: {invalid}"
+            if over_limit:
+                text += f"\n✂️ Сверх лимита в {ICS_MAX_EVENTS} событий: {over_limit}"
+            await self.reply_result(message, ack, text)
+            
+        except Exception as e:
+            print(f"Ошибка при импорте календаря: {str(e)}")
+            await self.release_message(message)
+            await ack.edit_text(f"❌ Не удалось импортировать календарь: {str(e)}")
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def export_command(self, message: types.Message):
+        user_id = message.from_user.id
+        fd, path = tempfile.mkstemp(suffix='.ics')
+        os.close(fd)
+        
+        def write_calendar() -> int:
+            # Строки пишутся в файл по мере чтения из базы, без списка всех напоминаний
+            count = 0
+            def counted(rows):
+                nonlocal count
+                for row in rows:
+                    count += 1
+                    yield row
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(export_lines(counted(self.db.iter_user_reminders(user_id))))
+            return count
+        
+        try:
+            count = await asyncio.to_thread(write_calendar)
+            if not count:
+                await message.answer("У вас пока нет напоминаний.")
+                return
+            await message.answer_document(
+                types.FSInputFile(path, filename="reminders.ics"),
+                caption=f"📤 Напоминаний в календаре: {count}"
+            )
         except Exception as e:
-            await message.answer(f"❌ Произошла ошибка: {str(e)}")
-            # Удаляем файлы в случае ошибки
-            for file in [voice_ogg, voice_wav]:
-                if os.path.exists(file):
-                    os.remove(file)
+            await message.answer(f"❌ Не удалось выгрузить напоминания: {str(e)}")
+        finally:
+            os.remove(path)
 
     async def handle_text(self, message: types.Message, state: FSMContext):
         # Проверяем состояние через переданный state
@@ -541,16 +997,43 @@ class ReminderBot:
             print("handle_text: пропускаем обработку из-за состояния создания")
             return
         
+        # Модель недоступна, а локальный разбор не справится - отвечаем сразу,
+        # не занимая лимит и очередь задачей, которая заведомо не выполнится
+        breaker = self.event_extractor.breaker
+        if not breaker.is_available() and parse_event(
+                message.text, self.db.get_user_timezone(message.from_user.id)) is None:
+            await message.answer(self.dependency_unavailable_text(CircuitOpenError(breaker.name)))
+            return
+        
+        root = tracer.start_trace('text', user_id=message.from_user.id, text_length=len(message.text))
+        with tracer.activate(root):
+            if not await self.admit(message):
+                return
+            # Запрос к модели выполняем в фоне, чтобы он не задерживал команды и кнопки
+            with tracer.span('ack'):
+                ack = await message.answer("⏳ Обрабатываю сообщение…")
+        self.job_queue.submit(
+            message.from_user.id,
+            lambda: self.run_traced(root, lambda: self.process_text(message, state, ack))
+        )
+
+    async def process_text(self, message: types.Message, state: FSMContext, ack: types.Message):
+        """Извлечение событий из текста; результат заменяет текст сообщения-подтверждения ack"""
+        reminder_id = None
         try:
             # Получаем данные о событии
             user_timezone = self.db.get_user_timezone(message.from_user.id)
-            event_data = await self.event_extractor.extract_event_data(message.text, user_timezone)
+            events = await self.extract_events(message.text, user_timezone)
+            
+            # Несколько событий в одном сообщении - предлагаем создать их разом
+            if len(events) > 1:
+                await self.ask_events_confirmation(message, ack, state, events, user_timezone)
+                return
+            event_data = events[0]
             
-            # Создаем напоминание и планируем уведомления
-            reminder_id = self.db.save_reminder(
-                message.from_user.id,
-                event_data["description"],
-                event_data["datetime"]
+            # Напоминание и его уведомления сохраняются одной транзакцией до ответа
+            reminder_id, = await self.notification_manager.schedule_events(
+                message.from_user.id, [event_data], user_timezone
             )
             
             # Создаем клавиатуру с кнопкой отмены
@@ -568,24 +1051,111 @@ class ReminderBot:
                 f"Событие: {event_data['description']}\n"
                 f"Дата и время: {formatted_datetime}"
             )
-            await message.answer(text, reply_markup=keyboard)
-            
-            # Планируем уведомления с существующим reminder_id
-            self.notification_manager.schedule_notifications(
-                message.from_user.id,
-                event_data,
-                user_timezone,
-                reminder_id
-            )
+            await self.reply_result(message, ack, text, reply_markup=keyboard)
             
+        except CircuitOpenError as e:
+            await self.release_message(message)
+            await ack.edit_text(self.dependency_unavailable_text(e))
+        except Exception as e:
+            # Если напоминание уже сохранено, повторная доставка создала бы дубликат
+            if reminder_id is None:
+                await self.release_message(message)
+            await ack.edit_text(f"❌ Произошла ошибка: {str(e)}")
+
+    async def pending_events(self, state: FSMContext) -> dict:
+        """Неподтвержденные списки событий пользователя по id исходного сообщения"""
+        pending = (await state.get_data()).get('pending_events')
+        # Прежние версии хранили один список без ключа - он считается устаревшим
+        return dict(pending) if isinstance(pending, dict) else {}
+
+    async def ask_events_confirmation(self, message: types.Message, ack: types.Message, state: FSMContext,
+                                      events: list, user_timezone: str, recognized_text: str = None):
+        """Показывает все найденные в сообщении события и предлагает создать их одной кнопкой.
+        Списки хранятся по id исходного сообщения: подтверждение одного
+        сообщения не должно создать события из другого"""
+        pending = await self.pending_events(state)
+        pending[str(message.message_id)] = events
+        # Неподтвержденные старые списки не копим бесконечно
+        while len(pending) > self.PENDING_EVENTS_LIMIT:
+            pending.pop(next(iter(pending)))
+        await state.update_data(pending_events=pending)
+        
+        text = f"Я распознал: {recognized_text}\n\n" if recognized_text else ""
+        text += f"📋 Найдено событий: {len(events)}\n\n"
+        for number, event in enumerate(events, 1):
+            formatted_datetime = self.format_datetime(event['datetime'], user_timezone)
+            text += f"{number}. {event['description']}\n└ {formatted_datetime}\n"
+        text += "\nСоздать все напоминания?"
+        
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(
+                text="✅ Создать все",
+                callback_data=f"confirm_events_{message.message_id}"
+            )],
+            [types.InlineKeyboardButton(
+                text="❌ Отменить",
+                callback_data=f"discard_events_{message.message_id}"
+            )]
+        ])
+        await self.reply_result(message, ack, text, reply_markup=keyboard)
+
+    async def confirm_events(self, callback: types.CallbackQuery, state: FSMContext):
+        key = callback.data[len("confirm_events_"):]
+        pending = await self.pending_events(state)
+        # Кнопки без id сообщения остались от прежних версий бота
+        events = pending.pop(key, None) if key else None
+        if not events:
+            await callback.answer("Список событий устарел, отправьте сообщение еще раз")
+            return
+        # Снимаем список до создания, чтобы повторное нажатие не создало дубликаты
+        await state.update_data(pending_events=pending)
+        
+        user_id = callback.from_user.id
+        try:
+            user_timezone = self.db.get_user_timezone(user_id)
+            # Все напоминания и их уведомления создаются одной транзакцией
+            reminder_ids = await self.notification_manager.schedule_events(user_id, events, user_timezone)
         except Exception as e:
-            await message.answer(f"❌ Произошла ошибка: {str(e)}")
+            # Ничего не создано - возвращаем список, чтобы можно было нажать еще раз
+            pending = await self.pending_events(state)
+            pending[key] = events
+            await state.update_data(pending_events=pending)
+            await callback.answer(f"Ошибка при создании напоминаний: {str(e)}")
+            return
+        
+        text = f"✅ Создано напоминаний: {len(reminder_ids)}\n\n"
+        buttons = []
+        for number, (reminder_id, event) in enumerate(zip(reminder_ids, events), 1):
+            formatted_datetime = self.format_datetime(event['datetime'], user_timezone)
+            text += f"{number}. {event['description']}\n└ {formatted_datetime}\n"
+            buttons.append([types.InlineKeyboardButton(
+                text=f"❌ Отменить {number}",
+                callback_data=f"cancel_{reminder_id}"
+            )])
+        
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=buttons)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer("Напоминания созданы")
+
+    async def discard_events(self, callback: types.CallbackQuery, state: FSMContext):
+        pending = await self.pending_events(state)
+        pending.pop(callback.data[len("discard_events_"):], None)
+        await state.update_data(pending_events=pending)
+        await callback.message.edit_text(f"{callback.message.text}\n\n❌ Создание отменено")
+        await callback.answer()
+
+    def dependency_unavailable_text(self, error: CircuitOpenError) -> str:
+        """Быстрый ответ, когда автомат защиты внешнего сервиса разомкнут"""
+        return (
+            f"⚠️ {str(error)}\n\n"
+            "Вы можете создать напоминание вручную: /manual"
+        )
 
     async def cancel_reminder(self, callback_query: types.CallbackQuery):
         reminder_id = int(callback_query.data.split('_')[1])
         
         try:
-            self.db.delete_reminder(reminder_id)
+            await self.db.delete_reminder(reminder_id, user_id=callback_query.from_user.id)
             await callback_query.message.edit_text(
                 f"{callback_query.message.text}\n\n❌ Напоминание отменено!"
             )
@@ -598,7 +1168,9 @@ class ReminderBot:
         try:
             offset = int(timezone_str[3:])
             timezone_name = f"Etc/GMT{'-' if offset > 0 else '+'}{abs(offset)}"
-            self.db.set_user_timezone(callback.from_user.id, timezone_name)
+            await self.db.set_user_timezone(callback.from_user.id, timezone_name)
+            # Готовые тексты уведомлений содержат местное время - обновляем их
+            await self.notification_manager.rerender_notifications(callback.from_user.id, timezone_name)
             
             text = f"⚙️ Настройки\n\n🌍 Часовой пояс: {timezone_str}"
             keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
@@ -699,11 +1271,9 @@ class ReminderBot:
                 "datetime": utc_dt.strftime('%Y-%m-%d %H:%M')
             }
             
-            # Создаем напоминание
-            reminder_id = self.db.save_reminder(
-                message.from_user.id,
-                event_data["description"],
-                event_data["datetime"]
+            # Создаем напоминание вместе с уведомлениями одной транзакцией
+            reminder_id, = await self.notification_manager.schedule_events(
+                message.from_user.id, [event_data], user_timezone
             )
             
             # Создаем клавиатуру с кнопкой отмены
@@ -723,14 +1293,6 @@ class ReminderBot:
             )
             await message.answer(text, reply_markup=keyboard)
             
-            # Планируем уведомления
-            self.notification_manager.schedule_notifications(
-                message.from_user.id,
-                event_data,
-                user_timezone,
-                reminder_id
-            )
-            
             # Очищаем состояни
             await state.clear()
             
@@ -758,21 +1320,212 @@ class ReminderBot:
         else:
             await callback.answer("Нет активного процесса создания напоминания.")
 
+    async def manage_reminder(self, callback: types.CallbackQuery):
+        reminder_id = int(callback.data.split('_')[1])
+        user_id = callback.from_user.id
+        
+        reminder = self.db.get_reminder(reminder_id, user_id)
+        if reminder is None:
+            await callback.answer("Напоминание не найдено")
+            return
+        
+        user_timezone = self.db.get_user_timezone(user_id)
+        text = (
+            f"🎯 {reminder[1]}\n"
+            f"📅 {self.format_datetime(reminder[2], user_timezone)}\n\n"
+            "Отложите напоминание или укажите новое время:"
+        )
+        await callback.message.answer(
+            text,
+            reply_markup=self.notification_manager.actions_keyboard(reminder_id)
+        )
+        await callback.answer()
+
+    async def snooze_reminder(self, callback: types.CallbackQuery):
+        _, reminder_id, code = callback.data.split('_')
+        reminder_id = int(reminder_id)
+        user_id = callback.from_user.id
+        
+        try:
+            reminder = self.db.get_reminder(reminder_id, user_id)
+            if reminder is None or code not in self.notification_manager.SNOOZE_OPTIONS:
+                await callback.answer("Напоминание уже удалено")
+                return
+            
+            user_timezone = self.db.get_user_timezone(user_id)
+            new_datetime = self.notification_manager.snooze_datetime(reminder[2], code)
+            event = await self.notification_manager.reschedule(
+                user_id, reminder_id, new_datetime, user_timezone
+            )
+            if event is None:
+                await callback.answer("Напоминание уже удалено")
+                return
+            
+            formatted_datetime = self.format_datetime(event['datetime'], user_timezone)
+            await callback.message.answer(
+                f"⏰ Напоминание «{event['description']}» перенесено на {formatted_datetime}",
+                reply_markup=self.notification_manager.actions_keyboard(reminder_id)
+            )
+            await callback.answer("Напоминание отложено")
+        except Exception as e:
+            await callback.answer(f"Ошибка при переносе напоминания: {str(e)}")
+
+    async def edit_reminder_time(self, callback: types.CallbackQuery, state: FSMContext):
+        reminder_id = int(callback.data.split('_')[1])
+        
+        if self.db.get_reminder(reminder_id, callback.from_user.id) is None:
+            await callback.answer("Напоминание уже удалено")
+            return
+        
+        await state.set_state(EditReminderStates.waiting_for_datetime)
+        await state.update_data(edit_reminder_id=reminder_id)
+        
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(
+                text="❌ Отменить",
+                callback_data="abort_edit"
+            )]
+        ])
+        await callback.message.answer(
+            "📅 Введите новую дату и время в формате 'ДД.ММ.ГГГГ ЧЧ:ММ'\n"
+            "Например: '25.11.2024 15:30'",
+            reply_markup=keyboard
+        )
+        await callback.answer()
+
+    async def abort_edit(self, callback: types.CallbackQuery, state: FSMContext):
+        if await state.get_state() == EditReminderStates.waiting_for_datetime.state:
+            await state.clear()
+        await callback.message.edit_text("❌ Изменение времени отменено.")
+        await callback.answer()
+
+    async def process_edit_datetime(self, message: types.Message, state: FSMContext):
+        user_id = message.from_user.id
+        data = await state.get_data()
+        reminder_id = data.get('edit_reminder_id')
+        
+        try:
+            dt = datetime.strptime(message.text.strip(), '%d.%m.%Y %H:%M')
+        except ValueError:
+            await message.answer(
+                "❌ Неверный формат даты и времени.\n"
+                "Используйте формат ДД.ММ.ГГГГ ЧЧ:ММ\n"
+                "Например: 25.11.2024 15:30"
+            )
+            return
+        
+        user_timezone = self.db.get_user_timezone(user_id)
+        local_dt = pytz.timezone(user_timezone).localize(dt)
+        if local_dt < datetime.now(pytz.UTC):
+            await message.answer(
+                "❌ Нельзя перенести напоминание на прошедшее время.\n"
+                "Пожалуйста, введите будущую дату и время."
+            )
+            return
+        
+        try:
+            event = await self.notification_manager.reschedule(
+                user_id,
+                reminder_id,
+                local_dt.astimezone(pytz.UTC).strftime('%Y-%m-%d %H:%M'),
+                user_timezone
+            )
+            await state.clear()
+            if event is None:
+                await message.answer("❌ Напоминание уже удалено.")
+                return
+            
+            formatted_datetime = self.format_datetime(event['datetime'], user_timezone)
+            await message.answer(
+                f"✅ Напоминание «{event['description']}» перенесено на {formatted_datetime}",
+                reply_markup=self.notification_manager.actions_keyboard(reminder_id)
+            )
+        except Exception as e:
+            await message.answer(f"❌ Ошибка при переносе напоминания: {str(e)}")
+
     async def run(self):
+        probe_tasks = []
+        metrics_server = MetricsServer(ready_check=self.readiness)
         try:
-            # Инициализируем планировщик уведомлений
-            await self.notification_manager.init_scheduler()
+            # Сторож запускается первым, чтобы видеть и зависания при старте
+            self.watchdog.start()
+            if LIVENESS_PORT:
+                try:
+                    self.watchdog.serve_liveness(METRICS_HOST, LIVENESS_PORT, self.liveness)
+                except OSError as e:
+                    print(f"❌ Не удалось запустить проверку живости на {METRICS_HOST}:{LIVENESS_PORT}: {e}")
+            if METRICS_PORT:
+                # Без метрик бот работает, поэтому занятый порт не мешает запуску
+                try:
+                    await metrics_server.start(METRICS_HOST, METRICS_PORT)
+                except OSError as e:
+                    print(f"❌ Не удалось запустить сервер метрик на {METRICS_HOST}:{METRICS_PORT}: {e}")
+                    await metrics_server.stop()
+            
+            # Все изменения базы идут через одного писателя с групповой фиксацией
+            self.db.start_writer(
+                window=DB_GROUP_COMMIT_WINDOW_MS / 1000,
+                max_batch=DB_GROUP_COMMIT_MAX_BATCH
+            )
+            
+            # Инициализируем планировщик уведомлений - только в одном процессе
+            if SCHEDULER_ENABLED:
+                await self.notification_manager.init_scheduler()
+            else:
+                print("ℹ️ Планировщик уведомлений отключен (SCHEDULER_ENABLED=0)")
+            
+            # Фоновые проверки, которые замыкают автоматы после восстановления сервисов
+            probe_tasks = [
+                asyncio.create_task(breaker.run_probes())
+                for breaker in (self.speech_recognizer.breaker, self.event_extractor.breaker)
+            ]
+            # Очистка голосовых сообщений по сроку хранения и квоте
+            if SCHEDULER_ENABLED:
+                probe_tasks.append(asyncio.create_task(self.voice_storage.run_sweeper()))
+            # Контроль перегрузки
+            probe_tasks.append(asyncio.create_task(self.load_shedder.run()))
+            
+            self.job_queue.start()
             
             # Запускаем бота
-            await self.dp.start_polling(self.bot)
+            if BOT_MODE == 'webhook':
+                await self.run_webhook()
+            else:
+                await self.dp.start_polling(self.bot)
             
         except Exception as e:
             print(f"Ошибка при запуске бота: {e}")
-            if self.notification_manager.scheduler:
-                self.notification_manager.scheduler.shutdown()
         finally:
+            # Сначала останавливаем все, что пишет в базу, затем писателя
+            for task in probe_tasks:
+                task.cancel()
+            await asyncio.gather(*probe_tasks, return_exceptions=True)
+            await self.notification_manager.shutdown()
+            await metrics_server.stop()
+            await self.watchdog.stop()
+            await self.job_queue.stop()
+            # Трассы завершаются в задачах очереди - дописываем их после ее остановки
+            await asyncio.to_thread(tracer.close)
+            await self.dp.storage.close()
+            await self.db.stop_writer()
             await self.bot.session.close()
 
+    async def run_webhook(self):
+        """Прием обновлений через вебхук вместо long polling"""
+        server = WebhookServer(
+            self.dp,
+            self.bot,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_concurrency=WEBHOOK_MAX_CONCURRENCY
+        )
+        await server.start(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL)
+        try:
+            # Работаем, пока процесс не остановят
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
 if __name__ == "__main__":
     bot = ReminderBot()
     try:
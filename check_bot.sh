@@ -1,6 +1,28 @@
 #!/bin/bash
+# Перезапуск бота, если процесс пропал или его цикл событий завис
+# (зависший процесс pgrep находит, а /health/live - нет)
+BOT_DIR=/home/botuser/ваш-репозиторий
+LOG="$BOT_DIR/restart.log"
+
 if ! pgrep -f "python bot.py" > /dev/null
 then
     sudo supervisorctl restart tgbot
-    echo "Bot restarted at $(date)" >> /home/botuser/ваш-репозиторий/restart.log
-fi 
\ No newline at end of file
+    echo "Bot restarted at $(date)" >> "$LOG"
+    exit 0
+fi
+
+# Порт берем из той же конфигурации, что и бот (instance/.env); 0 - проверка
+# живости выключена. Ее отвечает поток сторожа, а не цикл событий, поэтому
+# зависший цикл дает 503, а не таймаут
+read -r HOST PORT <<< "$(cd "$BOT_DIR" && .venv/bin/python -c \
+    'from config import METRICS_HOST, LIVENESS_PORT; print(METRICS_HOST, LIVENESS_PORT)' 2>/dev/null)"
+if [ -n "$PORT" ] && [ "$PORT" != "0" ]
+then
+    [ "$HOST" = "0.0.0.0" ] && HOST=127.0.0.1
+    HEALTH_URL="http://$HOST:$PORT/health/live"
+    if ! curl -fsS -m 10 --retry 2 "$HEALTH_URL" > /dev/null 2>&1
+    then
+        sudo supervisorctl restart tgbot
+        echo "Bot restarted at $(date): $HEALTH_URL not responding" >> "$LOG"
+    fi
+fi
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_SUCCESS_THRESHOLD, CIRCUIT_PROBE_INTERVAL,
+    CIRCUIT_HALF_OPEN_TIMEOUT,
+    REQUEST_DEADLINE_PERCENTILE, REQUEST_DEADLINE_MULTIPLIER,
+    REQUEST_MIN_DEADLINE, REQUEST_MAX_DEADLINE
+)
+
+logger = logging.getLogger('CircuitBreaker')
+
+
+class CircuitOpenError(Exception):
+    """Зависимость временно недоступна: автомат разомкнут"""
+
+    def __init__(self, name: str, message: str = None):
+        self.name = name
+        super().__init__(message or f"Сервис {name} временно недоступен. Пожалуйста, попробуйте позже.")
+
+
+class CircuitBreaker:
+    """Автомат защиты внешней зависимости (closed / open / half-open)
+    с дедлайном, вычисляемым по перцентилю недавних задержек.
+
+    Задержки учитываются в расчете на единицу размера запроса (например,
+    на отрезок аудио), поэтому дедлайн большого запроса пропорционально
+    больше; min_deadline и max_deadline задаются для запроса единичного размера.
+
+    Пробный запрос в полуоткрытом состоянии занимает слот не дольше
+    half_open_timeout секунд: если вызывающий код так и не отметил результат,
+    слот отдается следующему запросу"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, success_threshold: int = 2,
+                 probe_interval: float = 15.0, half_open_timeout: float = 120.0,
+                 latency_window: int = 50,
+                 deadline_percentile: float = 0.95, deadline_multiplier: float = 2.0,
+                 min_deadline: float = 3.0, max_deadline: float = 30.0,
+                 min_samples: int = 5):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.success_threshold = success_threshold
+        self.probe_interval = probe_interval
+        self.half_open_timeout = half_open_timeout
+        self.deadline_percentile = deadline_percentile
+        self.deadline_multiplier = deadline_multiplier
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.min_samples = min_samples
+
+        self.state = self.CLOSED
+        self.opened_at = None
+        self._failures = 0
+        self._half_open_successes = 0
+        self._half_open_in_flight = False
+        self._half_open_taken_at = None
+        self._latencies = deque(maxlen=latency_window)
+        # Вызовы идут и из цикла событий, и из потоков (asyncio.to_thread)
+        self._lock = threading.Lock()
+        self._probe = None
+
+    def set_probe(self, probe):
+        """Задает функцию проверки доступности зависимости (синхронную, возвращает bool)"""
+        self._probe = probe
+
+    def deadline(self, size: float = 1.0) -> float:
+        """Таймаут запроса размера size на основе перцентиля недавних задержек"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.max_deadline * size
+        index = min(len(samples) - 1, int(len(samples) * self.deadline_percentile))
+        deadline = samples[index] * self.deadline_multiplier
+        return max(self.min_deadline, min(self.max_deadline, deadline)) * size
+
+    def before_call(self):
+        """Проверяет, можно ли выполнить запрос; иначе сразу бросает CircuitOpenError"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN:
+                now = time.monotonic()
+                if (self._half_open_in_flight
+                        and now - self._half_open_taken_at > self.half_open_timeout):
+                    logger.warning(f"Автомат {self.name}: пробный запрос не завершился "
+                                   f"за {self.half_open_timeout:.0f} с, слот освобожден")
+                    self._half_open_in_flight = False
+                if not self._half_open_in_flight:
+                    # В полуоткрытом состоянии пропускаем по одному пробному запросу
+                    self._half_open_in_flight = True
+                    self._half_open_taken_at = now
+                    return
+        raise CircuitOpenError(self.name)
+
+    def record_success(self, latency: float, size: float = 1.0):
+        with self._lock:
+            self._latencies.append(latency / size)
+            self._failures = 0
+            if self.state == self.HALF_OPEN:
+                self._half_open_in_flight = False
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.success_threshold:
+                    self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN:
+                self._half_open_in_flight = False
+                self._set_state(self.OPEN)
+            elif self.state == self.CLOSED and self._failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+
+    def release(self):
+        """Запрос завершился без вывода о состоянии зависимости (например, она
+        занята подготовкой): счетчики не меняются, пробный слот освобождается"""
+        with self._lock:
+            self._half_open_in_flight = False
+
+    def is_available(self) -> bool:
+        """Быстрая проверка без захвата пробного запроса"""
+        return self.state != self.OPEN
+
+    def _set_state(self, state: str):
+        # Вызывается под self._lock
+        if state == self.state:
+            return
+        logger.warning(f"Автомат {self.name}: {self.state} -> {state}")
+        self.state = state
+        self._half_open_successes = 0
+        self._half_open_in_flight = False
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+        elif state == self.CLOSED:
+            self._failures = 0
+            self.opened_at = None
+
+    async def run_probes(self):
+        """Фоновая проверка: пока автомат разомкнут, периодически опрашивает
+        зависимость и переводит автомат в half-open после успешной проверки"""
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            if self.state != self.OPEN or self._probe is None:
+                continue
+            try:
+                healthy = await asyncio.to_thread(self._probe)
+            except Exception as e:
+                logger.info(f"Проверка {self.name} не прошла: {str(e)}")
+                healthy = False
+            if healthy:
+                with self._lock:
+                    if self.state == self.OPEN:
+                        self._set_state(self.HALF_OPEN)
+
+
+def create_breaker(name: str) -> CircuitBreaker:
+    """Создает автомат с параметрами из конфигурации"""
+    return CircuitBreaker(
+        name,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        success_threshold=CIRCUIT_SUCCESS_THRESHOLD,
+        probe_interval=CIRCUIT_PROBE_INTERVAL,
+        half_open_timeout=CIRCUIT_HALF_OPEN_TIMEOUT,
+        deadline_percentile=REQUEST_DEADLINE_PERCENTILE,
+        deadline_multiplier=REQUEST_DEADLINE_MULTIPLIER,
+        min_deadline=REQUEST_MIN_DEADLINE,
+        max_deadline=REQUEST_MAX_DEADLINE
+    )
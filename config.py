@@ -18,4 +18,147 @@ load_dotenv(ENV_PATH)
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 HUGGING_FACE_TOKEN = os.getenv('HUGGING_FACE_TOKEN')
-MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
\ No newline at end of file
+MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
+
+# Автоматы защиты внешних зависимостей (Hugging Face, Mistral)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3'))
+CIRCUIT_SUCCESS_THRESHOLD = int(os.getenv('CIRCUIT_SUCCESS_THRESHOLD', '1'))
+CIRCUIT_PROBE_INTERVAL = float(os.getenv('CIRCUIT_PROBE_INTERVAL', '15'))
+# Сколько секунд пробный запрос полуоткрытого автомата может держать слот
+CIRCUIT_HALF_OPEN_TIMEOUT = float(os.getenv('CIRCUIT_HALF_OPEN_TIMEOUT', '120'))
+# Дедлайн запроса: перцентиль недавних задержек * множитель, в пределах [MIN, MAX] секунд
+REQUEST_DEADLINE_PERCENTILE = float(os.getenv('REQUEST_DEADLINE_PERCENTILE', '0.95'))
+REQUEST_DEADLINE_MULTIPLIER = float(os.getenv('REQUEST_DEADLINE_MULTIPLIER', '2'))
+REQUEST_MIN_DEADLINE = float(os.getenv('REQUEST_MIN_DEADLINE', '3'))
+REQUEST_MAX_DEADLINE = float(os.getenv('REQUEST_MAX_DEADLINE', '30'))
+
+# Микропакетирование запросов к модели извлечения событий (выключено по умолчанию)
+EXTRACTION_BATCHING = os.getenv('EXTRACTION_BATCHING', '0') == '1'
+EXTRACTION_BATCH_DELAY_MS = int(os.getenv('EXTRACTION_BATCH_DELAY_MS', '20'))
+EXTRACTION_BATCH_SIZE = int(os.getenv('EXTRACTION_BATCH_SIZE', '8'))
+
+# Количество воркеров для тяжелых задач (голос, запросы к модели)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+
+# Способ получения обновлений: 'polling' (по умолчанию) или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Публичный адрес для регистрации вебхука в Telegram (можно не задавать, если регистрирует балансировщик)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', '32'))
+# Несколько процессов за балансировщиком: рассылку уведомлений и обслуживание базы
+# (досылка пропущенных, архив, очистка, голосовые файлы) выполняет только процесс
+# с SCHEDULER_ENABLED=1, иначе каждое уведомление уйдет столько раз, сколько процессов.
+# Состояние каждого процесса свое: очередь тяжелых задач, ограничение частоты
+# (лимиты действуют на процесс), уровень деградации и автоматы защиты сервисов
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+
+# Хранилище состояний диалогов: 'sqlite' (переживает перезапуск) или 'memory'
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+# Брошенные диалоги удаляются через FSM_STATE_TTL секунд
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))
+# 0 - каждое изменение состояния записывается сразу и видно всем процессам;
+# больше 0 - изменения копятся столько секунд и до записи видны только своему
+# процессу (подходит, если бот работает в одном процессе)
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0'))
+
+# Количество шардов базы: пользователи распределяются по файлам по хешу user_id.
+# Для перехода с одного файла используйте migrate_shards.py
+DATABASE_SHARDS = int(os.getenv('DATABASE_SHARDS', '1'))
+
+# Групповая фиксация: изменения, пришедшие за окно, записываются одной транзакцией
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv('DB_GROUP_COMMIT_WINDOW_MS', '5'))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', '100'))
+
+# Уведомления, пропущенные пока бот не работал или был перегружен:
+# 'late' - отправить с пометкой, 'summary' - одна сводка на пользователя,
+# 'drop' - промежуточные напоминания удалить, основные отправить с пометкой
+MISSED_NOTIFICATION_POLICY = os.getenv('MISSED_NOTIFICATION_POLICY', 'late')
+CATCHUP_BATCH_SIZE = int(os.getenv('CATCHUP_BATCH_SIZE', '100'))
+# Задержка проверки сверх интервала (в секундах), после которой запускается досылка
+CATCHUP_STALL_THRESHOLD = float(os.getenv('CATCHUP_STALL_THRESHOLD', '30'))
+
+# Бюджет отправки уведомлений (сообщений в секунду): пики в популярные минуты
+# растягиваются по времени вместо пачки одновременных запросов к Telegram
+NOTIFICATION_SEND_RATE = float(os.getenv('NOTIFICATION_SEND_RATE', '25'))
+
+# Количество напоминаний на странице /list
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '5'))
+
+# Импорт календарей .ics: максимальный размер файла, число событий и размер пачки вставки
+ICS_MAX_BYTES = int(os.getenv('ICS_MAX_BYTES', str(2 * 1024 * 1024)))
+ICS_MAX_EVENTS = int(os.getenv('ICS_MAX_EVENTS', '1000'))
+ICS_IMPORT_CHUNK = int(os.getenv('ICS_IMPORT_CHUNK', '200'))
+
+# Хранение голосовых сообщений: каталог, срок хранения OGG и квота на пользователя.
+# WAV удаляется сразу после распознавания, расшифровка в базе хранится всегда
+VOICE_DIR = os.getenv('VOICE_DIR', 'voice_messages')
+VOICE_RETENTION_DAYS = float(os.getenv('VOICE_RETENTION_DAYS', '30'))
+VOICE_USER_QUOTA_MB = float(os.getenv('VOICE_USER_QUOTA_MB', '50'))
+VOICE_SWEEP_INTERVAL = float(os.getenv('VOICE_SWEEP_INTERVAL', '3600'))
+
+
+# Обслуживание базы: завершенные напоминания переносятся в архив пачками,
+# свободные страницы возвращаются системе в тихие периоды, статистика
+# планировщика запросов полностью пересчитывается раз в сутки в DB_ANALYZE_HOUR (UTC)
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+DB_VACUUM_INTERVAL = int(os.getenv('DB_VACUUM_INTERVAL', '900'))
+DB_VACUUM_PAGES = int(os.getenv('DB_VACUUM_PAGES', '1000'))
+DB_ANALYZE_HOUR = int(os.getenv('DB_ANALYZE_HOUR', '4'))
+
+# Повторная доставка обновлений: ответ на сообщение хранится IDEMPOTENCY_TTL часов
+# (Telegram хранит недоставленные обновления сутки); незавершенная обработка
+# считается оборвавшейся через IDEMPOTENCY_PENDING_TIMEOUT секунд
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '48'))
+IDEMPOTENCY_PENDING_TIMEOUT = float(os.getenv('IDEMPOTENCY_PENDING_TIMEOUT', '600'))
+
+# Ограничение частоты тяжелых запросов (распознавание речи и LLM) в запросах в минуту
+# и допустимый всплеск: на пользователя и на всех. Голосовое сообщение стоит
+# RATE_LIMIT_VOICE_COST запросов (распознавание + извлечение), текст - один
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv('RATE_LIMIT_USER_PER_MINUTE', '6'))
+RATE_LIMIT_USER_BURST = float(os.getenv('RATE_LIMIT_USER_BURST', '4'))
+RATE_LIMIT_GLOBAL_PER_MINUTE = float(os.getenv('RATE_LIMIT_GLOBAL_PER_MINUTE', '120'))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv('RATE_LIMIT_GLOBAL_BURST', '30'))
+RATE_LIMIT_VOICE_COST = float(os.getenv('RATE_LIMIT_VOICE_COST', '2'))
+
+# Деградация при перегрузке: пороги глубины очереди тяжелых задач и задержки
+# цикла событий (в секундах) для уровней 1-4: локальный разбор времени,
+# отказ от длинных голосовых, уменьшенный max_tokens, отказ от новых задач.
+# Возврат на уровень ниже - после OVERLOAD_COOLDOWN секунд без перегрузки
+OVERLOAD_QUEUE_THRESHOLDS = tuple(int(value) for value in os.getenv('OVERLOAD_QUEUE_THRESHOLDS', '8,16,32,64').split(','))
+OVERLOAD_LAG_THRESHOLDS = tuple(float(value) for value in os.getenv('OVERLOAD_LAG_THRESHOLDS', '0.2,0.5,1,2').split(','))
+OVERLOAD_COOLDOWN = float(os.getenv('OVERLOAD_COOLDOWN', '30'))
+OVERLOAD_VOICE_MAX_SECONDS = int(os.getenv('OVERLOAD_VOICE_MAX_SECONDS', '30'))
+OVERLOAD_MAX_TOKENS = int(os.getenv('OVERLOAD_MAX_TOKENS', '200'))
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics.
+# По умолчанию (0) сервер не запускается; порт выбирайте свободный
+# (9100 обычно занят node_exporter)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Трассировка обработки голосовых и текстовых сообщений: в TRACE_SINK пишется
+# доля TRACE_SAMPLE_RATE трасс, трассы дольше TRACE_SLOW_THRESHOLD секунд
+# пишутся всегда и дополнительно попадают в TRACE_SLOW_LOG
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', '1') == '1'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '5'))
+TRACE_SINK = os.getenv('TRACE_SINK', os.path.join(INSTANCE_PATH, 'logs', 'traces.jsonl'))
+TRACE_SLOW_LOG = os.getenv('TRACE_SLOW_LOG', os.path.join(INSTANCE_PATH, 'logs', 'slow_traces.jsonl'))
+# Файл трасс, достигший TRACE_MAX_MB мегабайт, переименовывается в .1 (.2, ...);
+# хранится TRACE_BACKUPS (не меньше 1) старых файлов, более старые удаляются
+TRACE_MAX_MB = float(os.getenv('TRACE_MAX_MB', '50'))
+TRACE_BACKUPS = int(os.getenv('TRACE_BACKUPS', '2'))
+
+# Сторож цикла событий: если цикл не отвечает дольше WATCHDOG_STALL_THRESHOLD секунд,
+# в лог пишется стек блокирующего вызова. http://METRICS_HOST:LIVENESS_PORT/health/live
+# отвечает из отдельного потока и возвращает 503 (check_bot.sh перезапускает бота),
+# только если цикл не отвечает дольше WATCHDOG_LIVENESS_TIMEOUT секунд - короткие
+# задержки загруженного, но работающего бота перезапуска не стоят. 0 - не запускать
+WATCHDOG_STALL_THRESHOLD = float(os.getenv('WATCHDOG_STALL_THRESHOLD', '1'))
+WATCHDOG_INTERVAL = float(os.getenv('WATCHDOG_INTERVAL', '0.1'))
+WATCHDOG_LIVENESS_TIMEOUT = float(os.getenv('WATCHDOG_LIVENESS_TIMEOUT', '60'))
+LIVENESS_PORT = int(os.getenv('LIVENESS_PORT', '0'))
\ No newline at end of file
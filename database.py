@@ -1,23 +1,156 @@
+import asyncio
+import functools
+import inspect
+import os
 import sqlite3
-from datetime import datetime
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from db_writer import DatabaseWriter
+from metrics import Histogram
+from tracing import tracer
+
+DB_QUERY_SECONDS = Histogram('reminderbot_db_query_seconds', 'Длительность операций с базой (метка method)')
 
 class Database:
-    def __init__(self, db_path):
+    def __init__(self, db_path, shards: int = 1):
         self.db_path = db_path
-        self._create_tables()
+        self.shards = shards
+        self.writer = None
+        # Идентификатор запуска: незавершенные обработки сообщений прошлых запусков
+        # оборвались вместе с процессом, и их можно начинать заново
+        self.boot_id = uuid.uuid4().hex
+        if shards > 1:
+            # Пользователи распределяются по файлам reminders.shard0.db, reminders.shard1.db, ...
+            base, ext = os.path.splitext(db_path)
+            self.shard_paths = [f"{base}.shard{index}{ext}" for index in range(shards)]
+        else:
+            self.shard_paths = [db_path]
+        # Пул для параллельных запросов ко всем шардам
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shard_paths))
+        for shard_path in self.shard_paths:
+            self._create_tables(shard_path)
+    
+    def shard_index(self, user_id: int) -> int:
+        """Номер шарда пользователя (стабильный хеш user_id)"""
+        return zlib.crc32(str(user_id).encode()) % len(self.shard_paths)
+    
+    def _shard_path(self, user_id: int = None) -> str:
+        """Файл шарда пользователя; без user_id - только для нешардированной базы"""
+        if user_id is None:
+            if len(self.shard_paths) > 1:
+                raise ValueError("Для шардированной базы необходимо указать user_id")
+            return self.shard_paths[0]
+        return self.shard_paths[self.shard_index(user_id)]
+    
+    def _connect(self, user_id: int = None):
+        return sqlite3.connect(self._shard_path(user_id))
+    
+    def start_writer(self, window: float = 0.005, max_batch: int = 100):
+        """Запускает единственного писателя с групповой фиксацией изменений"""
+        if self.writer is None:
+            self.writer = DatabaseWriter(window=window, max_batch=max_batch)
+            self.writer.start()
+    
+    async def stop_writer(self):
+        if self.writer is not None:
+            await self.writer.stop()
+            self.writer = None
+    
+    async def _write_all_shards(self, fn) -> list:
+        """Выполняет изменение fn(conn) на каждом шарде; возвращает результаты по шардам"""
+        if self.writer is None:
+            results = []
+            for shard_path in self.shard_paths:
+                with sqlite3.connect(shard_path) as conn:
+                    results.append(fn(conn))
+            return results
+        return await asyncio.gather(*[
+            self.writer.submit(shard_path, fn) for shard_path in self.shard_paths
+        ])
+    
+    async def _write(self, user_id: int, fn):
+        """Выполняет изменение fn(conn): через писателя, если он запущен,
+        иначе напрямую отдельной транзакцией. fn не должна вызывать commit"""
+        if self.writer is None:
+            with self._connect(user_id) as conn:
+                return fn(conn)
+        return await self.writer.submit(self._shard_path(user_id), fn)
+    
+    def _query_all_shards(self, query: str, params: tuple = ()) -> list:
+        """Выполняет запрос на всех шардах параллельно и объединяет результаты"""
+        def run(shard_path):
+            with sqlite3.connect(shard_path) as conn:
+                return conn.execute(query, params).fetchall()
+        
+        results = []
+        for rows in self._executor.map(run, self.shard_paths):
+            results.extend(rows)
+        return results
+    
+    def _enable_incremental_vacuum(self, shard_path: str):
+        """Включает auto_vacuum=INCREMENTAL: освободившиеся страницы можно возвращать
+        системе понемногу (incremental_vacuum) вместо полного VACUUM. Для новой базы
+        достаточно прагмы до создания таблиц, существующую один раз перестраиваем"""
+        conn = sqlite3.connect(shard_path, isolation_level=None)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+                print(f"🧹 Перестраиваем {shard_path} для инкрементальной очистки (однократно)")
+                conn.execute("VACUUM")
+        finally:
+            conn.close()
     
-    def _create_tables(self):
-        with sqlite3.connect(self.db_path) as conn:
+    def _create_tables(self, shard_path: str):
+        self._enable_incremental_vacuum(shard_path)
+        with sqlite3.connect(shard_path) as conn:
             cursor = conn.cursor()
+            # AUTOINCREMENT: ID удаленных и архивированных напоминаний не переиспользуются,
+            # иначе кнопки старых уведомлений и UID экспорта указывали бы на новые события
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS reminders (
-                    id INTEGER PRIMARY KEY,
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     description TEXT NOT NULL,
                     event_datetime TEXT NOT NULL,
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Завершенные напоминания переносятся сюда из горячей таблицы reminders.
+            # У архива свой ключ: reminder_id - ID исходного напоминания
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(reminders_archive)")]
+            if columns and 'reminder_id' not in columns:
+                # Архив в старом формате (ключ - ID напоминания) переносим в новую таблицу
+                cursor.execute("ALTER TABLE reminders_archive RENAME TO reminders_archive_old")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reminders_archive (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    reminder_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    description TEXT NOT NULL,
+                    event_datetime TEXT NOT NULL,
+                    created_at TEXT,
+                    archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            if columns and 'reminder_id' not in columns:
+                cursor.execute("""
+                    INSERT INTO reminders_archive
+                    (reminder_id, user_id, description, event_datetime, created_at, archived_at)
+                    SELECT id, user_id, description, event_datetime, created_at, archived_at
+                    FROM reminders_archive_old ORDER BY id
+                """)
+                cursor.execute("DROP TABLE reminders_archive_old")
+                conn.commit()
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_reminders_archive_user_event
+                ON reminders_archive (user_id, event_datetime)
+            """)
+            self._migrate_reminders_autoincrement(conn)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS user_settings (
                     user_id INTEGER PRIMARY KEY,
@@ -38,6 +171,27 @@ class Database:
                     FOREIGN KEY (reminder_id) REFERENCES reminders (id)
                 )
             """)
+            # Готовый текст уведомления, подготовленный при планировании
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(notifications)")]
+            if 'message_text' not in columns:
+                cursor.execute("ALTER TABLE notifications ADD COLUMN message_text TEXT")
+            if 'parse_mode' not in columns:
+                cursor.execute("ALTER TABLE notifications ADD COLUMN parse_mode TEXT")
+            # Постраничный список напоминаний пользователя в порядке (event_datetime, id)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_reminders_user_event
+                ON reminders (user_id, event_datetime, id)
+            """)
+            # Уведомления напоминания: удаление, перенос, поиск завершенных напоминаний
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_notifications_reminder
+                ON notifications (reminder_id)
+            """)
+            # Поиск неотправленных уведомлений по времени (в т.ч. просроченных)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_notifications_pending
+                ON notifications (is_sent, notify_datetime)
+            """)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS voice_messages (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -49,10 +203,113 @@ class Database:
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Размер хранимого OGG для учета места; 0 - файл удален или размер неизвестен
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(voice_messages)")]
+            if 'file_size' not in columns:
+                cursor.execute("ALTER TABLE voice_messages ADD COLUMN file_size INTEGER NOT NULL DEFAULT 0")
+            # Очистка по сроку хранения и по квоте пользователя (от старых к новым)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_voice_messages_created_at
+                ON voice_messages (created_at)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_voice_messages_user_created_at
+                ON voice_messages (user_id, created_at)
+            """)
+            # Принятые в обработку сообщения и ответы на них: повторная доставка
+            # того же сообщения после перезапуска не создает дубликатов
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS processed_messages (
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    result_text TEXT,
+                    reply_markup TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (chat_id, message_id)
+                ) WITHOUT ROWID
+            """)
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(processed_messages)")]
+            if 'boot_id' not in columns:
+                cursor.execute("ALTER TABLE processed_messages ADD COLUMN boot_id TEXT")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_processed_messages_created_at
+                ON processed_messages (created_at)
+            """)
+            self._create_search_index(cursor)
             conn.commit()
     
-    def save_reminder(self, user_id: int, description: str, event_datetime: str):
-        with sqlite3.connect(self.db_path) as conn:
+    def _migrate_reminders_autoincrement(self, conn):
+        """Перестраивает таблицу reminders, созданную без AUTOINCREMENT (однократно).
+        ID сохраняются; счетчик начинается после наибольшего ID, в том числе
+        уже ушедшего в архив"""
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'reminders'").fetchone()[0]
+        if 'AUTOINCREMENT' in sql.upper():
+            return
+        print("🔧 Перестраиваем таблицу reminders: ID напоминаний больше не переиспользуются")
+        conn.commit()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute("""
+            CREATE TABLE reminders_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                description TEXT NOT NULL,
+                event_datetime TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO reminders_new (id, user_id, description, event_datetime, created_at)
+            SELECT id, user_id, description, event_datetime, created_at FROM reminders
+        """)
+        # Триггеры полнотекстового индекса удаляются вместе с таблицей и создаются
+        # заново в _create_search_index; сам индекс остается верным - ID не меняются
+        cursor.execute("DROP TABLE reminders")
+        cursor.execute("ALTER TABLE reminders_new RENAME TO reminders")
+        reserve_reminder_ids(conn)
+        conn.commit()
+    
+    # Полнотекстовые индексы: внешнее содержимое (сам текст хранится только в
+    # исходных таблицах), синхронизация триггерами
+    _SEARCH_INDEXES = {
+        'reminders_fts': ('reminders', 'description'),
+        'voice_fts': ('voice_messages', 'recognized_text'),
+    }
+    
+    def _create_search_index(self, cursor):
+        for fts_table, (table, column) in self._SEARCH_INDEXES.items():
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+            exists = cursor.fetchone() is not None
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                    {column},
+                    content='{table}',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts_table} (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts_table} ({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {column} ON {table} BEGIN
+                    INSERT INTO {fts_table} ({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                    INSERT INTO {fts_table} (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            """)
+            if not exists:
+                # Индекс добавлен к уже существующей базе - заполняем его из таблицы
+                cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    
+    async def save_reminder(self, user_id: int, description: str, event_datetime: str):
+        def write(conn):
             cursor = conn.cursor()
             
             # Всегда создаем новое напоминание без проверки на дубликаты
@@ -60,149 +317,315 @@ class Database:
                 INSERT INTO reminders (user_id, description, event_datetime)
                 VALUES (?, ?, ?)
             """, (user_id, description, event_datetime))
-            conn.commit()
             return cursor.lastrowid
+        
+        return await self._write(user_id, write)
     
-    def save_notification(self, reminder_id: int, user_id: int, notify_datetime: str, 
-                         description: str, timing_description: str, is_main: bool = False,
-                         notification_type: str = "REMINDER"):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+    async def save_notification(self, reminder_id: int, user_id: int, notify_datetime: str, 
+                               description: str, timing_description: str, is_main: bool = False,
+                               notification_type: str = "REMINDER", message_text: str = None,
+                               parse_mode: str = None):
+        def write(conn):
             # Всегда создаем новое уведомление без проверки на дубликаты
-            cursor.execute("""
+            conn.execute("""
                 INSERT INTO notifications 
-                (reminder_id, user_id, notify_datetime, description, timing_description, is_main, notification_type)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (reminder_id, user_id, notify_datetime, description, timing_description, is_main, notification_type))
-            conn.commit()
+                (reminder_id, user_id, notify_datetime, description, timing_description, is_main,
+                 notification_type, message_text, parse_mode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (reminder_id, user_id, notify_datetime, description, timing_description, is_main,
+                  notification_type, message_text, parse_mode))
+        
+        await self._write(user_id, write)
     
-    def get_pending_notifications(self):
-        with sqlite3.connect(self.db_path) as conn:
+    async def save_reminders_with_notifications(self, user_id: int, reminders: list) -> list:
+        """Сохраняет несколько напоминаний вместе с уведомлениями в одной транзакции.
+        reminders - список (description, event_datetime, notifications), где notifications -
+        список (notify_datetime, timing_description, is_main, notification_type, message_text, parse_mode)"""
+        def write(conn):
             cursor = conn.cursor()
+            notification_rows = []
             
-            query = """
-                SELECT 
-                    n.id,
-                    n.user_id,
-                    r.description,
-                    r.event_datetime,
-                    n.notify_datetime,
-                    n.timing_description,
-                    us.timezone
-                FROM notifications n
-                JOIN reminders r ON n.reminder_id = r.id
-                LEFT JOIN user_settings us ON n.user_id = us.user_id
-                WHERE n.is_sent = 0 
-                AND datetime(n.notify_datetime) <= datetime('now', '+1 minute')
-                AND datetime(n.notify_datetime) >= datetime('now', '-1 minute')
-                ORDER BY n.notify_datetime
-            """
-            print(f"\nВыполняется SQL-запрос:\n{query}")
-            
-            cursor.execute(query)
-            results = cursor.fetchall()
-            print(f"Найдено записей: {len(results)}")
+            cursor.executemany("""
+                INSERT INTO reminders (user_id, description, event_datetime)
+                VALUES (?, ?, ?)
+            """, [(user_id, description, event_datetime) for description, event_datetime, _ in reminders])
+            # Внутри транзакции писатель один, поэтому ID вставленных строк идут подряд
+            last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+            reminder_ids = list(range(last_id - len(reminders) + 1, last_id + 1))
             
-            for row in results:
-                print(f"""
-                ID: {row[0]}
-                User ID: {row[1]}
-                Description: {row[2]}
-                Event DateTime: {row[3]}
-                Notify DateTime: {row[4]}
-                Timing: {row[5]}
-                Timezone: {row[6]}
-                """)
+            for reminder_id, (description, event_datetime, notifications) in zip(reminder_ids, reminders):
+                notification_rows.extend(
+                    (reminder_id, user_id, notify_datetime, description, timing_description, is_main,
+                     notification_type, message_text, parse_mode)
+                    for notify_datetime, timing_description, is_main, notification_type, message_text, parse_mode
+                    in notifications
+                )
             
-            return results
+            cursor.executemany("""
+                INSERT INTO notifications 
+                (reminder_id, user_id, notify_datetime, description, timing_description, is_main,
+                 notification_type, message_text, parse_mode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, notification_rows)
+            return reminder_ids
+        
+        return await self._write(user_id, write)
+    
+    def get_pending_notifications(self):
+        query = """
+            SELECT 
+                n.id,
+                n.user_id,
+                r.description,
+                r.event_datetime,
+                n.notify_datetime,
+                n.timing_description,
+                us.timezone,
+                n.reminder_id,
+                n.is_main,
+                n.message_text,
+                n.parse_mode
+            FROM notifications n
+            JOIN reminders r ON n.reminder_id = r.id
+            LEFT JOIN user_settings us ON n.user_id = us.user_id
+            WHERE n.is_sent = 0 
+            AND n.notify_datetime <= ?
+            AND n.notify_datetime >= ?
+            ORDER BY n.notify_datetime
+        """
+        # Время хранится строкой "YYYY-MM-DD HH:MM" в UTC, поэтому сравниваем строки
+        # напрямую - без обертки datetime() запрос использует индекс
+        now = datetime.utcnow()
+        params = (
+            (now + timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M"),
+            self.pending_window_start(now)
+        )
+        print(f"\nВыполняется SQL-запрос на {len(self.shard_paths)} шард(ах):\n{query}")
+        
+        # Уведомления разных пользователей лежат в разных шардах - опрашиваем все
+        results = sorted(self._query_all_shards(query, params), key=lambda row: row[4])
+        print(f"Найдено записей: {len(results)}")
+        
+        for row in results:
+            print(f"""
+            ID: {row[0]}
+            User ID: {row[1]}
+            Description: {row[2]}
+            Event DateTime: {row[3]}
+            Notify DateTime: {row[4]}
+            Timing: {row[5]}
+            Timezone: {row[6]}
+            """)
+        
+        return results
     
-    def mark_notification_sent(self, notification_id: int):
-        with sqlite3.connect(self.db_path) as conn:
+    @staticmethod
+    def pending_window_start(now: datetime = None) -> str:
+        """Нижняя граница окна обычной проверки; все, что раньше, считается пропущенным"""
+        now = now or datetime.utcnow()
+        return (now - timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M")
+    
+    def get_overdue_notifications(self, before: str, limit: int = 100, after: tuple = None) -> list:
+        """Неотправленные уведомления со временем раньше before, не больше limit штук.
+        Порядок - (notify_datetime, user_id, id); after - последний обработанный
+        ключ в этом порядке, чтобы продолжить с него (пагинация без OFFSET)"""
+        query = """
+            SELECT 
+                n.id,
+                n.user_id,
+                r.description,
+                r.event_datetime,
+                n.notify_datetime,
+                n.timing_description,
+                us.timezone,
+                n.reminder_id,
+                n.is_main,
+                n.message_text,
+                n.parse_mode
+            FROM notifications n
+            JOIN reminders r ON n.reminder_id = r.id
+            LEFT JOIN user_settings us ON n.user_id = us.user_id
+            WHERE n.is_sent = 0 
+            AND n.notify_datetime < ?
+            {keyset}
+            ORDER BY n.notify_datetime, n.user_id, n.id
+            LIMIT ?
+        """
+        if after is None:
+            query = query.format(keyset="")
+            params = (before, limit)
+        else:
+            query = query.format(keyset="AND (n.notify_datetime, n.user_id, n.id) > (?, ?, ?)")
+            params = (before, *after, limit)
+        
+        # Каждый шард отдает не больше limit строк; после слияния оставляем первые limit
+        rows = self._query_all_shards(query, params)
+        rows.sort(key=lambda row: (row[4], row[1], row[0]))
+        return rows[:limit]
+    
+    def get_unsent_notifications(self, user_id: int) -> list:
+        """Неотправленные уведомления пользователя для перерисовки текста:
+        (id, description, event_datetime, timing_description)"""
+        with self._connect(user_id) as conn:
             cursor = conn.cursor()
             cursor.execute("""
+                SELECT n.id, r.description, r.event_datetime, n.timing_description
+                FROM notifications n
+                JOIN reminders r ON n.reminder_id = r.id
+                WHERE n.user_id = ? AND n.is_sent = 0
+            """, (user_id,))
+            return cursor.fetchall()
+    
+    async def update_notification_texts(self, user_id: int, texts: list):
+        """Заменяет готовые тексты уведомлений; texts - список (message_text, parse_mode, id)"""
+        def write(conn):
+            conn.executemany("""
+                UPDATE notifications 
+                SET message_text = ?, parse_mode = ?
+                WHERE id = ?
+            """, texts)
+        
+        await self._write(user_id, write)
+    
+    async def mark_notification_sent(self, notification_id: int, user_id: int = None):
+        def write(conn):
+            conn.execute("""
                 UPDATE notifications 
                 SET is_sent = 1 
                 WHERE id = ?
             """, (notification_id,))
-            conn.commit()
+        
+        await self._write(user_id, write)
     
-    def get_user_reminders(self, user_id: int):
-        with sqlite3.connect(self.db_path) as conn:
+    async def delete_notification(self, notification_id: int, user_id: int = None):
+        def write(conn):
+            conn.execute("""
+                DELETE FROM notifications 
+                WHERE id = ?
+            """, (notification_id,))
+        
+        await self._write(user_id, write)
+    
+    # Сработавшие напоминания (без оставшихся уведомлений) в списке не показываются
+    _VISIBLE_REMINDER = """
+        (r.event_datetime >= ? OR EXISTS (SELECT 1 FROM notifications n WHERE n.reminder_id = r.id))
+    """
+    
+    def _has_reminder(self, cursor, user_id: int, now: str, op: str, key: tuple) -> bool:
+        """Есть ли видимое напоминание с ключом (event_datetime, id), меньшим/большим key"""
+        cursor.execute(f"""
+            SELECT 1 FROM reminders r
+            WHERE r.user_id = ? AND {self._VISIBLE_REMINDER}
+            AND (r.event_datetime, r.id) {op} (?, ?)
+            LIMIT 1
+        """, (user_id, now, *key))
+        return cursor.fetchone() is not None
+    
+    def get_reminders_page(self, user_id: int, start: tuple = None, before: tuple = None,
+                           limit: int = 5):
+        """Страница напоминаний пользователя в порядке (event_datetime, id) без OFFSET.
+        start - ключ (event_datetime, id), с которого начинается страница (включительно);
+        before - ключ, перед которым заканчивается предыдущая страница.
+        Возвращает (reminders, has_prev, has_next); reminders - список словарей
+        id, description, event_datetime, notifications"""
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+        with self._connect(user_id) as conn:
             cursor = conn.cursor()
+            if before is not None:
+                cursor.execute(f"""
+                    SELECT r.id, r.description, r.event_datetime FROM reminders r
+                    WHERE r.user_id = ? AND {self._VISIBLE_REMINDER}
+                    AND (r.event_datetime, r.id) < (?, ?)
+                    ORDER BY r.event_datetime DESC, r.id DESC
+                    LIMIT ?
+                """, (user_id, now, *before, limit))
+                rows = cursor.fetchall()[::-1]
+                # Дошли до начала - показываем первую страницу целиком
+                if not rows or not self._has_reminder(cursor, user_id, now, '<', (rows[0][2], rows[0][0])):
+                    return self.get_reminders_page(user_id, limit=limit)
+            else:
+                keyset = "AND (r.event_datetime, r.id) >= (?, ?)" if start is not None else ""
+                cursor.execute(f"""
+                    SELECT r.id, r.description, r.event_datetime FROM reminders r
+                    WHERE r.user_id = ? AND {self._VISIBLE_REMINDER}
+                    {keyset}
+                    ORDER BY r.event_datetime, r.id
+                    LIMIT ?
+                """, (user_id, now, *(start or ()), limit))
+                rows = cursor.fetchall()
             
-            # Получаем напоминания с их уведомлениями в одном запросе
-            cursor.execute("""
-                SELECT 
-                    r.id,
-                    r.description,
-                    r.event_datetime,
-                    r.created_at,
-                    n.notify_datetime,
-                    n.timing_description,
-                    n.notification_type,
-                    n.is_main
-                FROM reminders r
-                LEFT JOIN notifications n ON r.id = n.reminder_id
-                WHERE r.user_id = ?
-                ORDER BY r.event_datetime, r.created_at
-            """, (user_id,))
-            
-            results = cursor.fetchall()
+            if not rows:
+                return [], False, False
             
-            # Группируем результаты по reminder_id
-            grouped_reminders = {}
-            real_to_display_id = {}  # Словарь для соответствия реальных и отображаемых ID
-            display_id = 1  # Начинаем с 1
+            has_prev = self._has_reminder(cursor, user_id, now, '<', (rows[0][2], rows[0][0]))
+            has_next = self._has_reminder(cursor, user_id, now, '>', (rows[-1][2], rows[-1][0]))
             
-            for row in results:
-                reminder_id = row[0]
-                
-                # Если это новое напоминание, создаем для него запись и сохраняем соответствие ID
-                if reminder_id not in grouped_reminders:
-                    real_to_display_id[reminder_id] = display_id
-                    grouped_reminders[reminder_id] = {
-                        'id': reminder_id,  # Реальный ID
-                        'display_id': display_id,  # Отображаемый ID
-                        'description': row[1],
-                        'event_datetime': row[2],
-                        'created_at': row[3],
-                        'notifications': []
-                    }
-                    display_id += 1
-                
-                # Добавляем уведомление, если оно есть и это не основное уведомление
-                if row[4] is not None and not row[7]:  # row[7] это is_main
-                    grouped_reminders[reminder_id]['notifications'].append({
-                        'datetime': row[4],
-                        'timing': row[5]
-                    })
+            reminders = {
+                row[0]: {'id': row[0], 'description': row[1], 'event_datetime': row[2], 'notifications': []}
+                for row in rows
+            }
+            # Дополнительные уведомления только для напоминаний этой страницы
+            placeholders = ', '.join('?' for _ in reminders)
+            cursor.execute(f"""
+                SELECT reminder_id, notify_datetime, timing_description
+                FROM notifications
+                WHERE reminder_id IN ({placeholders}) AND is_main = 0
+                ORDER BY notify_datetime
+            """, tuple(reminders))
+            for reminder_id, notify_datetime, timing in cursor.fetchall():
+                reminders[reminder_id]['notifications'].append({
+                    'datetime': notify_datetime,
+                    'timing': timing
+                })
             
-            # Сохраняем соответствие ID в базе данных для последующего использования
+            return list(reminders.values()), has_prev, has_next
+    
+    def search(self, user_id: int, words: list, limit: int = 5, offset: int = 0) -> list:
+        """Полнотекстовый поиск по напоминаниям и расшифровкам голосовых сообщений
+        пользователя, лучшие совпадения первыми. Каждое слово ищется как префикс.
+        Возвращает список (kind, id, text, datetime), kind - 'reminder' или 'voice'"""
+        # Слова берутся в кавычки, чтобы пользовательский ввод не разбирался как синтаксис FTS5
+        query = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+        with self._connect(user_id) as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS id_mapping (
-                    user_id INTEGER NOT NULL,
-                    real_id INTEGER NOT NULL,
-                    display_id INTEGER NOT NULL,
-                    PRIMARY KEY (user_id, display_id)
+                SELECT kind, id, text, dt FROM (
+                    SELECT 'reminder' AS kind, r.id, r.description AS text, r.event_datetime AS dt,
+                           bm25(reminders_fts) AS score
+                    FROM reminders_fts
+                    JOIN reminders r ON r.id = reminders_fts.rowid
+                    WHERE reminders_fts MATCH ? AND r.user_id = ?
+                    UNION ALL
+                    SELECT 'voice', v.id, v.recognized_text, v.timestamp, bm25(voice_fts)
+                    FROM voice_fts
+                    JOIN voice_messages v ON v.id = voice_fts.rowid
+                    WHERE voice_fts MATCH ? AND v.user_id = ?
                 )
-            """)
-            
-            # Очищаем старые маппинги для этого пользователя
-            cursor.execute("DELETE FROM id_mapping WHERE user_id = ?", (user_id,))
-            
-            # Сохраняем новые маппинги
-            for real_id, disp_id in real_to_display_id.items():
-                cursor.execute("""
-                    INSERT INTO id_mapping (user_id, real_id, display_id)
-                    VALUES (?, ?, ?)
-                """, (user_id, real_id, disp_id))
-            
-            conn.commit()
-            return grouped_reminders
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (query, user_id, query, user_id, limit, offset))
+            return cursor.fetchall()
+    
+    def iter_user_reminders(self, user_id: int, batch_size: int = 500):
+        """Все напоминания пользователя (id, description, event_datetime) по порядку.
+        Строки читаются курсором пачками по мере потребления, а не загружаются целиком"""
+        with self._connect(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, description, event_datetime FROM reminders
+                WHERE user_id = ?
+                ORDER BY event_datetime, id
+            """, (user_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
     
     def get_real_reminder_id(self, user_id: int, display_id: int) -> int:
-        """Получает реальный ID напоминания по отображаемому ID"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Получает реальный ID напоминания по отображаемому ID из сообщений
+        старого формата /list (таблица id_mapping больше не пополняется)"""
+        with self._connect(user_id) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT real_id FROM id_mapping
@@ -212,7 +635,7 @@ class Database:
             return result[0] if result else None
     
     def get_user_timezone(self, user_id: int) -> str:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(user_id) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT timezone FROM user_settings WHERE user_id = ?
@@ -220,18 +643,126 @@ class Database:
             result = cursor.fetchone()
             return result[0] if result else 'Etc/GMT+0'
     
-    def set_user_timezone(self, user_id: int, timezone: str):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+    async def set_user_timezone(self, user_id: int, timezone: str):
+        def write(conn):
+            conn.execute("""
                 INSERT INTO user_settings (user_id, timezone)
                 VALUES (?, ?)
                 ON CONFLICT(user_id) DO UPDATE SET timezone = ?
             """, (user_id, timezone, timezone))
-            conn.commit()
+        
+        await self._write(user_id, write)
+    
+    def get_reminder(self, reminder_id: int, user_id: int):
+        """Напоминание пользователя: (id, description, event_datetime) или None"""
+        with self._connect(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, description, event_datetime FROM reminders
+                WHERE id = ? AND user_id = ?
+            """, (reminder_id, user_id))
+            return cursor.fetchone()
     
-    def delete_reminder(self, reminder_id: int):
-        with sqlite3.connect(self.db_path) as conn:
+    async def reschedule_reminder(self, reminder_id: int, user_id: int, event_datetime: str,
+                                  notifications: list) -> bool:
+        """Переносит напоминание на новое время и заменяет его уведомления одной транзакцией.
+        notifications - как в save_reminders_with_notifications. False, если напоминания нет"""
+        def write(conn):
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE reminders 
+                SET event_datetime = ? 
+                WHERE id = ? AND user_id = ?
+            """, (event_datetime, reminder_id, user_id))
+            if cursor.rowcount == 0:
+                return False
+            
+            cursor.execute("""
+                DELETE FROM notifications 
+                WHERE reminder_id = ?
+            """, (reminder_id,))
+            cursor.executemany("""
+                INSERT INTO notifications 
+                (reminder_id, user_id, notify_datetime, description, timing_description, is_main,
+                 notification_type, message_text, parse_mode)
+                SELECT ?, ?, ?, description, ?, ?, ?, ?, ?
+                FROM reminders WHERE id = ?
+            """, [
+                (reminder_id, user_id, notify_datetime, timing_description, is_main,
+                 notification_type, message_text, parse_mode, reminder_id)
+                for notify_datetime, timing_description, is_main, notification_type, message_text, parse_mode
+                in notifications
+            ])
+            return True
+        
+        return await self._write(user_id, write)
+    
+    async def finish_reminder(self, reminder_id: int, user_id: int = None):
+        """Удаляет уведомления сработавшего напоминания; само напоминание остается,
+        чтобы его можно было отложить кнопкой из уведомления"""
+        def write(conn):
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM notifications 
+                WHERE reminder_id = ?
+            """, (reminder_id,))
+            return cursor.rowcount
+        
+        notifications_count = await self._write(user_id, write)
+        print(f"✅ Напоминание {reminder_id} завершено, удалено {notifications_count} уведомлений")
+    
+    async def archive_finished_reminders(self, before: str, batch_size: int = 500) -> int:
+        """Переносит сработавшие напоминания (без оставшихся уведомлений) со временем
+        раньше before в reminders_archive. Каждая пачка - отдельная короткая
+        транзакция, чтобы не задерживать остальные записи"""
+        def write(conn):
+            ids = [row[0] for row in conn.execute("""
+                SELECT id FROM reminders 
+                WHERE event_datetime < ?
+                AND NOT EXISTS (SELECT 1 FROM notifications n WHERE n.reminder_id = reminders.id)
+                LIMIT ?
+            """, (before, batch_size))]
+            conn.executemany("""
+                INSERT INTO reminders_archive 
+                (reminder_id, user_id, description, event_datetime, created_at)
+                SELECT id, user_id, description, event_datetime, created_at
+                FROM reminders WHERE id = ?
+            """, [(reminder_id,) for reminder_id in ids])
+            conn.executemany("DELETE FROM reminders WHERE id = ?", [(reminder_id,) for reminder_id in ids])
+            return len(ids)
+        
+        total = 0
+        while True:
+            moved = sum(await self._write_all_shards(write))
+            total += moved
+            if moved == 0:
+                return total
+    
+    async def incremental_vacuum(self, max_pages: int = 1000) -> int:
+        """Возвращает системе до max_pages свободных страниц каждого шарда;
+        возвращает количество освобожденных страниц"""
+        def write(conn):
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # sqlite3 выполняет прагму за один шаг, а каждый шаг освобождает
+            # одну страницу - поэтому вызываем ее постранично
+            for _ in range(min(free_before, max_pages)):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+            return free_before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        
+        return sum(await self._write_all_shards(write))
+    
+    async def optimize(self, analyze: bool = False):
+        """Обновляет статистику планировщика запросов: полный ANALYZE или
+        PRAGMA optimize, который пересчитывает только устаревшую статистику"""
+        def write(conn):
+            if analyze:
+                conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize").fetchall()
+        
+        await self._write_all_shards(write)
+    
+    async def delete_reminder(self, reminder_id: int, user_id: int = None):
+        def write(conn):
             cursor = conn.cursor()
             # Сначала удаляем все связанные уведомления
             cursor.execute("""
@@ -244,79 +775,234 @@ class Database:
                 DELETE FROM reminders 
                 WHERE id = ?
             """, (reminder_id,))
-            
-            conn.commit()
+        
+        await self._write(user_id, write)
     
     def debug_notifications(self):
         """Метод для отладки - показывает все уведомления"""
-        with sqlite3.connect(self.db_path) as conn:
+        results = sorted(self._query_all_shards("""
+            SELECT 
+                n.id,
+                n.user_id,
+                r.description,
+                r.event_datetime,
+                n.notify_datetime,
+                n.timing_description,
+                n.is_sent
+            FROM notifications n
+            JOIN reminders r ON n.reminder_id = r.id
+        """), key=lambda row: row[4])
+        print("\n=== Все уведомления в базе данных ===")
+        for row in results:
+            print(f"""
+            ID: {row[0]}
+            User ID: {row[1]}
+            Description: {row[2]}
+            Event DateTime: {row[3]}
+            Notify DateTime: {row[4]}
+            Timing: {row[5]}
+            Is Sent: {row[6]}
+            """)
+        return results
+    
+    async def delete_reminder_with_notifications(self, reminder_id: int, user_id: int = None):
+        """Удаляет напоминание и все его уведомления"""
+        def write(conn):
             cursor = conn.cursor()
+            # Удаляем все уведомления
             cursor.execute("""
-                SELECT 
-                    n.id,
-                    n.user_id,
-                    r.description,
-                    r.event_datetime,
-                    n.notify_datetime,
-                    n.timing_description,
-                    n.is_sent
-                FROM notifications n
-                JOIN reminders r ON n.reminder_id = r.id
-                ORDER BY n.notify_datetime
+                DELETE FROM notifications 
+                WHERE reminder_id = ?
+            """, (reminder_id,))
+            notifications_count = cursor.rowcount
+            
+            # Удаляем само напоминание
+            cursor.execute("""
+                DELETE FROM reminders 
+                WHERE id = ?
+            """, (reminder_id,))
+            return notifications_count
+        
+        try:
+            notifications_count = await self._write(user_id, write)
+            print(f"✅ Удалено напоминание {reminder_id} и {notifications_count} связанных уведомлений")
+        except Exception as e:
+            print(f"❌ Ошибка при удалении напоминания: {str(e)}")
+            raise
+    
+    async def save_voice_message(self, user_id: int, ogg_path: str, wav_path: str, 
+                                 recognized_text: str, timestamp: str, file_size: int = 0):
+        def write(conn):
+            conn.execute("""
+                INSERT INTO voice_messages 
+                (user_id, ogg_path, wav_path, recognized_text, timestamp, file_size)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, ogg_path, wav_path, recognized_text, timestamp, file_size))
+        
+        await self._write(user_id, write)
+    
+    def get_expired_voice_files(self, before: str, limit: int = 500) -> list:
+        """Голосовые сообщения старше before, у которых еще есть файлы:
+        (user_id, id, ogg_path, wav_path)"""
+        rows = self._query_all_shards("""
+            SELECT user_id, id, ogg_path, wav_path FROM voice_messages
+            WHERE created_at < ? AND (ogg_path != '' OR wav_path != '')
+            ORDER BY created_at
+            LIMIT ?
+        """, (before, limit))
+        return rows[:limit]
+    
+    def get_voice_quota_excess(self, quota: int) -> list:
+        """Пользователи, чьи OGG занимают больше quota байт: (user_id, занято байт)"""
+        return self._query_all_shards("""
+            SELECT user_id, SUM(file_size) FROM voice_messages
+            WHERE ogg_path != ''
+            GROUP BY user_id
+            HAVING SUM(file_size) > ?
+        """, (quota,))
+    
+    def get_user_voice_files(self, user_id: int, limit: int = 100) -> list:
+        """Хранимые файлы пользователя от старых к новым: (id, ogg_path, wav_path, file_size)"""
+        with self._connect(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, ogg_path, wav_path, file_size FROM voice_messages
+                WHERE user_id = ? AND ogg_path != ''
+                ORDER BY created_at, id
+                LIMIT ?
+            """, (user_id, limit))
+            return cursor.fetchall()
+    
+    async def clear_voice_files(self, user_id: int, voice_ids: list):
+        """Отмечает, что файлы голосовых сообщений удалены; расшифровка остается для поиска"""
+        def write(conn):
+            conn.executemany("""
+                UPDATE voice_messages 
+                SET ogg_path = '', wav_path = '', file_size = 0
+                WHERE id = ?
+            """, [(voice_id,) for voice_id in voice_ids])
+        
+        await self._write(user_id, write)
+    
+    def get_voice_usage(self, user_id: int = None) -> tuple:
+        """Хранимые OGG пользователя (или всех, если user_id не указан): (количество, байт)"""
+        if user_id is None:
+            rows = self._query_all_shards("""
+                SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM voice_messages
+                WHERE ogg_path != ''
             """)
-            results = cursor.fetchall()
-            print("\n=== Все уведомления в базе данных ===")
-            for row in results:
-                print(f"""
-                ID: {row[0]}
-                User ID: {row[1]}
-                Description: {row[2]}
-                Event DateTime: {row[3]}
-                Notify DateTime: {row[4]}
-                Timing: {row[5]}
-                Is Sent: {row[6]}
-                """)
-            return results
+            return sum(row[0] for row in rows), sum(row[1] for row in rows)
+        with self._connect(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM voice_messages
+                WHERE user_id = ? AND ogg_path != ''
+            """, (user_id,))
+            return cursor.fetchone()
     
-    def delete_reminder_with_notifications(self, reminder_id: int):
-        """Удаляет напоминание и все его уведомления"""
-        with sqlite3.connect(self.db_path) as conn:
+    async def claim_message(self, user_id: int, chat_id: int, message_id: int,
+                            stale_after: float = 600) -> tuple:
+        """Отмечает сообщение как принятое в обработку.
+
+        Возвращает (True, None), если сообщение новое или прошлая попытка его
+        обработки оборвалась (начата прошлым запуском бота или не завершилась
+        за stale_after секунд), иначе (False, (result_text, reply_markup));
+        result_text None - обработка еще идет"""
+        def write(conn):
+            now = time.time()
             cursor = conn.cursor()
-            try:
-                # Получаем ID всех уведомлений для этого напоминания
-                cursor.execute("""
-                    SELECT id FROM notifications 
-                    WHERE reminder_id = ?
-                """, (reminder_id,))
-                notification_ids = [row[0] for row in cursor.fetchall()]
-                
-                # Удаляем все уведомления
-                cursor.execute("""
-                    DELETE FROM notifications 
-                    WHERE reminder_id = ?
-                """, (reminder_id,))
-                
-                # Удаляем само напоминание
+            cursor.execute("""
+                INSERT OR IGNORE INTO processed_messages (chat_id, message_id, created_at, boot_id)
+                VALUES (?, ?, ?, ?)
+            """, (chat_id, message_id, now, self.boot_id))
+            if cursor.rowcount:
+                return True, None
+            result_text, reply_markup, created_at, boot_id = cursor.execute("""
+                SELECT result_text, reply_markup, created_at, boot_id FROM processed_messages
+                WHERE chat_id = ? AND message_id = ?
+            """, (chat_id, message_id)).fetchone()
+            # Задача прошлого запуска пропала из очереди в памяти вместе с процессом
+            if result_text is None and (boot_id != self.boot_id or created_at < now - stale_after):
                 cursor.execute("""
-                    DELETE FROM reminders 
-                    WHERE id = ?
-                """, (reminder_id,))
-                
-                conn.commit()
-                print(f"✅ Удалено напоминание {reminder_id} и {len(notification_ids)} связанных уведомлений")
-                
-            except Exception as e:
-                print(f"❌ Ошибка при удалении напоминания: {str(e)}")
-                conn.rollback()
-                raise
-    
-    def save_voice_message(self, user_id: int, ogg_path: str, wav_path: str, 
-                          recognized_text: str, timestamp: str):
-        with sqlite3.connect(self.db_path) as conn:
+                    UPDATE processed_messages SET created_at = ?, boot_id = ?
+                    WHERE chat_id = ? AND message_id = ?
+                """, (now, self.boot_id, chat_id, message_id))
+                return True, None
+            return False, (result_text, reply_markup)
+        
+        return await self._write(user_id, write)
+    
+    async def save_message_result(self, user_id: int, chat_id: int, message_id: int,
+                                  result_text: str, reply_markup: str = None):
+        """Запоминает итоговый ответ на сообщение для повторных доставок"""
+        def write(conn):
+            conn.execute("""
+                UPDATE processed_messages SET result_text = ?, reply_markup = ?
+                WHERE chat_id = ? AND message_id = ?
+            """, (result_text, reply_markup, chat_id, message_id))
+        
+        await self._write(user_id, write)
+    
+    async def release_message(self, user_id: int, chat_id: int, message_id: int):
+        """Снимает отметку об обработке (обработка не удалась), чтобы сообщение
+        можно было обработать заново"""
+        def write(conn):
+            conn.execute("""
+                DELETE FROM processed_messages WHERE chat_id = ? AND message_id = ?
+            """, (chat_id, message_id))
+        
+        await self._write(user_id, write)
+    
+    async def delete_processed_messages(self, before: float) -> int:
+        """Удаляет отметки об обработке сообщений, принятых раньше before (unix time)"""
+        def write(conn):
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO voice_messages 
-                (user_id, ogg_path, wav_path, recognized_text, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, ogg_path, wav_path, recognized_text, timestamp))
-            conn.commit()
\ No newline at end of file
+            cursor.execute("DELETE FROM processed_messages WHERE created_at < ?", (before,))
+            return cursor.rowcount
+        
+        return sum(await self._write_all_shards(write))
+
+
+def reserve_reminder_ids(conn):
+    """Сдвигает счетчик AUTOINCREMENT таблицы reminders за наибольший ID,
+    встречающийся в reminders и reminders_archive"""
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'reminders'")
+    conn.execute("""
+        INSERT INTO sqlite_sequence (name, seq) VALUES ('reminders', MAX(
+            (SELECT COALESCE(MAX(id), 0) FROM reminders),
+            (SELECT COALESCE(MAX(reminder_id), 0) FROM reminders_archive)
+        ))
+    """)
+
+
+def _timed(method):
+    """Учитывает длительность вызова метода в DB_QUERY_SECONDS и в трассе обновления"""
+    name = method.__name__
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracer.span(f"db.{name}"):
+                    return await method(*args, **kwargs)
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - started, method=name)
+    else:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracer.span(f"db.{name}"):
+                    return method(*args, **kwargs)
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - started, method=name)
+    return wrapper
+
+
+# Время всех публичных запросов к базе - без ручной обертки каждого метода.
+# Генераторы (iter_user_reminders) и служебные методы не оборачиваются
+for _name, _method in list(vars(Database).items()):
+    if (inspect.isfunction(_method) and not _name.startswith('_')
+            and not inspect.isgeneratorfunction(_method)
+            and _name not in ('shard_index', 'start_writer', 'stop_writer')):
+        setattr(Database, _name, _timed(_method))
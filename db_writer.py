@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import sqlite3
+
+logger = logging.getLogger('DatabaseWriter')
+
+
+class DatabaseWriter:
+    """Единственный писатель в базу с групповой фиксацией.
+
+    Изменения приходят через очередь в виде функций fn(conn). Все, что
+    пришло за window секунд (но не больше max_batch), выполняется в одной
+    транзакции на каждый файл базы - один fsync на пачку вместо одного на
+    запись. Каждое изменение выполняется в своей точке сохранения, так что
+    ошибка одного не откатывает остальные. Future вызывающего разрешается
+    только после фиксации транзакции."""
+
+    def __init__(self, window: float = 0.005, max_batch: int = 100):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._connections = {}
+        self._task = None
+        self._closed = False
+
+    def start(self):
+        if self._task is None:
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает все, что уже в очереди, и закрывает соединения.
+        Новые изменения после вызова stop отклоняются"""
+        self._closed = True
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        for conn in self._connections.values():
+            conn.close()
+        self._connections = {}
+
+    async def submit(self, db_path: str, fn):
+        """Ставит изменение в очередь и ждет его фиксации; возвращает результат fn(conn)"""
+        if self._closed:
+            # Очередь больше никто не разбирает - вызывающий ждал бы вечно
+            raise RuntimeError("Запись в базу остановлена")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((db_path, fn, future))
+        return await future
+
+    def _connection(self, db_path: str) -> sqlite3.Connection:
+        conn = self._connections.get(db_path)
+        if conn is None:
+            # Соединение используется только писателем, но из потоков пула
+            conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+            # WAL: читатели не блокируются писателем, фиксация дешевле
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._connections[db_path] = conn
+        return conn
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+
+            # Добираем все, что успеет прийти за окно группировки
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout > 0:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            by_path = {}
+            for db_path, fn, future in batch:
+                by_path.setdefault(db_path, []).append((fn, future))
+
+            # Разные файлы базы фиксируем параллельно
+            results = await asyncio.gather(*[
+                asyncio.to_thread(self._commit, db_path, items)
+                for db_path, items in by_path.items()
+            ], return_exceptions=True)
+
+            for items, outcomes in zip(by_path.values(), results):
+                for index, (fn, future) in enumerate(items):
+                    if future.done():
+                        continue
+                    outcome = outcomes if isinstance(outcomes, Exception) else outcomes[index]
+                    if isinstance(outcome, Exception):
+                        future.set_exception(outcome)
+                    else:
+                        future.set_result(outcome)
+
+    def _commit(self, db_path: str, items: list) -> list:
+        """Выполняет пачку изменений одной транзакцией; возвращает результат
+        или исключение для каждого изменения"""
+        conn = self._connection(db_path)
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for fn, _ in items:
+                conn.execute("SAVEPOINT mutation")
+                try:
+                    outcomes.append(fn(conn))
+                    conn.execute("RELEASE mutation")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO mutation")
+                    conn.execute("RELEASE mutation")
+                    outcomes.append(e)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.debug(f"Зафиксировано изменений: {len(items)} ({db_path})")
+        return outcomes
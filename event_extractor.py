@@ -1,15 +1,106 @@
-import json
+import asyncio
+import time
 from datetime import datetime
 import pytz
+import requests
 from huggingface_hub import InferenceClient
 from config import HUGGING_FACE_TOKEN
+from circuit_breaker import create_breaker, CircuitOpenError
+from json_stream import IncrementalJSONParser, EVENTS_JSON_SCHEMA, LLM_REQUEST_SECONDS, LLM_REQUEST_FAILURES
 
 class EventExtractor:
     def __init__(self):
         self.client = InferenceClient(api_key=HUGGING_FACE_TOKEN)
         self.model = "microsoft/Phi-3-mini-4k-instruct"
+        self.max_tokens = self.MAX_TOKENS
+        # Автомат защиты: при деградации Hugging Face отказываем сразу, без ожидания таймаута
+        self.breaker = create_breaker("распознавания событий")
+        self.breaker.set_probe(self.probe)
+
+    # С запасом на несколько событий; поток все равно обрывается после закрытия объекта
+    MAX_TOKENS = 400
+
+    def set_max_tokens(self, max_tokens: int = None):
+        """Ограничивает длину ответа модели (при перегрузке); None - значение по умолчанию"""
+        self.max_tokens = max_tokens or self.MAX_TOKENS
+
+    def probe(self) -> bool:
+        """Легкая проверка доступности модели для фонового опроса автомата"""
+        response = requests.get(
+            f"https://api-inference.huggingface.co/models/{self.model}",
+            headers={"Authorization": f"Bearer {HUGGING_FACE_TOKEN}"},
+            timeout=5
+        )
+        return response.status_code < 500
+    
+    def _stream_completion(self, messages: list) -> dict:
+        """Потоковая генерация с досрочным завершением, как только собран JSON-объект"""
+        self.breaker.before_call()
+        # Таймаут клиента подстраиваем под недавние задержки модели
+        self.client.timeout = self.breaker.deadline()
+        started = time.monotonic()
+        parser = IncrementalJSONParser(required_keys=('events',))
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens,
+                temperature=0.1,
+                stream=True,
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {"name": "events", "schema": EVENTS_JSON_SCHEMA, "strict": True}
+                }
+            )
+            try:
+                for chunk in stream:
+                    if parser.feed(chunk.choices[0].delta.content or '') is not None:
+                        break
+            finally:
+                # Закрываем генератор, чтобы оборвать соединение и не ждать остатка ответа
+                stream.close()
+        except ValueError:
+            # Модель ответила, но содержимое некорректно - это не отказ зависимости
+            self.breaker.record_success(time.monotonic() - started)
+            LLM_REQUEST_FAILURES.inc(backend='huggingface')
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            LLM_REQUEST_FAILURES.inc(backend='huggingface')
+            raise
+        self.breaker.record_success(time.monotonic() - started)
+        LLM_REQUEST_SECONDS.observe(time.monotonic() - started, backend='huggingface')
+        
+        if parser.result is None:
+            raise ValueError("JSON не найден в ответе")
+        return parser.result
     
     async def extract_event_data(self, text: str, user_timezone: str = 'UTC') -> dict:
+        """Извлекает одно (первое) событие из текста"""
+        events = await self.extract_events(text, user_timezone)
+        return events[0]
+    
+    def _localize_event(self, event_data: dict, local_tz, current_time: datetime) -> dict:
+        """Переводит время события из часового пояса пользователя в UTC"""
+        event_dt = datetime.strptime(event_data['datetime'], '%Y-%m-%d %H:%M')
+        # Важно: считаем, что время от модели уже в часовом поясе пользователя
+        local_dt = local_tz.localize(event_dt)
+        
+        # Если дата уже прошла в этом году, добавляем год
+        if local_dt < current_time:
+            next_year = current_time.year + 1
+            local_dt = local_dt.replace(year=next_year)
+            print(f"Дата {event_dt.strftime('%d.%m.%Y')} уже прошла, используем следующий год: {next_year}")
+        
+        # Конвертируем в UTC для хранения
+        utc_dt = local_dt.astimezone(pytz.UTC)
+        return {
+            'description': event_data['description'],
+            'datetime': utc_dt.strftime('%Y-%m-%d %H:%M')
+        }
+    
+    async def extract_events(self, text: str, user_timezone: str = 'UTC') -> list:
+        """Извлекает все события из текста одним запросом к модели"""
         # Получаем текущее время в часовом поясе пользователя
         local_tz = pytz.timezone(user_timezone)
         current_time = datetime.now(local_tz)
@@ -19,7 +110,9 @@ class EventExtractor:
                 "role": "system",
                 "content": (
                     "Ты - ассистент, который извлекает информацию о событиях из текста. "
-                    "Всегда отвечай в формате JSON с полями 'description' и 'datetime'. "
+                    "Всегда отвечай в формате JSON с полем 'events' - списком событий, "
+                    "у каждого события поля 'description' и 'datetime'. "
+                    "Если в тексте упомянуто несколько событий, верни каждое отдельным элементом списка. "
                     "Поле datetime должно быть в формате 'YYYY-MM-DD HH:MM'. "
                     "Описание события должно быть максимально кратким (2-4 слова), отражая только суть. "
                     "Всегда используй предоставленное текущее время как точку отсчета для расчетов."
@@ -66,61 +159,31 @@ class EventExtractor:
                     f"- Текущее время {current_time.strftime('%H:%M')}, текст 'в 15:30' -> сегодня в 15:30 (или завтра, если время уже прошло)\n"
                     "Верни строго в формате JSON:\n"
                     "{\n"
-                    '    "description": "краткое описание",\n'
-                    '    "datetime": "YYYY-MM-DD HH:MM"\n'
+                    '    "events": [\n'
+                    '        {"description": "краткое описание", "datetime": "YYYY-MM-DD HH:MM"}\n'
+                    "    ]\n"
                     "}"
                 )
             }
         ]
         
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=500,
-                temperature=0.1
-            )
-            
-            response = completion.choices[0].message.content
-            print(f"Ответ от модели: {response}")
-            
-            # Очищаем ответ от возможного лишнего текста
-            response = response.strip()
-            if response.startswith('```json'):
-                response = response[7:]
-            if response.endswith('```'):
-                response = response[:-3]
-            response = response.strip()
-            
-            # Находим JSON в тексте
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            if start == -1 or end == 0:
-                raise ValueError("JSON не найден в ответе")
-            
-            json_str = response[start:end]
-            event_data = json.loads(json_str)
-            
-            if not all(key in event_data for key in ['description', 'datetime']):
-                raise ValueError("Отсутствуют необходимые поля в ответе")
-            
-            # Преобразуем дату с учетом часового пояса
-            event_dt = datetime.strptime(event_data['datetime'], '%Y-%m-%d %H:%M')
-            # Важно: считаем, что время от модели уже в часовом поясе пользователя
-            local_dt = local_tz.localize(event_dt)
-            
-            # Если дата уже прошла в этом году, добавляем год
-            if local_dt < current_time:
-                next_year = current_time.year + 1
-                local_dt = local_dt.replace(year=next_year)
-                print(f"Дата {event_dt.strftime('%d.%m.%Y')} уже прошла, используем следующий год: {next_year}")
+            # Потоковый HTTP-запрос блокирующий - выполняем его вне цикла событий
+            result = await asyncio.to_thread(self._stream_completion, messages)
+            print(f"Ответ от модели: {result}")
             
-            # Конвертируем в UTC для хранения
-            utc_dt = local_dt.astimezone(pytz.UTC)
-            event_data['datetime'] = utc_dt.strftime('%Y-%m-%d %H:%M')
+            events = [
+                self._localize_event(event_data, local_tz, current_time)
+                for event_data in result['events']
+                if all(key in event_data for key in ['description', 'datetime'])
+            ]
+            if not events:
+                raise ValueError("В ответе нет ни одного события")
             
-            return event_data
+            return events
             
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"Ошибка при обработке: {str(e)}")
             print(f"Исходный текст: {text}")
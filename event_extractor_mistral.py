@@ -1,8 +1,15 @@
+import asyncio
 import json
 from datetime import datetime
 import pytz
 import requests
+import time
 from config import MISTRAL_API_KEY, INSTANCE_PATH
+from circuit_breaker import create_breaker, CircuitOpenError
+from json_stream import (
+    IncrementalJSONParser, EVENTS_JSON_SCHEMA, BATCH_EVENTS_JSON_SCHEMA,
+    LLM_REQUEST_SECONDS, LLM_REQUEST_FAILURES
+)
 import logging
 import os
 
@@ -25,6 +32,10 @@ class EventExtractorMistral:
         self.api_key = MISTRAL_API_KEY
         self.api_url = "https://api.mistral.ai/v1/chat/completions"
         self.model = "mistral-large-latest"
+        self.max_tokens = self.MAX_TOKENS
+        # Автомат защиты: при деградации Mistral AI отказываем сразу, без ожидания таймаута
+        self.breaker = create_breaker("распознавания событий")
+        self.breaker.set_probe(self.probe)
         logger.info(f"""
 {'='*50}
 Инициализация EventExtractorMistral:
@@ -38,8 +49,196 @@ class EventExtractorMistral:
   * Поддержка сложных языковых конструкций
 {'='*50}
 """)
-        
+
+    # С запасом на несколько событий; поток все равно обрывается после закрытия объекта
+    MAX_TOKENS = 400
+
+    def set_max_tokens(self, max_tokens: int = None):
+        """Ограничивает длину ответа модели (при перегрузке); None - значение по умолчанию"""
+        self.max_tokens = max_tokens or self.MAX_TOKENS
+        logger.info(f"Максимум токенов ответа: {self.max_tokens}")
+
+    def probe(self) -> bool:
+        """Легкая проверка доступности API для фонового опроса автомата"""
+        response = requests.get(
+            "https://api.mistral.ai/v1/models",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=5
+        )
+        return response.status_code < 500
+
+    def _stream_completion(self, headers: dict, payload: dict, parser: IncrementalJSONParser) -> dict:
+        """Потоковый запрос к API: читает ответ по мере генерации и обрывает поток,
+        как только из него собран JSON-объект события"""
+        self.breaker.before_call()
+        deadline = self.breaker.deadline()
+        logger.info(f"Дедлайн запроса: {deadline:.1f} с")
+        started = time.monotonic()
+        # Любой выход после before_call должен отметиться в автомате, иначе
+        # пробный слот полуоткрытого автомата останется занятым
+        try:
+            with requests.post(
+                self.api_url,
+                headers=headers,
+                json=payload,
+                timeout=deadline,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    # timeout ограничивает лишь ожидание каждого чтения, а медленный
+                    # поток может идти сколько угодно - проверяем общий дедлайн сами
+                    if time.monotonic() - started > deadline:
+                        raise requests.exceptions.Timeout(
+                            f"Ответ не получен за {deadline:.1f} с"
+                        )
+                    # Формат server-sent events: "data: {...}", завершается "data: [DONE]"
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    chunk = json.loads(data)
+                    delta = chunk["choices"][0].get("delta", {}).get("content") or ''
+                    if parser.feed(delta) is not None:
+                        # Объект собран - остаток генерации не нужен, закрываем соединение
+                        logger.info("JSON получен, поток прерван досрочно")
+                        break
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code
+            if status >= 500 or status == 429:
+                self.breaker.record_failure()
+            else:
+                # Сервис ответил, ошибка в самом запросе - это не отказ зависимости
+                self.breaker.record_success(time.monotonic() - started)
+            LLM_REQUEST_FAILURES.inc(backend='mistral')
+            raise
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            LLM_REQUEST_FAILURES.inc(backend='mistral')
+            raise
+        except ValueError:
+            # Сервис ответил, но содержимое некорректно - это не отказ зависимости
+            self.breaker.record_success(time.monotonic() - started)
+            LLM_REQUEST_FAILURES.inc(backend='mistral')
+            raise
+        except Exception:
+            # Ответ непредвиденной формы (например, событие с ошибкой вместо choices)
+            self.breaker.record_failure()
+            LLM_REQUEST_FAILURES.inc(backend='mistral')
+            raise
+
+        self.breaker.record_success(time.monotonic() - started)
+        LLM_REQUEST_SECONDS.observe(time.monotonic() - started, backend='mistral')
+        if parser.result is None:
+            raise ValueError(f"JSON не найден в ответе: {parser.text()}")
+        return parser.result
+
     async def extract_event_data(self, text: str, user_timezone: str = 'UTC') -> dict:
+        """Извлекает одно (первое) событие из текста"""
+        events = await self.extract_events(text, user_timezone)
+        return events[0]
+
+    def _localize_event(self, event_data: dict, local_tz, current_time: datetime) -> dict:
+        """Переводит время события из часового пояса пользователя в UTC"""
+        event_dt = datetime.strptime(event_data['datetime'], '%Y-%m-%d %H:%M')
+        local_dt = local_tz.localize(event_dt)
+        logger.info(f"Локальное время события: {local_dt}")
+        
+        # Если дата уже прошла в этом году, добавляем год
+        if local_dt < current_time:
+            next_year = current_time.year + 1
+            local_dt = local_dt.replace(year=next_year)
+            logger.info(f"Дата в прошлом, перенесено на следующий год: {local_dt}")
+        
+        # Конвертируем в UTC для хранения
+        utc_dt = local_dt.astimezone(pytz.UTC)
+        return {
+            'description': event_data['description'],
+            'datetime': utc_dt.strftime('%Y-%m-%d %H:%M')
+        }
+
+    # Системный промпт общий для одиночных и пакетных запросов
+    SYSTEM_PROMPT = (
+        "Ты - ассистент, который извлекает информацию о событиях из текста. "
+        "Всегда отвечай в формате JSON с полем 'events' - списком событий, "
+        "у каждого события поля 'description' и 'datetime'. "
+        "Если в тексте упомянуто несколько событий, верни каждое отдельным элементом списка. "
+        "Поле datetime должно быть в формате 'YYYY-MM-DD HH:MM'. "
+        "Описание события должно быть максимально кратким (2-4 слова), отражая только суть. "
+        "Всегда используй предоставленное текущее время как точку отсчета для расчетов. "
+        "Если указано конкретное время (например, '3 часа дня', '15:00', 'три часа дня'), "
+        "используй именно это время, а не 00:00."
+    )
+    
+    RULES_PROMPT = (
+        "Правила обработки времени:\n"
+        "1. Если указано '3 дня' - это 15:00\n"
+        "2. Если указано 'три часа' - это 15:00\n"
+        "3. Всегда используй 24-часовой формат\n"
+        "4. Никогда не используй 00:00, если время не указано явно\n\n"
+        "Примеры обработки времени:\n"
+        "- 'завтра в 3 дня' -> завтрашняя дата в 15:00\n"
+        "- 'послезавтра в военкомат в 3 дня' -> дата через 2 дня в 15:00\n"
+        "- 'встреча в 3 часа' -> сегодня в 15:00\n"
+        "- 'в три часа дня' -> сегодня в 15:00\n\n"
+        "Правила обработки описания:\n"
+        "1. Описание должно быть максимально кратким (2-4 слова)\n"
+        "2. Используй существительные и глаголы\n"
+        "3. Убирай все лишние детали\n"
+        "4. Оставляй только главную суть события\n\n"
+        "Примеры описаний:\n"
+        "- 'Нужно купить хлеба и молока в магазине' -> 'Купить продукты'\n"
+        "- 'Встреча с Иваном Петровичем по поводу проекта' -> 'Встреча по проекту'\n"
+        "- 'Не забыть забрать вещи из химчистки на улице Ленина' -> 'Забрать химчистку'\n"
+        "- 'Записаться к стоматологу на осмотр' -> 'Визит к стоматологу'\n"
+        "- 'Послезавтра в военкомат в 3 дня' -> 'Посещение военкомата'\n\n"
+        "Несколько событий в одном тексте:\n"
+        "- 'завтра в 9 врач, в 15 встреча' -> два события: 'Визит к врачу' завтра в 09:00 "
+        "и 'Встреча' завтра в 15:00\n\n"
+    )
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _payload(self, user_prompt: str, schema_name: str, schema: dict, max_tokens: int) -> dict:
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": 0.1,
+            "max_tokens": max_tokens,
+            "stream": True,
+            # Структурированный вывод: модель сразу отдает объект по схеме, без markdown
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": schema_name, "schema": schema, "strict": True}
+            }
+        }
+        
+        logger.info("Отправляем запрос к Mistral AI:")
+        logger.info(f"Используемая модель: {self.model}")
+        logger.info(f"Температура: {payload['temperature']}")
+        logger.info(f"Максимум токенов: {payload['max_tokens']}")
+        return payload
+
+    def _localize_events(self, raw_events: list, local_tz, current_time: datetime) -> list:
+        events = [
+            self._localize_event(event_data, local_tz, current_time)
+            for event_data in raw_events
+            if all(key in event_data for key in ['description', 'datetime'])
+        ]
+        if not events:
+            raise ValueError("В ответе нет ни одного события")
+        return events
+
+    async def extract_events(self, text: str, user_timezone: str = 'UTC') -> list:
+        """Извлекает все события из текста одним запросом к модели"""
         logger.info(f"\n{'='*50}\nНовый запрос на обработку текста")
         logger.info(f"Входной текст: {text}")
         logger.info(f"Часовой пояс пользователя: {user_timezone}")
@@ -49,122 +248,106 @@ class EventExtractorMistral:
         current_time = datetime.now(local_tz)
         logger.info(f"Текущее время пользователя: {current_time}")
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Формируем промпт для модели
-        system_prompt = (
-            "Ты - ассистент, который извлекает информацию о событиях из текста. "
-            "Всегда отвечай в формате JSON с полями 'description' и 'datetime'. "
-            "Поле datetime должно быть в формате 'YYYY-MM-DD HH:MM'. "
-            "Описание события должно быть максимально кратким (2-4 слова), отражая только суть. "
-            "Всегда используй предоставленное текущее время как точку отсчета для расчетов. "
-            "Если указано конкретное время (например, '3 часа дня', '15:00', 'три часа дня'), "
-            "используй именно это время, а не 00:00."
-        )
-        
         user_prompt = (
             f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M')}\n"
             f"Текущий год: {current_time.year}\n"
             f"Часовой пояс пользователя: {user_timezone}\n"
             f"Текст: {text}\n\n"
-            "Правила обработки времени:\n"
-            "1. Если указано '3 дня' - это 15:00\n"
-            "2. Если указано 'три часа' - это 15:00\n"
-            "3. Всегда используй 24-часовой формат\n"
-            "4. Никогда не используй 00:00, если время не указано явно\n\n"
-            "Примеры обработки времени:\n"
-            "- 'завтра в 3 дня' -> завтрашняя дата в 15:00\n"
-            "- 'послезавтра в военкомат в 3 дня' -> дата через 2 дня в 15:00\n"
-            "- 'встреча в 3 часа' -> сегодня в 15:00\n"
-            "- 'в три часа дня' -> сегодня в 15:00\n\n"
-            "Правила обработки описания:\n"
-            "1. Описание должно быть максимально кратким (2-4 слова)\n"
-            "2. Используй существительные и глаголы\n"
-            "3. Убирай все лишние детали\n"
-            "4. Оставляй только главную суть события\n\n"
-            "Примеры описаний:\n"
-            "- 'Нужно купить хлеба и молока в магазине' -> 'Купить продукты'\n"
-            "- 'Встреча с Иваном Петровичем по поводу проекта' -> 'Встреча по проекту'\n"
-            "- 'Не забыть забрать вещи из химчистки на улице Ленина' -> 'Забрать химчистку'\n"
-            "- 'Записаться к стоматологу на осмотр' -> 'Визит к стоматологу'\n"
-            "- 'Послезавтра в военкомат в 3 дня' -> 'Посещение военкомата'\n\n"
+            + self.RULES_PROMPT +
             "Верни строго в формате JSON:\n"
             "{\n"
-            '    "description": "краткое описание",\n'
-            '    "datetime": "YYYY-MM-DD HH:MM"\n'
+            '    "events": [\n'
+            '        {"description": "краткое описание", "datetime": "YYYY-MM-DD HH:MM"}\n'
+            "    ]\n"
             "}"
         )
         
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.1,
-            "max_tokens": 100
-        }
-        
-        logger.info("Отправляем запрос к Mistral AI:")
-        logger.info(f"Используемая модель: {self.model}")
-        logger.info(f"Температура: {payload['temperature']}")
-        logger.info(f"Максимум токенов: {payload['max_tokens']}")
+        payload = self._payload(user_prompt, "events", EVENTS_JSON_SCHEMA, max_tokens=self.max_tokens)
         
         try:
-            logger.info("Отправка запроса к API...")
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            logger.info("Получен ответ от API:")
-            logger.info(f"Полный ответ: {json.dumps(result, indent=2, ensure_ascii=False)}")
-            
-            # Извлекаем JSON из ответа модели
-            content = result["choices"][0]["message"]["content"]
-            logger.info(f"Извлеченный контент: {content}")
+            logger.info("Отправка потокового запроса к API...")
+            parser = IncrementalJSONParser(required_keys=('events',))
+            # Сетевой запрос выполняем в потоке, чтобы не блокировать цикл событий
+            result = await asyncio.to_thread(self._stream_completion, self._headers(), payload, parser)
+            logger.info(f"Распарсенные данные: {result}")
             
-            # Очищаем контент от markdown-разметки
-            content = content.replace("```json", "").replace("```", "").strip()
-            logger.info(f"Очищенный контент: {content}")
+            events = self._localize_events(result['events'], local_tz, current_time)
             
-            event_data = json.loads(content)
-            logger.info(f"Распарсенные данные события: {event_data}")
-            
-            # Проверяем наличие необходимых полей
-            if not all(key in event_data for key in ['description', 'datetime']):
-                logger.error("Отсутствуют необходимые поля в ответе")
-                raise ValueError("Отсутствуют необходимые поля в ответе")
-            
-            # Преобразуем дату с учетом часового пояса
-            event_dt = datetime.strptime(event_data['datetime'], '%Y-%m-%d %H:%M')
-            local_dt = local_tz.localize(event_dt)
-            logger.info(f"Локальное время события: {local_dt}")
-            
-            # Если дата уже прошла в этом году, добавляем год
-            if local_dt < current_time:
-                next_year = current_time.year + 1
-                local_dt = local_dt.replace(year=next_year)
-                logger.info(f"Дата в прошлом, перенесено на следующий год: {local_dt}")
-            
-            # Конвертируем в UTC для хранения
-            utc_dt = local_dt.astimezone(pytz.UTC)
-            event_data['datetime'] = utc_dt.strftime('%Y-%m-%d %H:%M')
-            
-            logger.info(f"Итоговые данные события: {event_data}")
+            logger.info(f"Итоговые данные событий: {events}")
             logger.info(f"{'='*50}\n")
             
-            return event_data
+            return events
             
+        except CircuitOpenError:
+            logger.warning("Автомат разомкнут, запрос к Mistral AI не отправлен")
+            raise
         except Exception as e:
             logger.error(f"Ошибка при обработке: {str(e)}")
             logger.error(f"Исходный текст: {text}")
             logger.exception("Полный стек ошибки:")
-            raise ValueError(f"Не удалось распознать дату и время события: {str(e)}") 
\ No newline at end of file
+            raise ValueError(f"Не удалось распознать дату и время события: {str(e)}")
+
+    async def extract_events_batch(self, items: list) -> list:
+        """Извлекает события для нескольких текстов одним запросом к модели.
+        items - список (text, user_timezone); возвращает для каждого элемента
+        список событий или исключение, если этот элемент разобрать не удалось"""
+        logger.info(f"\n{'='*50}\nПакетный запрос на обработку {len(items)} текстов")
+        
+        contexts = []
+        texts_prompt = ""
+        for index, (text, user_timezone) in enumerate(items):
+            local_tz = pytz.timezone(user_timezone)
+            current_time = datetime.now(local_tz)
+            contexts.append((local_tz, current_time))
+            texts_prompt += (
+                f"Текст #{index}\n"
+                f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M')}\n"
+                f"Текущий год: {current_time.year}\n"
+                f"Часовой пояс пользователя: {user_timezone}\n"
+                f"Текст: {text}\n\n"
+            )
+        
+        user_prompt = (
+            "Ниже несколько независимых текстов от разных пользователей. "
+            "Обработай каждый отдельно, используя его собственное текущее время.\n\n"
+            + texts_prompt
+            + self.RULES_PROMPT +
+            "Верни строго в формате JSON, по одному элементу results на каждый текст, "
+            "где id - номер текста:\n"
+            "{\n"
+            '    "results": [\n'
+            '        {"id": 0, "events": [{"description": "краткое описание", "datetime": "YYYY-MM-DD HH:MM"}]}\n'
+            "    ]\n"
+            "}"
+        )
+        
+        payload = self._payload(user_prompt, "batch_events", BATCH_EVENTS_JSON_SCHEMA, max_tokens=self.max_tokens // 2 * len(items))
+        
+        try:
+            parser = IncrementalJSONParser(required_keys=('results',))
+            result = await asyncio.to_thread(self._stream_completion, self._headers(), payload, parser)
+            logger.info(f"Распарсенные данные пакета: {result}")
+        except CircuitOpenError:
+            logger.warning("Автомат разомкнут, пакетный запрос к Mistral AI не отправлен")
+            raise
+        except Exception as e:
+            logger.exception("Ошибка пакетного запроса:")
+            raise ValueError(f"Не удалось распознать дату и время события: {str(e)}")
+        
+        # Раскладываем ответ обратно по исходным запросам
+        raw_by_id = {
+            item.get('id'): item.get('events', [])
+            for item in result['results']
+            if isinstance(item, dict)
+        }
+        outcomes = []
+        for index, (local_tz, current_time) in enumerate(contexts):
+            try:
+                if index not in raw_by_id:
+                    raise ValueError("Модель не вернула результат для этого текста")
+                outcomes.append(self._localize_events(raw_by_id[index], local_tz, current_time))
+            except Exception as e:
+                outcomes.append(ValueError(f"Не удалось распознать дату и время события: {str(e)}"))
+        
+        logger.info(f"{'='*50}\n")
+        return outcomes
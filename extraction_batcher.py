@@ -0,0 +1,81 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('ExtractionBatcher')
+
+
+class ExtractionBatcher:
+    """Микропакетирование запросов к экстрактору событий.
+
+    Одновременные вызовы extract_events копятся не дольше max_delay секунд
+    (или до max_batch_size штук) и уходят в модель одним запросом через
+    extractor.extract_events_batch; результаты раздаются ожидающим вызовам.
+    Интерфейс совпадает с экстрактором, поэтому батчер подставляется вместо него."""
+
+    def __init__(self, extractor, max_delay: float = 0.02, max_batch_size: int = 8):
+        self.extractor = extractor
+        self.breaker = extractor.breaker
+        self.max_delay = max_delay
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._timer = None
+        # Ссылки на запущенные пакеты, чтобы задачи не собрал сборщик мусора
+        self._tasks = set()
+
+    def set_max_tokens(self, max_tokens: int = None):
+        self.extractor.set_max_tokens(max_tokens)
+
+    async def extract_event_data(self, text: str, user_timezone: str = 'UTC') -> dict:
+        """Извлекает одно (первое) событие из текста"""
+        events = await self.extract_events(text, user_timezone)
+        return events[0]
+
+    async def extract_events(self, text: str, user_timezone: str = 'UTC') -> list:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, user_timezone, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list):
+        logger.info(f"Отправка пакета из {len(batch)} запросов")
+        try:
+            try:
+                if len(batch) == 1:
+                    # Одиночный запрос не оборачиваем в пакетный промпт
+                    text, user_timezone, _ = batch[0]
+                    outcomes = [await self.extractor.extract_events(text, user_timezone)]
+                else:
+                    outcomes = await self.extractor.extract_events_batch(
+                        [(text, user_timezone) for text, user_timezone, _ in batch]
+                    )
+            except Exception as e:
+                outcomes = [e] * len(batch)
+
+            for (_, _, future), outcome in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+        finally:
+            # Пакет отменен или вернул меньше результатов - ожидающие не должны висеть
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Запрос к модели прерван, попробуйте еще раз"))
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+logger = logging.getLogger('FSMStorage')
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite.
+
+    Состояния переживают перезапуск и доступны всем процессам бота,
+    работающим с одним файлом. При flush_interval = 0 каждое изменение
+    записывается до возврата из set_state/set_data (одновременные изменения
+    все равно попадают в одну транзакцию писателя), и следующее обновление
+    пользователя может обработать любой процесс. При flush_interval > 0
+    записи копятся в памяти и сбрасываются раз в flush_interval секунд -
+    до сброса их видит только этот процесс, поэтому такой режим подходит
+    для одного процесса. Чтение сначала смотрит в несброшенный буфер, база
+    читается в потоке, не блокируя цикл событий. Если передана database
+    с запущенным писателем, запись идет через него вместе с остальными
+    изменениями базы. Состояния, не менявшиеся дольше ttl секунд,
+    считаются брошенными и удаляются."""
+
+    def __init__(self, db_path: str, ttl: float = 86400, flush_interval: float = 0,
+                 sweep_interval: float = 600, database=None):
+        self.db_path = db_path
+        self.database = database
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        # key -> {'state': ..., 'data': ...}; отсутствующее поле значит "не менялось"
+        self._pending = {}
+        # Изменения, которые прямо сейчас записываются в базу (от старых к новым)
+        self._inflight = []
+        self._flush_task = None
+        self._last_sweep = time.time()
+        self._create_table()
+
+    def _create_table(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at
+                ON fsm_states (updated_at)
+            """)
+            conn.commit()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.destiny}"
+
+    async def _buffer(self, key: StorageKey, field: str, value):
+        self._pending.setdefault(self._key(key), {})[field] = value
+        if self.flush_interval <= 0:
+            await self.flush()
+            if not self._pending:
+                return
+            # Запись не удалась - изменения остались в буфере, повторим позже
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _buffered(self, key: str, field: str):
+        """Несохраненное значение поля: (True, значение) или (False, None)"""
+        for buffer in (self._pending, *reversed(self._inflight)):
+            fields = buffer.get(key, {})
+            if field in fields:
+                return True, fields[field]
+        return False, None
+
+    def _read(self, key: str):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT state, data FROM fsm_states
+                WHERE key = ? AND updated_at >= ?
+            """, (key, time.time() - self.ttl))
+            return cursor.fetchone()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._buffer(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        found, state = self._buffered(self._key(key), 'state')
+        if found:
+            return state
+        row = await asyncio.to_thread(self._read, self._key(key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._buffer(key, 'data', data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        found, data = self._buffered(self._key(key), 'data')
+        if found:
+            return data.copy()
+        row = await asyncio.to_thread(self._read, self._key(key))
+        return json.loads(row[1]) if row else {}
+
+    async def _flush_later(self):
+        # Повторяем, пока буфер не опустеет: записи могли прийти во время сброса.
+        # В режиме записи сразу сюда попадают только неудавшиеся записи - повтор через секунду
+        while self._pending:
+            await asyncio.sleep(self.flush_interval or 1)
+            await self.flush()
+
+    async def flush(self):
+        """Сбрасывает накопленные изменения в базу одной транзакцией"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._inflight.append(pending)
+        try:
+            await self._execute(lambda conn: self._write(conn, pending))
+        except Exception:
+            logger.exception("Ошибка записи состояний FSM")
+            # Возвращаем несохраненные изменения, не затирая более новые
+            for key, fields in pending.items():
+                merged = dict(fields)
+                merged.update(self._pending.get(key, {}))
+                self._pending[key] = merged
+            return
+        finally:
+            self._inflight.remove(pending)
+
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = time.time()
+            await self._execute(self.sweep)
+
+    async def _execute(self, fn):
+        """Выполняет изменение fn(conn) через писателя базы, если он запущен,
+        иначе отдельной транзакцией в потоке"""
+        writer = self.database.writer if self.database is not None else None
+        if writer is not None:
+            return await writer.submit(self.db_path, fn)
+
+        def run():
+            with sqlite3.connect(self.db_path) as conn:
+                return fn(conn)
+
+        return await asyncio.to_thread(run)
+
+    def _write(self, conn, pending: dict):
+        """Записывает накопленные изменения; фиксацию выполняет вызывающий"""
+        now = time.time()
+        state_rows = [
+            (key, fields['state'], now)
+            for key, fields in pending.items() if 'state' in fields
+        ]
+        data_rows = [
+            (key, json.dumps(fields['data'], ensure_ascii=False), now)
+            for key, fields in pending.items() if 'data' in fields
+        ]
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO fsm_states (key, state, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, state_rows)
+        cursor.executemany("""
+            INSERT INTO fsm_states (key, data, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        """, data_rows)
+        # Пустые записи (состояние сброшено, данных нет) хранить незачем
+        cursor.executemany("""
+            DELETE FROM fsm_states
+            WHERE key = ? AND state IS NULL AND data = '{}'
+        """, [(key,) for key in pending])
+
+    def sweep(self, conn) -> int:
+        """Удаляет состояния, не менявшиеся дольше ttl; фиксацию выполняет вызывающий"""
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM fsm_states WHERE updated_at < ?
+        """, (time.time() - self.ttl,))
+        if cursor.rowcount:
+            logger.info(f"Удалено устаревших состояний FSM: {cursor.rowcount}")
+        return cursor.rowcount
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
@@ -0,0 +1,161 @@
+"""Чтение и запись календарей в формате iCalendar (.ics, RFC 5545).
+
+Поддерживается то, что нужно для переноса напоминаний: события VEVENT с
+SUMMARY и DTSTART. Правила повторения (RRULE) не разворачиваются - берется
+первое наступление события."""
+from datetime import datetime
+import pytz
+
+# Время суток для событий на весь день (DTSTART;VALUE=DATE)
+ALL_DAY_TIME = (9, 0)
+# Более длинные названия обрезаются
+MAX_SUMMARY_LENGTH = 500
+
+
+class ICSError(ValueError):
+    """Событие календаря, которое нельзя превратить в напоминание"""
+
+
+def unfold_lines(lines):
+    """Склеивает перенесенные строки: продолжение начинается с пробела или табуляции"""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def _parse_property(line: str):
+    """'NAME;PARAM=VALUE:значение' -> ('NAME', {'PARAM': 'VALUE'}, 'значение')"""
+    head, sep, value = line.partition(':')
+    if not sep:
+        raise ICSError(f"Некорректная строка: {line[:50]}")
+    name, *params = head.split(';')
+    parameters = {}
+    for param in params:
+        key, _, param_value = param.partition('=')
+        parameters[key.upper()] = param_value.strip('"')
+    return name.upper(), parameters, value
+
+
+def _unescape(value: str) -> str:
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            escaped = next(chars, '')
+            result.append('\n' if escaped in ('n', 'N') else escaped)
+        else:
+            result.append(char)
+    return ''.join(result)
+
+
+def _escape(value: str) -> str:
+    return (value.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _parse_dtstart(parameters: dict, value: str, default_timezone: str) -> str:
+    """Время начала события в UTC в формате базы ("YYYY-MM-DD HH:MM")"""
+    try:
+        if parameters.get('VALUE') == 'DATE' or len(value) == 8:
+            day = datetime.strptime(value, '%Y%m%d')
+            local = day.replace(hour=ALL_DAY_TIME[0], minute=ALL_DAY_TIME[1])
+            utc_time = pytz.timezone(default_timezone).localize(local).astimezone(pytz.UTC)
+        elif value.endswith('Z'):
+            utc_time = pytz.UTC.localize(datetime.strptime(value, '%Y%m%dT%H%M%SZ'))
+        else:
+            local = datetime.strptime(value, '%Y%m%dT%H%M%S')
+            try:
+                tz = pytz.timezone(parameters.get('TZID', default_timezone))
+            except pytz.UnknownTimeZoneError:
+                # Нестандартные имена поясов (например, из Outlook) - считаем временем пользователя
+                tz = pytz.timezone(default_timezone)
+            utc_time = tz.localize(local).astimezone(pytz.UTC)
+    except ValueError:
+        raise ICSError(f"Некорректное время начала: {value}")
+    return utc_time.strftime('%Y-%m-%d %H:%M')
+
+
+def parse_events(lines, default_timezone: str = 'UTC'):
+    """Потоково разбирает календарь, по одному событию за раз.
+
+    lines - любой итерируемый источник строк (например, открытый файл).
+    Для каждого VEVENT выдает словарь {"description", "datetime"} или ICSError,
+    если событие некорректно; разбор продолжается со следующего события."""
+    event = None
+    # Вложенные компоненты события (VALARM) со своими SUMMARY и DESCRIPTION пропускаем
+    nested = 0
+    for line in unfold_lines(lines):
+        if not line:
+            continue
+        try:
+            name, parameters, value = _parse_property(line)
+        except ICSError as e:
+            if event is not None:
+                event['error'] = e
+            continue
+
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event, nested = {}, 0
+        elif event is not None and name == 'BEGIN':
+            nested += 1
+        elif event is not None and name == 'END' and value.upper() != 'VEVENT':
+            nested -= 1
+        elif name == 'END' and value.upper() == 'VEVENT' and event is not None:
+            if 'error' in event:
+                yield event['error']
+            elif not event.get('description'):
+                yield ICSError("Событие без названия (SUMMARY)")
+            elif 'datetime' not in event:
+                yield ICSError(f"Событие «{event['description']}» без времени начала (DTSTART)")
+            else:
+                yield {"description": event['description'], "datetime": event['datetime']}
+            event = None
+        elif event is not None and not nested and 'error' not in event:
+            if name == 'SUMMARY':
+                event['description'] = _unescape(value).strip()[:MAX_SUMMARY_LENGTH]
+            elif name == 'DTSTART':
+                try:
+                    event['datetime'] = _parse_dtstart(parameters, value, default_timezone)
+                except ICSError as e:
+                    event['error'] = e
+
+
+def _fold(line: str):
+    """Переносит строку длиннее 75 байт (RFC 5545, 3.1), не разрывая символы UTF-8"""
+    chunk, size = '', 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            yield chunk + '\r\n'
+            chunk, size = ' ', 1
+        chunk += char
+        size += char_size
+    yield chunk + '\r\n'
+
+
+def export_lines(reminders, stamp: datetime = None):
+    """Строки календаря для напоминаний (id, description, event_datetime в UTC).
+
+    reminders может быть ленивым итератором - строки выдаются по мере чтения."""
+    stamp = (stamp or datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ')
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield 'VERSION:2.0\r\n'
+    yield 'PRODID:-//ReminderBot//RU\r\n'
+    for reminder_id, description, event_datetime in reminders:
+        start = datetime.strptime(event_datetime, '%Y-%m-%d %H:%M').strftime('%Y%m%dT%H%M%SZ')
+        yield 'BEGIN:VEVENT\r\n'
+        yield f'UID:reminder-{reminder_id}@reminderbot\r\n'
+        yield f'DTSTAMP:{stamp}\r\n'
+        yield f'DTSTART:{start}\r\n'
+        yield from _fold(f'SUMMARY:{_escape(description)}')
+        yield 'END:VEVENT\r\n'
+    yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from metrics import Gauge, Histogram, Counter
+
+logger = logging.getLogger('JobQueue')
+
+JOB_QUEUE_DEPTH = Gauge('reminderbot_job_queue_depth', 'Тяжелые задачи, ожидающие выполнения')
+JOB_QUEUE_ACTIVE = Gauge('reminderbot_job_queue_active', 'Тяжелые задачи, выполняемые воркерами')
+JOB_WAIT_SECONDS = Histogram('reminderbot_job_wait_seconds', 'Время ожидания задачи в очереди')
+JOB_RUN_SECONDS = Histogram('reminderbot_job_run_seconds', 'Время выполнения задачи')
+JOB_FAILURES = Counter('reminderbot_job_failures_total', 'Задачи, завершившиеся исключением')
+
+
+class JobQueue:
+    """Фоновое выполнение тяжелых задач (голос, LLM) ограниченным пулом воркеров.
+
+    У каждого пользователя своя FIFO-очередь: его задачи выполняются строго
+    по порядку и не более одной одновременно, а задачи разных пользователей
+    распределяются между воркерами."""
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self._queues = {}  # user_id -> deque[(job, enqueued_at)]
+        self._ready = asyncio.Queue()  # пользователи, чью следующую задачу можно брать
+        self._tasks = []
+        self._depth = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self) -> int:
+        """Количество задач, ожидающих выполнения"""
+        return self._depth
+
+    def submit(self, user_id: int, job) -> int:
+        """Ставит задачу (функцию без аргументов, возвращающую корутину) в очередь
+        пользователя; возвращает количество задач перед ней у этого пользователя"""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            # Пользователя нет ни в ready, ни в работе - ставим его в очередь на обслуживание
+            queue = self._queues[user_id] = deque()
+            self._ready.put_nowait(user_id)
+        queue.append((job, time.monotonic()))
+        self._depth += 1
+        JOB_QUEUE_DEPTH.set(self._depth)
+        return len(queue) - 1
+
+    async def _worker(self):
+        while True:
+            user_id = await self._ready.get()
+            queue = self._queues[user_id]
+            job, enqueued_at = queue.popleft()
+            self._depth -= 1
+            JOB_QUEUE_DEPTH.set(self._depth)
+            JOB_WAIT_SECONDS.observe(time.monotonic() - enqueued_at)
+
+            JOB_QUEUE_ACTIVE.inc()
+            started = time.monotonic()
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                JOB_FAILURES.inc()
+                logger.exception(f"Ошибка фоновой задачи пользователя {user_id}")
+            finally:
+                JOB_QUEUE_ACTIVE.dec()
+                JOB_RUN_SECONDS.observe(time.monotonic() - started)
+                # Следующая задача пользователя становится доступной только после текущей
+                if queue:
+                    self._ready.put_nowait(user_id)
+                else:
+                    del self._queues[user_id]
@@ -0,0 +1,109 @@
+import json
+from metrics import Counter, Histogram
+
+# Метрики запросов к языковым моделям, общие для всех экстракторов (метка backend)
+LLM_REQUEST_SECONDS = Histogram('reminderbot_llm_request_seconds', 'Длительность запроса к языковой модели')
+LLM_REQUEST_FAILURES = Counter('reminderbot_llm_request_failures_total', 'Неудачные запросы к языковой модели')
+
+# JSON-схема ответа модели: запрашивается у провайдеров, поддерживающих
+# структурированный вывод, чтобы модель не тратила токены на лишний текст
+EVENT_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string"},
+        "datetime": {"type": "string"}
+    },
+    "required": ["description", "datetime"],
+    "additionalProperties": False
+}
+
+# Схема ответа со списком событий - одно сообщение может содержать несколько
+EVENTS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "events": {"type": "array", "items": EVENT_JSON_SCHEMA}
+    },
+    "required": ["events"],
+    "additionalProperties": False
+}
+
+# Схема ответа на пакетный запрос: события для каждого текста по его номеру
+BATCH_EVENTS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "events": {"type": "array", "items": EVENT_JSON_SCHEMA}
+                },
+                "required": ["id", "events"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+
+
+class IncrementalJSONParser:
+    """Инкрементальный разбор первого JSON-объекта из потока текста.
+
+    Куски ответа подаются через feed(); как только закрывается внешняя
+    фигурная скобка, метод возвращает разобранный объект, и поток можно
+    прерывать. Текст до объекта (например, ```json) пропускается."""
+
+    def __init__(self, required_keys=()):
+        self.required_keys = tuple(required_keys)
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.result = None
+
+    def feed(self, chunk: str):
+        """Добавляет очередной кусок текста; возвращает объект, если он уже собран"""
+        if self.result is not None:
+            return self.result
+
+        for char in chunk:
+            if not self._started:
+                if char != '{':
+                    continue
+                self._started = True
+
+            self._buffer.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._complete()
+        return None
+
+    def _complete(self):
+        obj = json.loads(''.join(self._buffer))
+        if not isinstance(obj, dict) or not all(key in obj for key in self.required_keys):
+            raise ValueError("Отсутствуют необходимые поля в ответе")
+        self.result = obj
+        return obj
+
+    def text(self) -> str:
+        """Собранный на данный момент текст объекта (для логов)"""
+        return ''.join(self._buffer)
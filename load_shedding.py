@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from metrics import Gauge
+
+logger = logging.getLogger('LoadShedder')
+
+DEGRADATION_LEVEL = Gauge('reminderbot_degradation_level', 'Текущий уровень деградации при перегрузке')
+EVENT_LOOP_LAG_SECONDS = Gauge('reminderbot_event_loop_lag_seconds', 'Сглаженная задержка цикла событий')
+
+
+class LoadShedder:
+    """Ступенчатая деградация при перегрузке.
+
+    Уровень определяется глубиной очереди тяжелых задач и задержкой цикла
+    событий: уровень N включается, когда любая из величин достигла своего
+    N-го порога. Повышение уровня происходит сразу, понижение - по одной
+    ступени и только после cooldown секунд ниже порога, чтобы режимы не
+    переключались туда-обратно на границе."""
+
+    NORMAL = 0
+    # Сначала пробуем локальный разбор времени, модель - только если он не справился
+    LOCAL_PARSER = 1
+    # Длинные голосовые сообщения не принимаем
+    SHORT_VOICE = 2
+    # Уменьшенный max_tokens у модели
+    REDUCED_TOKENS = 3
+    # Новые тяжелые задачи не принимаем
+    REJECT = 4
+
+    LEVEL_NAMES = {
+        NORMAL: 'normal',
+        LOCAL_PARSER: 'local_parser',
+        SHORT_VOICE: 'short_voice',
+        REDUCED_TOKENS: 'reduced_tokens',
+        REJECT: 'reject',
+    }
+
+    def __init__(self, queue_depth, depth_thresholds: tuple = (8, 16, 32, 64),
+                 lag_thresholds: tuple = (0.2, 0.5, 1.0, 2.0), cooldown: float = 30,
+                 interval: float = 0.5, smoothing: float = 0.3):
+        """queue_depth - функция без аргументов, возвращающая глубину очереди;
+        пороги задаются для уровней 1..4 по возрастанию"""
+        self.queue_depth = queue_depth
+        self.depth_thresholds = depth_thresholds
+        self.lag_thresholds = lag_thresholds
+        self.cooldown = cooldown
+        self.interval = interval
+        self.smoothing = smoothing
+        self.level = self.NORMAL
+        self.lag = 0.0
+        self._below_since = None
+        self._listeners = []
+
+    def on_change(self, listener):
+        """Подписывает listener(level) на смену уровня"""
+        self._listeners.append(listener)
+
+    def target_level(self) -> int:
+        depth = self.queue_depth()
+        level = self.NORMAL
+        for index, (depth_threshold, lag_threshold) in enumerate(
+                zip(self.depth_thresholds, self.lag_thresholds), start=1):
+            if depth >= depth_threshold or self.lag >= lag_threshold:
+                level = index
+        return level
+
+    def update(self, now: float = None):
+        """Пересчитывает уровень по текущей нагрузке"""
+        now = time.monotonic() if now is None else now
+        target = self.target_level()
+        if target > self.level:
+            self._set_level(target)
+            self._below_since = None
+        elif target < self.level:
+            if self._below_since is None:
+                self._below_since = now
+            elif now - self._below_since >= self.cooldown:
+                self._set_level(self.level - 1)
+                self._below_since = now if target < self.level else None
+        else:
+            self._below_since = None
+
+    def _set_level(self, level: int):
+        previous, self.level = self.level, level
+        DEGRADATION_LEVEL.set(level)
+        log = logger.warning if level > previous else logger.info
+        log(f"Режим работы: {self.LEVEL_NAMES[previous]} -> {self.LEVEL_NAMES[level]} "
+            f"(очередь {self.queue_depth()}, задержка цикла {self.lag:.2f} с)")
+        for listener in self._listeners:
+            listener(level)
+
+    async def run(self):
+        """Измеряет задержку цикла событий и обновляет уровень; работает до отмены"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.lag = self.smoothing * lag + (1 - self.smoothing) * self.lag
+            EVENT_LOOP_LAG_SECONDS.set(round(self.lag, 4))
+            self.update()
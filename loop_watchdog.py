@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger('Watchdog')
+
+LOOP_STALLS = Counter('reminderbot_event_loop_stalls_total', 'Зависания цикла событий дольше порога')
+LOOP_STALL_SECONDS = Histogram(
+    'reminderbot_event_loop_stall_seconds',
+    'Длительность зависаний цикла событий',
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+LOOP_HEARTBEAT_AGE = Gauge('reminderbot_event_loop_heartbeat_age_seconds', 'Время с последнего отклика цикла событий')
+
+
+class _LivenessHandler(BaseHTTPRequestHandler):
+    """GET /health/live: ответ формирует поток сервера, а не цикл событий"""
+
+    def do_GET(self):
+        if self.path != '/health/live':
+            self.send_error(404)
+            return
+        ok, details = self.server.check()
+        body = json.dumps({'ok': ok, **details}, ensure_ascii=False).encode('utf-8')
+        self.send_response(200 if ok else 503)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LoopWatchdog:
+    """Сторож цикла событий.
+
+    Корутина в цикле отмечается каждые interval секунд. Отдельный поток
+    проверяет отметки: если цикл не отвечает дольше threshold секунд, поток
+    снимает стек потока цикла и пишет в лог, какой вызов его блокирует.
+    Пока зависание продолжается, стек повторно снимается раз в threshold
+    секунд - так видно, меняется ли блокирующий вызов.
+
+    Проверку живости (serve_liveness) обслуживает отдельный HTTP-сервер в
+    своем потоке: сервер в цикле событий при зависшем цикле просто не
+    ответил бы, и отличить зависание от медленного ответа было бы нельзя."""
+
+    def __init__(self, threshold: float = 1.0, interval: float = 0.1, stack_limit: int = 30):
+        self.threshold = threshold
+        self.interval = interval
+        self.stack_limit = stack_limit
+        self.last_beat = time.monotonic()
+        # Последнее завершившееся зависание
+        self.last_stall = None  # (monotonic время окончания, длительность)
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._liveness_server = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def serve_liveness(self, host: str, port: int, check):
+        """Запускает GET /health/live в отдельном потоке; check() возвращает
+        (ok, подробности) и не должна обращаться к циклу событий"""
+        server = ThreadingHTTPServer((host, port), _LivenessHandler)
+        server.daemon_threads = True
+        server.check = check
+        threading.Thread(target=server.serve_forever, name='liveness-server', daemon=True).start()
+        self._liveness_server = server
+        logger.info(f"Проверка живости доступна на http://{host}:{port}/health/live")
+
+    async def stop(self):
+        if self._liveness_server is not None:
+            await asyncio.to_thread(self._liveness_server.shutdown)
+            self._liveness_server.server_close()
+            self._liveness_server = None
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, self.threshold + self.interval)
+            self._thread = None
+
+    def heartbeat_age(self) -> float:
+        """Сколько секунд цикл не отмечался"""
+        return time.monotonic() - self.last_beat
+
+    def is_responsive(self, max_age: float = None) -> bool:
+        """Цикл отмечался не дольше max_age (по умолчанию threshold) секунд назад"""
+        return self.heartbeat_age() < (self.threshold if max_age is None else max_age)
+
+    async def _heartbeat(self):
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "(стек недоступен)"
+        return ''.join(traceback.format_stack(frame, limit=self.stack_limit))
+
+    def _watch(self):
+        stalled_since = None  # last_beat, на котором цикл завис
+        reported_at = 0.0
+        while not self._stop.wait(self.interval):
+            beat = self.last_beat
+            age = time.monotonic() - beat
+            LOOP_HEARTBEAT_AGE.set(round(age, 3))
+
+            if stalled_since is not None and beat != stalled_since:
+                # Цикл снова отвечает - фиксируем длительность зависания
+                duration = beat - stalled_since
+                LOOP_STALL_SECONDS.observe(duration)
+                self.last_stall = (time.monotonic(), duration)
+                logger.warning(f"Цикл событий снова отвечает, зависание длилось {duration:.2f} с")
+                stalled_since = None
+
+            if age < self.threshold:
+                continue
+            now = time.monotonic()
+            if stalled_since is None:
+                stalled_since = beat
+                LOOP_STALLS.inc()
+            elif now - reported_at < self.threshold:
+                continue
+            reported_at = now
+            logger.warning(
+                f"Цикл событий не отвечает {age:.2f} с. Стек потока цикла:\n{self._loop_stack()}"
+            )
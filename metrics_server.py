@@ -0,0 +1,49 @@
+import logging
+from aiohttp import web
+from metrics import render_metrics
+
+logger = logging.getLogger('MetricsServer')
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с метриками процесса в формате Prometheus (GET /metrics)
+    и проверкой готовности (GET /health/ready).
+
+    Проверка - функция без аргументов, возвращающая (ok, подробности). Сервер
+    работает в том же цикле событий, что и бот, поэтому при зависшем цикле
+    он просто не ответит - для балансировщика это тоже "не готов". Живость
+    проверяет LoopWatchdog из своего потока."""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, ready_check=None):
+        self.ready_check = ready_check
+        self._runner = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/health/ready', self.handle_ready)
+        return app
+
+    @staticmethod
+    def _health_response(check) -> web.Response:
+        ok, details = check() if check else (True, {})
+        return web.json_response({'ok': ok, **details}, status=200 if ok else 503)
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        return self._health_response(self.ready_check)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=render_metrics().encode('utf-8'), headers={'Content-Type': self.CONTENT_TYPE})
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics, готовность - /health/ready")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,116 @@
+"""Разделяет существующую базу напоминаний на N шардов по user_id.
+
+Использование:
+    python migrate_shards.py reminders.db 4
+
+Создает файлы reminders.shard0.db ... reminders.shard3.db рядом с исходным.
+ID записей сохраняются, поэтому кнопки в уже отправленных сообщениях
+продолжают работать. Исходный файл не изменяется. После миграции
+запустите бота с DATABASE_SHARDS=4."""
+import sqlite3
+import sys
+from database import Database, reserve_reminder_ids
+
+# Таблицы с данными пользователей и их колонки; user_id определяет шард,
+# отсутствующие в исходной базе таблицы пропускаются
+TABLES = {
+    'reminders': ['id', 'user_id', 'description', 'event_datetime', 'created_at'],
+    'notifications': ['id', 'reminder_id', 'user_id', 'notify_datetime', 'description',
+                      'timing_description', 'is_sent', 'is_main', 'notification_type',
+                      'message_text', 'parse_mode'],
+    'reminders_archive': ['id', 'reminder_id', 'user_id', 'description', 'event_datetime',
+                          'created_at', 'archived_at'],
+    'user_settings': ['user_id', 'timezone'],
+    'voice_messages': ['id', 'user_id', 'ogg_path', 'wav_path', 'recognized_text',
+                       'timestamp', 'created_at', 'file_size'],
+    'id_mapping': ['user_id', 'real_id', 'display_id'],
+    'processed_messages': ['chat_id', 'message_id', 'result_text', 'reply_markup',
+                           'created_at', 'boot_id'],
+}
+
+# Таблицы без user_id и колонка, определяющая их шард: бот пишет отметки
+# о сообщениях в шард отправителя, а в личном чате chat_id совпадает с user_id
+SHARD_COLUMNS = {
+    'processed_messages': 'chat_id',
+}
+
+# Таблицы, которых Database больше не создает: в шардах их создает миграция,
+# если они есть в исходной базе (id_mapping нужна кнопкам старых сообщений /list)
+LEGACY_TABLES = {
+    'id_mapping': """
+        CREATE TABLE IF NOT EXISTS id_mapping (
+            user_id INTEGER NOT NULL,
+            real_id INTEGER NOT NULL,
+            display_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, display_id)
+        )
+    """,
+}
+
+# Колонки, которых нет в исходной базе старого формата, и их источник:
+# в старом архиве ID записи совпадал с ID напоминания
+FALLBACK_COLUMNS = {
+    ('reminders_archive', 'reminder_id'): 'id',
+}
+
+BATCH_SIZE = 1000
+
+
+def migrate(source_path: str, shards: int):
+    target = Database(source_path, shards=shards)
+    targets = [sqlite3.connect(path) for path in target.shard_paths]
+    try:
+        for conn in targets:
+            if conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]:
+                raise RuntimeError("Шарды уже содержат данные, миграция прервана")
+
+        with sqlite3.connect(source_path) as source:
+            for table, columns in TABLES.items():
+                # Исходная база может быть создана до появления части колонок
+                existing = {row[1] for row in source.execute(f"PRAGMA table_info({table})")}
+                if not existing:
+                    continue
+                if table in LEGACY_TABLES:
+                    for conn in targets:
+                        conn.execute(LEGACY_TABLES[table])
+                sources = {
+                    column: column if column in existing else FALLBACK_COLUMNS.get((table, column))
+                    for column in columns
+                }
+                columns = [column for column in columns if sources[column] in existing]
+                shard_column = columns.index(SHARD_COLUMNS.get(table, 'user_id'))
+                column_list = ', '.join(columns)
+                placeholders = ', '.join('?' for _ in columns)
+                insert = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+
+                select_list = ', '.join(sources[column] for column in columns)
+                cursor = source.execute(f"SELECT {select_list} FROM {table}")
+                copied = 0
+                while True:
+                    rows = cursor.fetchmany(BATCH_SIZE)
+                    if not rows:
+                        break
+                    by_shard = {}
+                    for row in rows:
+                        by_shard.setdefault(target.shard_index(row[shard_column]), []).append(row)
+                    for index, shard_rows in by_shard.items():
+                        targets[index].executemany(insert, shard_rows)
+                    copied += len(rows)
+                print(f"✅ {table}: перенесено {copied} записей")
+
+        # Фиксируем все шарды только после успешного копирования; ID из архива
+        # не должны достаться новым напоминаниям
+        for conn in targets:
+            reserve_reminder_ids(conn)
+            conn.commit()
+    finally:
+        for conn in targets:
+            conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    migrate(sys.argv[1], int(sys.argv[2]))
+    print("Готово. Запустите бота с DATABASE_SHARDS=" + sys.argv[2])
@@ -1,16 +1,52 @@
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.memory import MemoryJobStore
-from aiogram import Bot
+from aiogram import Bot, types
 import pytz
 import asyncio
-import sqlite3
+import time
+from config import (
+    MISSED_NOTIFICATION_POLICY, CATCHUP_BATCH_SIZE, CATCHUP_STALL_THRESHOLD, NOTIFICATION_SEND_RATE,
+    ARCHIVE_BATCH_SIZE, DB_VACUUM_INTERVAL, DB_VACUUM_PAGES, DB_ANALYZE_HOUR, IDEMPOTENCY_TTL
+)
+from metrics import Counter, Histogram
+
+NOTIFICATION_LATENESS_SECONDS = Histogram(
+    'reminderbot_notification_lateness_seconds',
+    'Задержка отправки уведомления относительно запланированного времени',
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 120, 300)
+)
+NOTIFICATION_SEND_SECONDS = Histogram('reminderbot_notification_send_seconds', 'Длительность запроса отправки в Telegram')
+NOTIFICATION_SEND_FAILURES = Counter('reminderbot_notification_send_failures_total', 'Неудачные отправки уведомлений')
 
 class NotificationManager:
+    # Интервал проверки уведомлений в секундах
+    CHECK_INTERVAL = 60
+    PARSE_MODE = 'Markdown'
+    MISSED_MARKER = "⏰ *Пропущенное напоминание* (бот был недоступен)\n\n"
+    MISSED_SUMMARY_HEADER = "⏰ Пока бот был недоступен, вы пропустили напоминания:\n\n"
+    # Предел длины сообщения Telegram - 4096 символов; оставляем запас на разметку
+    MESSAGE_LIMIT = 4000
+    # Сработавшее напоминание хранится столько, чтобы его можно было отложить из уведомления
+    SNOOZE_WINDOW = timedelta(days=1)
+    # Кнопки "отложить": код -> (подпись, сдвиг)
+    SNOOZE_OPTIONS = {
+        '10m': ("⏰ +10 мин", timedelta(minutes=10)),
+        '1h': ("⏰ +1 час", timedelta(hours=1)),
+        '1d': ("📅 Завтра", timedelta(days=1)),
+    }
+    
     def __init__(self, token: str, database):
         self.bot = Bot(token=token)
         self.db = database
         self.scheduler = None  # Инициализируем планировщик позже
+        # Время предыдущей проверки - по нему видно, что цикл простаивал
+        self._last_check = None
+        # (user_id, notification_id) уведомлений, ожидающих отправки в фоновых задачах
+        self._dispatching = set()
+        self._dispatch_tasks = set()
+        # Время ближайшего свободного слота отправки (loop.time())
+        self._next_send_slot = 0.0
     
     async def init_scheduler(self):
         """Инициализация планировщика"""
@@ -28,73 +64,231 @@ class NotificationManager:
             self.scheduler.add_job(
                 self.check_notifications,
                 'interval',
-                seconds=60,  # Было 30, стало 60
+                seconds=self.CHECK_INTERVAL,  # Было 30, стало 60
                 id='check_notifications',
                 replace_existing=True,
                 next_run_time=datetime.now(pytz.UTC),
                 misfire_grace_time=30  # Добавляем допустимое время опоздания
             )
             
+            # Сработавшие напоминания переносим в архив, когда их уже нельзя отложить
+            self.scheduler.add_job(
+                self.archive_finished_reminders,
+                'interval',
+                hours=1,
+                id='archive_finished_reminders',
+                replace_existing=True
+            )
+            
+            # Отметки об обработанных сообщениях нужны, только пока возможна повторная доставка
+            self.scheduler.add_job(
+                self.purge_processed_messages,
+                'interval',
+                hours=1,
+                id='purge_processed_messages',
+                replace_existing=True
+            )
+            
+            # Возвращаем освободившееся место и обновляем статистику запросов
+            self.scheduler.add_job(
+                self.maintain_database,
+                'interval',
+                seconds=DB_VACUUM_INTERVAL,
+                id='maintain_database',
+                replace_existing=True
+            )
+            self.scheduler.add_job(
+                self.analyze_database,
+                'cron',
+                hour=DB_ANALYZE_HOUR,
+                id='analyze_database',
+                replace_existing=True
+            )
+            
             self.scheduler.start()
     
-    def schedule_notifications(self, user_id: int, event: dict, user_timezone: str = 'UTC', reminder_id: int = None):
+    async def shutdown(self):
+        """Останавливает планировщик и фоновые отправки; вызывается до остановки
+        писателя базы, чтобы после нее никто не ставил изменения в очередь"""
+        if self.scheduler is not None and self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        for task in self._dispatch_tasks:
+            task.cancel()
+        await asyncio.gather(*self._dispatch_tasks, return_exceptions=True)
+    
+    def build_notifications(self, event: dict, user_timezone: str = 'UTC') -> list:
+        """Список будущих уведомлений для события с готовым текстом:
+        (notify_datetime, timing_description, is_main, notification_type, message_text, parse_mode)"""
+        event_time = datetime.strptime(event["datetime"], "%Y-%m-%d %H:%M")
+        event_time = pytz.UTC.localize(event_time)
+        current_time = datetime.now(pytz.UTC)
+        
+        # Добавляем основное напоминание в список времен
+        notify_times = [
+            (event_time, "MAIN_EVENT", "прямо сейчас", True),  # Основное напоминание
+            (event_time - timedelta(days=3), "REMINDER", "за 3 дня", False),
+            (event_time - timedelta(days=2), "REMINDER", "за 2 дня", False),
+            (event_time - timedelta(days=1), "REMINDER", "за сутки", False),
+            (event_time - timedelta(hours=2), "REMINDER", "за 2 часа", False)
+        ]
+        
+        # Фильтруем будущие напоминания и уведомления
+        return [
+            (notify_time.strftime("%Y-%m-%d %H:%M"), description, is_main, notif_type,
+             self.render_notification(event, user_timezone, description), self.PARSE_MODE)
+            for notify_time, notif_type, description, is_main in notify_times 
+            if notify_time > current_time
+        ]
+    
+    async def schedule_events(self, user_id: int, events: list, user_timezone: str = 'UTC') -> list:
+        """Создает несколько напоминаний с уведомлениями одной транзакцией, возвращает их ID"""
         try:
-            event_time = datetime.strptime(event["datetime"], "%Y-%m-%d %H:%M")
-            event_time = pytz.UTC.localize(event_time)
-            current_time = datetime.now(pytz.UTC)
-            
-            # Добавляем основное напоминание в список времен
-            notify_times = [
-                (event_time, "MAIN_EVENT", "прямо сейчас", True),  # Основное напоминание
-                (event_time - timedelta(days=3), "REMINDER", "за 3 дня", False),
-                (event_time - timedelta(days=2), "REMINDER", "за 2 дня", False),
-                (event_time - timedelta(days=1), "REMINDER", "за сутки", False),
-                (event_time - timedelta(hours=2), "REMINDER", "за 2 часа", False)
+            reminders = [
+                (event["description"], event["datetime"], self.build_notifications(event, user_timezone or 'UTC'))
+                for event in events
             ]
-            
-            # Фильтруем будущие напоминания и уведомления
-            future_notifications = [
-                (notify_time, notif_type, description, is_main) 
-                for notify_time, notif_type, description, is_main in notify_times 
-                if notify_time > current_time
-            ]
-            
-            if not future_notifications:
-                print("Нет будущих уведомлений для планирования")
-                return
-            
-            # Используем существующий reminder_id или создаем новый
-            if reminder_id is None:
-                reminder_id = self.db.save_reminder(
-                    user_id,
-                    event["description"],
-                    event["datetime"]
-                )
-            
-            # Сохраняем все уведомления и напоминания
-            for notify_time, notif_type, description, is_main in future_notifications:
-                self.db.save_notification(
-                    reminder_id,
-                    user_id,
-                    notify_time.strftime("%Y-%m-%d %H:%M"),
-                    event["description"],
-                    description,
-                    is_main,
-                    notif_type
-                )
-                print(f"Запланировано {notif_type} на {notify_time}")
-                print(f"Для пользователя {user_id}, reminder_id {reminder_id}")
+            reminder_ids = await self.db.save_reminders_with_notifications(user_id, reminders)
+            print(f"Запланировано {len(reminder_ids)} напоминаний для пользователя {user_id}")
+            return reminder_ids
             
         except Exception as e:
             print(f"Ошибка при планировании уведомлений: {str(e)}")
             raise
     
+    async def rerender_notifications(self, user_id: int, user_timezone: str):
+        """Перерисовывает готовые тексты неотправленных уведомлений после смены часового пояса"""
+        try:
+            rows = await asyncio.to_thread(self.db.get_unsent_notifications, user_id)
+            texts = [
+                (self.render_notification({"description": description, "datetime": event_datetime},
+                                          user_timezone, timing),
+                 self.PARSE_MODE, notification_id)
+                for notification_id, description, event_datetime, timing in rows
+            ]
+            if texts:
+                await self.db.update_notification_texts(user_id, texts)
+                print(f"Обновлены тексты {len(texts)} уведомлений пользователя {user_id}")
+        except Exception as e:
+            print(f"Ошибка при обновлении текстов уведомлений: {str(e)}")
+    
+    def actions_keyboard(self, reminder_id: int, snooze: bool = True) -> types.InlineKeyboardMarkup:
+        """Кнопки переноса напоминания: отложить и изменить время. Предварительным
+        уведомлениям ("за 2 часа") кнопки "отложить" не нужны (snooze=False) - они
+        перенесли бы само событие"""
+        rows = [[types.InlineKeyboardButton(text="✏️ Изменить время", callback_data=f"edit_{reminder_id}")]]
+        if snooze:
+            rows.insert(0, [
+                types.InlineKeyboardButton(text=label, callback_data=f"snooze_{reminder_id}_{code}")
+                for code, (label, _) in self.SNOOZE_OPTIONS.items()
+            ])
+        return types.InlineKeyboardMarkup(inline_keyboard=rows)
+    
+    def snooze_datetime(self, event_datetime: str, code: str) -> str:
+        """Новое время события при откладывании: прошедшее событие откладывается
+        от текущего момента, будущее - сдвигается ("завтра" - на то же время суток)"""
+        _, delta = self.SNOOZE_OPTIONS[code]
+        event_time = pytz.UTC.localize(datetime.strptime(event_datetime, "%Y-%m-%d %H:%M"))
+        now = datetime.now(pytz.UTC)
+        if code == '1d':
+            new_time = event_time + delta
+            while new_time <= now:
+                new_time += delta
+        else:
+            new_time = max(event_time, now) + delta
+        return new_time.strftime("%Y-%m-%d %H:%M")
+    
+    async def reschedule(self, user_id: int, reminder_id: int, event_datetime: str,
+                         user_timezone: str = 'UTC') -> dict:
+        """Переносит напоминание на event_datetime (UTC) с пересозданием уведомлений
+        одной транзакцией; возвращает событие или None, если напоминания нет"""
+        reminder = await asyncio.to_thread(self.db.get_reminder, reminder_id, user_id)
+        if reminder is None:
+            return None
+        
+        event = {"description": reminder[1], "datetime": event_datetime}
+        notifications = self.build_notifications(event, user_timezone or 'UTC')
+        if not await self.db.reschedule_reminder(reminder_id, user_id, event_datetime, notifications):
+            return None
+        print(f"Напоминание {reminder_id} перенесено на {event_datetime}, уведомлений: {len(notifications)}")
+        return event
+    
+    async def archive_finished_reminders(self):
+        """Переносит в архив сработавшие напоминания старше SNOOZE_WINDOW"""
+        try:
+            before = (datetime.utcnow() - self.SNOOZE_WINDOW).strftime("%Y-%m-%d %H:%M")
+            count = await self.db.archive_finished_reminders(before, batch_size=ARCHIVE_BATCH_SIZE)
+            if count:
+                print(f"🗄 Перенесено в архив завершенных напоминаний: {count}")
+        except Exception as e:
+            print(f"❌ Ошибка при архивации завершенных напоминаний: {str(e)}")
+    
+    async def purge_processed_messages(self):
+        """Удаляет отметки об обработанных сообщениях старше IDEMPOTENCY_TTL часов"""
+        try:
+            count = await self.db.delete_processed_messages(time.time() - IDEMPOTENCY_TTL * 3600)
+            if count:
+                print(f"🗑 Удалено отметок об обработанных сообщениях: {count}")
+        except Exception as e:
+            print(f"❌ Ошибка при удалении отметок об обработанных сообщениях: {str(e)}")
+    
+    def is_quiet(self) -> bool:
+        """Нет уведомлений, ожидающих отправки, и до следующей проверки далеко"""
+        if self._dispatching:
+            return False
+        job = self.scheduler.get_job('check_notifications') if self.scheduler else None
+        if job is None or job.next_run_time is None:
+            return True
+        return (job.next_run_time - datetime.now(pytz.UTC)).total_seconds() > 10
+    
+    async def maintain_database(self):
+        """В тихий период возвращает системе часть свободных страниц и
+        обновляет устаревшую статистику планировщика запросов"""
+        if not self.is_quiet():
+            return
+        try:
+            pages = await self.db.incremental_vacuum(DB_VACUUM_PAGES)
+            await self.db.optimize()
+            if pages:
+                print(f"🧹 Освобождено страниц базы: {pages}")
+        except Exception as e:
+            print(f"❌ Ошибка при обслуживании базы: {str(e)}")
+    
+    async def analyze_database(self):
+        """Полный пересчет статистики планировщика запросов"""
+        try:
+            await self.db.optimize(analyze=True)
+            print("📊 Статистика базы обновлена")
+        except Exception as e:
+            print(f"❌ Ошибка при обновлении статистики базы: {str(e)}")
+    
+    def message_text(self, notification) -> str:
+        """Готовый текст уведомления; для записей без него (созданных до появления
+        колонки) текст формируется на месте"""
+        if notification[9]:
+            return notification[9]
+        return self.render_notification(
+            {"description": notification[2], "datetime": notification[3]},
+            notification[6] or 'UTC',
+            notification[5]
+        )
+    
     async def check_notifications(self):
         try:
             current_time = datetime.now(pytz.UTC)
             print(f"\n{'='*50}")
             print(f"Проверка уведомлений в {current_time}")
             
+            # Первая проверка после запуска или проверка после задержки цикла:
+            # уведомления вне окна обычной проверки иначе никогда не отправятся
+            now = time.monotonic()
+            stalled = (self._last_check is not None and
+                       now - self._last_check > self.CHECK_INTERVAL + CATCHUP_STALL_THRESHOLD)
+            if self._last_check is None or stalled:
+                if stalled:
+                    print(f"⚠️ Проверка задержалась на {now - self._last_check - self.CHECK_INTERVAL:.0f} с")
+                await self.catch_up_missed()
+            self._last_check = now
+            
             # Отладочный вывод всех уведомлений
             self.db.debug_notifications()
             
@@ -109,55 +303,58 @@ class NotificationManager:
             if notifications:
                 print(f"📬 Найдено {len(notifications)} уведомлений для отправки")
                 
+                # Окно захватывает следующую минуту, поэтому часть строк уже ждет отправки
+                notifications = [
+                    notification for notification in notifications
+                    if (notification[1], notification[0]) not in self._dispatching
+                ]
+                
+                # Уведомления пользователя на одну минуту уходят одним сообщением
+                groups = {}
                 for notification in notifications:
-                    (notification_id, user_id, description, event_datetime, 
-                     notify_datetime, timing, user_timezone) = notification
-                    
-                    print(f"\n📌 Обработка уведомления {notification_id}:")
-                    print(f"👤 ID пользователя: {user_id}")
-                    print(f"📝 Описание: {description}")
-                    print(f"📅 Время события: {event_datetime}")
-                    print(f"⏰ Время уведомления: {notify_datetime}")
-                    print(f"ℹ️ Тип уведомления: {timing}")
-                    print(f"🌍 Часовой пояс: {user_timezone}")
+                    groups.setdefault((notification[1], notification[4]), []).append(notification)
+                
+                # Тексты готовим заранее, до наступления минуты отправки
+                items = []
+                for (user_id, notify_datetime), user_notifications in groups.items():
+                    for notification in user_notifications:
+                        (notification_id, user_id, description, event_datetime, 
+                         notify_datetime, timing, user_timezone, reminder_id, is_main, _, _) = notification
+                        
+                        print(f"\n📌 Обработка уведомления {notification_id}:")
+                        print(f"👤 ID пользователя: {user_id}")
+                        print(f"📝 Описание: {description}")
+                        print(f"📅 Время события: {event_datetime}")
+                        print(f"⏰ Время уведомления: {notify_datetime}")
+                        print(f"ℹ️ Тип уведомления: {timing}")
+                        print(f"🌍 Часовой пояс: {user_timezone}")
                     
                     try:
-                        print("✉️ Отправка уведомления...")
-                        await self.send_notification(
-                            user_id,
-                            {"description": description, "datetime": event_datetime},
-                            user_timezone or 'UTC',
-                            timing
-                        )
-                        
-                        # Получаем reminder_id для этого уведомления
-                        with sqlite3.connect(self.db.db_path) as conn:
-                            cursor = conn.cursor()
-                            cursor.execute("""
-                                SELECT reminder_id FROM notifications
-                                WHERE id = ?
-                            """, (notification_id,))
-                            result = cursor.fetchone()
-                            if result:
-                                reminder_id = result[0]
-                                
-                                if timing == "прямо сейчас":
-                                    # Если это основное напоминание, удаляем всё
-                                    self.db.delete_reminder_with_notifications(reminder_id)
-                                    print(f"✅ Напоминание {reminder_id} удалено вместе со всеми уведомлениями")
-                                else:
-                                    # Для обычного уведомления удаляем только его
-                                    cursor.execute("""
-                                        DELETE FROM notifications 
-                                        WHERE id = ?
-                                    """, (notification_id,))
-                                    conn.commit()
-                                    print(f"✅ Уведомление {notification_id} удалено")
-                        
-                        print("✅ Уведомление успешно обработано")
-                        
-                    except Exception as send_error:
-                        print(f"❌ Ошибка при отправке уведомления: {str(send_error)}")
+                        if len(user_notifications) == 1:
+                            text = self.message_text(user_notifications[0])
+                        else:
+                            text = self.render_digest(user_notifications)
+                    except Exception as render_error:
+                        print(f"❌ Ошибка при подготовке уведомления: {str(render_error)}")
+                        continue
+                    
+                    items.append({
+                        'user_id': user_id,
+                        'text': text,
+                        'parse_mode': user_notifications[0][10] or self.PARSE_MODE,
+                        # Кнопки переноса - если сообщение касается одного напоминания
+                        'reminder_id': (user_notifications[0][7]
+                                        if len({row[7] for row in user_notifications}) == 1 else None),
+                        'rows': user_notifications,
+                        'due': pytz.UTC.localize(datetime.strptime(notify_datetime, "%Y-%m-%d %H:%M")),
+                        'is_main': any(row[8] for row in user_notifications)
+                    })
+                    self._dispatching.update((user_id, row[0]) for row in user_notifications)
+                
+                # Отправка идет в фоне: уведомления следующей минуты ждут своего времени
+                task = asyncio.create_task(self._dispatch(items))
+                self._dispatch_tasks.add(task)
+                task.add_done_callback(self._dispatch_tasks.discard)
             else:
                 print("📭 Нет уведомлений для отправки")
             
@@ -166,45 +363,221 @@ class NotificationManager:
         except Exception as e:
             print(f"❌ Критическая ошибка при проверке уведомлений: {str(e)}")
     
-    async def send_notification(self, user_id: int, event: dict, user_timezone: str, timing: str):
+    async def catch_up_missed(self, policy: str = MISSED_NOTIFICATION_POLICY):
+        """Обрабатывает просроченные неотправленные уведомления пачками по
+        CATCHUP_BATCH_SIZE согласно политике late/summary/drop. Каждая пачка
+        обрабатывается целиком до чтения следующей; для summary - одна сводка
+        на пользователя в пачке"""
         try:
-            event_time = datetime.strptime(event["datetime"], "%Y-%m-%d %H:%M")
-            event_time = pytz.UTC.localize(event_time)
-            local_tz = pytz.timezone(user_timezone)
-            local_time = event_time.astimezone(local_tz)
-            
-            formatted_date = local_time.strftime("%d.%m.%Y")
-            formatted_time = local_time.strftime("%H:%M")
-            
-            if timing == "прямо сейчас":
-                message = (
-                    f"Внимание! Событие *{event['description']}* началось! "
-                    f"Точная дата и время: *{formatted_date}* *{formatted_time}*."
-                )
-            elif "часа" in timing:
-                hours = "2"
-                message = (
-                    f"Внимание! Событие *{event['description']}* запланировано через "
-                    f"*{hours}* часа, а именно *{formatted_date}* *{formatted_time}*."
+            before = self.db.pending_window_start()
+            after = None
+            total = 0
+            while True:
+                batch = await asyncio.to_thread(
+                    self.db.get_overdue_notifications, before, CATCHUP_BATCH_SIZE, after
                 )
-            elif any(word in timing for word in ["дня", "сутки"]):
-                if "сутки" in timing:
-                    days = "1"
+                if not batch:
+                    break
+                # Неудачно отправленные остаются в базе, поэтому продолжаем после последней строки
+                after = (batch[-1][4], batch[-1][1], batch[-1][0])
+                last_batch = len(batch) < CATCHUP_BATCH_SIZE
+                # После задержки цикла часть просроченных строк уже ждет слота отправки
+                # в фоновых задачах - их отправит _dispatch
+                batch = [row for row in batch if (row[1], row[0]) not in self._dispatching]
+                total += len(batch)
+                if policy == 'summary':
+                    summaries = {}
+                    for row in batch:
+                        summaries.setdefault(row[1], []).append(row)
+                    for user_id, rows in summaries.items():
+                        try:
+                            await self.send_missed_summary(user_id, rows, rows[0][6] or 'UTC')
+                        except Exception as e:
+                            print(f"❌ Ошибка при отправке сводки пользователю {user_id}: {str(e)}")
                 else:
-                    days = timing.split()[1]
-                    
-                message = (
-                    f"Внимание! Событие *{event['description']}* запланировано через "
-                    f"*{days}* {'день' if days == '1' else 'дня' if days in ['2', '3'] else 'дней'}, "
-                    f"а именно *{formatted_date}* *{formatted_time}*."
-                )
+                    await self._process_missed(batch, policy)
+                if last_batch:
+                    break
             
-            await self.bot.send_message(
+            if total:
+                print(f"📮 Обработано пропущенных уведомлений: {total} (политика {policy})")
+        except Exception as e:
+            print(f"❌ Ошибка при обработке пропущенных уведомлений: {str(e)}")
+    
+    async def _process_missed(self, batch: list, policy: str):
+        for row in batch:
+            notification_id, user_id, timing, is_main = row[0], row[1], row[5], row[8]
+            try:
+                if policy == 'drop' and not is_main:
+                    # Промежуточное напоминание о прошедшем моменте уже бесполезно
+                    print(f"🗑 Пропущенное уведомление {notification_id} ({timing}) отброшено")
+                else:
+                    await self._wait_send_slot()
+                    await self.send_message(
+                        kind='missed',
+                        chat_id=user_id,
+                        text=self.MISSED_MARKER + self.message_text(row),
+                        parse_mode=row[10] or self.PARSE_MODE,
+                        reply_markup=self.actions_keyboard(row[7], snooze=bool(is_main))
+                    )
+                await self._remove_notification(row)
+            except Exception as e:
+                print(f"❌ Ошибка при отправке пропущенного уведомления {notification_id}: {str(e)}")
+    
+    async def send_missed_summary(self, user_id: int, rows: list, user_timezone: str):
+        """Сводка пропущенных событий пользователя: список событий, разбитый на
+        сообщения не длиннее MESSAGE_LIMIT. Уведомления удаляются после отправки
+        сообщения, в которое попали их события"""
+        local_tz = pytz.timezone(user_timezone)
+        # Строка сводки на каждое событие и все его уведомления
+        events = {}
+        for row in rows:
+            reminder_id, description, event_datetime = row[7], row[2], row[3]
+            if reminder_id not in events:
+                event_time = pytz.UTC.localize(datetime.strptime(event_datetime, "%Y-%m-%d %H:%M"))
+                local_time = event_time.astimezone(local_tz)
+                # Очень длинное описание сокращаем, чтобы строка всегда помещалась в сообщение
+                if len(description) > 200:
+                    description = description[:200] + "…"
+                line = f"• *{description}* - {local_time.strftime('%d.%m.%Y %H:%M')}"
+                events[reminder_id] = (line, [])
+            events[reminder_id][1].append(row)
+        
+        chunks = [[]]
+        length = len(self.MISSED_SUMMARY_HEADER)
+        for line, event_rows in events.values():
+            if chunks[-1] and length + len(line) + 1 > self.MESSAGE_LIMIT:
+                chunks.append([])
+                length = len(self.MISSED_SUMMARY_HEADER)
+            chunks[-1].append((line, event_rows))
+            length += len(line) + 1
+        
+        for chunk in chunks:
+            await self._wait_send_slot()
+            await self.send_message(
+                kind='summary',
                 chat_id=user_id,
-                text=message,
-                parse_mode='Markdown'
+                text=self.MISSED_SUMMARY_HEADER + "\n".join(line for line, _ in chunk),
+                parse_mode=self.PARSE_MODE
             )
+            for _, event_rows in chunk:
+                for row in event_rows:
+                    await self._remove_notification(row)
+    
+    async def _dispatch(self, items: list):
+        """Отправляет подготовленные сообщения не раньше их минуты и в пределах
+        бюджета NOTIFICATION_SEND_RATE; внутри минуты основные события идут первыми"""
+        items.sort(key=lambda item: (item['due'], not item['is_main']))
+        lateness = []
+        for item in items:
+            try:
+                delay = (item['due'] - datetime.now(pytz.UTC)).total_seconds()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._wait_send_slot()
+                
+                print(f"✉️ Отправка уведомлений пользователю {item['user_id']}: {len(item['rows'])}")
+                await self.send_message(
+                    kind='digest' if len(item['rows']) > 1 else 'single',
+                    chat_id=item['user_id'],
+                    text=item['text'],
+                    parse_mode=item['parse_mode'],
+                    reply_markup=(self.actions_keyboard(item['reminder_id'], snooze=item['is_main'])
+                                  if item['reminder_id'] is not None else None)
+                )
+                late = max((datetime.now(pytz.UTC) - item['due']).total_seconds(), 0)
+                lateness.append(late)
+                NOTIFICATION_LATENESS_SECONDS.observe(late, priority='main' if item['is_main'] else 'reminder')
+                
+                for notification in item['rows']:
+                    await self._remove_notification(notification)
+            except Exception as send_error:
+                print(f"❌ Ошибка при отправке уведомления: {str(send_error)}")
+            finally:
+                self._dispatching.difference_update((item['user_id'], row[0]) for row in item['rows'])
+        
+        if lateness:
+            print(f"📤 Отправлено сообщений: {len(lateness)}, "
+                  f"макс. задержка {max(lateness):.1f} с, средняя {sum(lateness) / len(lateness):.1f} с")
+    
+    async def send_message(self, kind: str, **kwargs):
+        """Отправка сообщения с учетом длительности и ошибок в метриках"""
+        started = time.monotonic()
+        try:
+            return await self.bot.send_message(**kwargs)
+        except Exception:
+            NOTIFICATION_SEND_FAILURES.inc(kind=kind)
+            raise
+        finally:
+            NOTIFICATION_SEND_SECONDS.observe(time.monotonic() - started, kind=kind)
+    
+    async def _wait_send_slot(self):
+        """Ждет свободного слота отправки; слоты общие для всех фоновых отправок"""
+        loop = asyncio.get_running_loop()
+        slot = max(self._next_send_slot, loop.time())
+        self._next_send_slot = slot + 1 / NOTIFICATION_SEND_RATE
+        await asyncio.sleep(slot - loop.time())
+    
+    async def _remove_notification(self, notification):
+        """Удаляет обработанное уведомление; после основного - все уведомления напоминания"""
+        notification_id, user_id, reminder_id, is_main = notification[0], notification[1], notification[7], notification[8]
+        try:
+            if is_main:
+                # Основное напоминание сработало: удаляем все его уведомления,
+                # само напоминание остается на SNOOZE_WINDOW для кнопок "отложить"
+                await self.db.finish_reminder(reminder_id, user_id=user_id)
+            else:
+                # Для обычного уведомления удаляем только его
+                await self.db.delete_notification(notification_id, user_id=user_id)
+                print(f"✅ Уведомление {notification_id} удалено")
             
-        except Exception as e:
-            print(f"Ошибка при отправке уведомления: {str(e)}")
-            raise
\ No newline at end of file
+            print("✅ Уведомление успешно обработано")
+        except Exception as db_error:
+            print(f"❌ Ошибка при удалении уведомления {notification_id}: {str(db_error)}")
+    
+    def render_digest(self, notifications: list) -> str:
+        """Одно сообщение с несколькими уведомлениями пользователя, пришедшимися на одну минуту"""
+        # Основные события - первыми
+        ordered = sorted(notifications, key=lambda row: not row[8])
+        parts = [self.message_text(row) for row in ordered]
+        return f"🔔 Напоминаний: {len(parts)}\n\n" + "\n\n".join(parts)
+    
+    def render_notification(self, event: dict, user_timezone: str, timing: str) -> str:
+        """Текст уведомления о событии (Markdown)"""
+        event_time = datetime.strptime(event["datetime"], "%Y-%m-%d %H:%M")
+        event_time = pytz.UTC.localize(event_time)
+        local_tz = pytz.timezone(user_timezone)
+        local_time = event_time.astimezone(local_tz)
+        
+        formatted_date = local_time.strftime("%d.%m.%Y")
+        formatted_time = local_time.strftime("%H:%M")
+        
+        if timing == "прямо сейчас":
+            message = (
+                f"Внимание! Событие *{event['description']}* началось! "
+                f"Точная дата и время: *{formatted_date}* *{formatted_time}*."
+            )
+        elif "часа" in timing:
+            hours = "2"
+            message = (
+                f"Внимание! Событие *{event['description']}* запланировано через "
+                f"*{hours}* часа, а именно *{formatted_date}* *{formatted_time}*."
+            )
+        elif any(word in timing for word in ["дня", "сутки"]):
+            if "сутки" in timing:
+                days = "1"
+            else:
+                days = timing.split()[1]
+                
+            message = (
+                f"Внимание! Событие *{event['description']}* запланировано через "
+                f"*{days}* {'день' if days == '1' else 'дня' if days in ['2', '3'] else 'дней'}, "
+                f"а именно *{formatted_date}* *{formatted_time}*."
+            )
+        else:
+            # Неизвестный тип уведомления - общий текст вместо падения
+            message = (
+                f"Напоминание: событие *{event['description']}* ({timing}), "
+                f"*{formatted_date}* *{formatted_time}*."
+            )
+        return message
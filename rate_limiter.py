@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict
+from metrics import Counter
+
+RATE_LIMITED = Counter('reminderbot_rate_limited_total', 'Запросы, отклоненные ограничением частоты')
+
+
+class TokenBucket:
+    """Корзина токенов: пополняется со скоростью rate токенов в секунду
+    до capacity; запрос стоимостью cost проходит, если токенов хватает"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: float = 1, now: float = None) -> float:
+        """Через сколько секунд хватит токенов (0 - хватает сейчас)"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= cost:
+            return 0.0
+        if cost > self.capacity:
+            return float('inf')
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1):
+        self.tokens -= cost
+
+
+class RateLimiter:
+    """Ограничение частоты тяжелых запросов (распознавание речи, LLM):
+    корзина на каждого пользователя и общая на всех.
+
+    Запрос списывается с обеих корзин только если проходит в обе, так что
+    отклоненный запрос пользователя не расходует общий бюджет. Корзины
+    хранятся в памяти; давно не использованные (полные) вытесняются."""
+
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float,
+                 global_burst: float, max_users: int = 10000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._users = OrderedDict()  # user_id -> TokenBucket, от давно использованных к недавним
+
+    def _user_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            # Вытесненная корзина за время простоя почти наверняка успела наполниться
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return bucket
+
+    def acquire(self, user_id: int, cost: float = 1) -> float:
+        """Списывает cost токенов и возвращает 0 или, если лимит исчерпан,
+        ничего не списывает и возвращает время ожидания в секундах"""
+        now = time.monotonic()
+        user_bucket = self._user_bucket(user_id)
+        user_wait = user_bucket.wait_time(cost, now)
+        global_wait = self.global_bucket.wait_time(cost, now)
+        if user_wait > 0 or global_wait > 0:
+            RATE_LIMITED.inc(scope='user' if user_wait >= global_wait else 'global')
+            return max(user_wait, global_wait)
+        user_bucket.consume(cost)
+        self.global_bucket.consume(cost)
+        return 0.0
@@ -0,0 +1,38 @@
+"""Отправляет записанные обновления Telegram на локальный вебхук бота.
+
+Использование:
+    python replay_updates.py updates.jsonl [http://127.0.0.1:8080/webhook]
+
+Файл - JSON-массив обновлений или по одному обновлению на строку (JSON Lines).
+Секрет берется из WEBHOOK_SECRET, как и у самого бота."""
+import json
+import sys
+import requests
+from config import WEBHOOK_SECRET, WEBHOOK_PORT, WEBHOOK_PATH
+
+
+def load_updates(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    url = sys.argv[2] if len(sys.argv) > 2 else f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    headers = {}
+    if WEBHOOK_SECRET:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = WEBHOOK_SECRET
+
+    for update in load_updates(sys.argv[1]):
+        response = requests.post(url, json=update, headers=headers, timeout=30)
+        print(f"update_id={update.get('update_id')}: HTTP {response.status_code}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,18 @@ import os
 import ffmpeg
 import requests
 import time
+import wave
 from config import HUGGING_FACE_TOKEN
+from circuit_breaker import create_breaker
+from metrics import Counter, Histogram
+
+FFMPEG_SECONDS = Histogram('reminderbot_ffmpeg_seconds', 'Длительность конвертации OGG в WAV')
+ASR_REQUEST_SECONDS = Histogram('reminderbot_asr_request_seconds', 'Длительность запроса к Whisper')
+ASR_RETRIES = Counter('reminderbot_asr_retries_total', 'Повторные запросы к Whisper')
+ASR_FAILURES = Counter('reminderbot_asr_failures_total', 'Неудачные распознавания речи')
+
+# Единица размера запроса для дедлайна: аудио до этой длины (в секундах) - одна единица
+AUDIO_SECONDS_PER_UNIT = 10
 
 class SpeechRecognizer:
     def __init__(self):
@@ -10,9 +21,63 @@ class SpeechRecognizer:
         self.headers = {"Authorization": f"Bearer {HUGGING_FACE_TOKEN}"}
         self.max_retries = 3
         self.retry_delay = 2  # секунды
+        # Автомат защиты: при деградации Hugging Face отказываем сразу, без ожидания таймаута
+        self.breaker = create_breaker("распознавания речи")
+        self.breaker.set_probe(self.probe)
+
+    def probe(self) -> bool:
+        """Легкая проверка доступности модели для фонового опроса автомата"""
+        response = requests.get(self.API_URL, headers=self.headers, timeout=5)
+        return response.status_code < 500
+
+    @staticmethod
+    def _audio_units(audio_path: str) -> float:
+        """Длина аудио в единицах дедлайна (не меньше одной)"""
+        try:
+            with wave.open(audio_path, 'rb') as wav:
+                seconds = wav.getnframes() / wav.getframerate()
+        except (wave.Error, EOFError, OSError, ZeroDivisionError):
+            return 1.0
+        return max(1.0, seconds / AUDIO_SECONDS_PER_UNIT)
+
+    @staticmethod
+    def _is_model_loading(response) -> bool:
+        """503 от Hugging Face, пока модель загружается: сервис работает, это не отказ"""
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and (
+            'estimated_time' in body or 'loading' in str(body.get('error', '')).lower()
+        )
+
+    def _post(self, data: bytes, units: float = 1.0):
+        """Запрос к API с адаптивным таймаутом и учетом результата в автомате;
+        units - длина аудио в единицах дедлайна"""
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            response = requests.post(
+                self.API_URL,
+                headers=self.headers,
+                data=data,
+                timeout=self.breaker.deadline(units)
+            )
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        ASR_REQUEST_SECONDS.observe(time.monotonic() - started)
+        if response.status_code == 503 and self._is_model_loading(response):
+            self.breaker.release()
+        elif response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success(time.monotonic() - started, units)
+        return response
 
     def convert_ogg_to_wav(self, input_path: str, output_path: str):
         """Конвертирует .ogg файл в .wav"""
+        started = time.monotonic()
         try:
             stream = ffmpeg.input(input_path)
             stream = ffmpeg.output(stream, output_path)
@@ -21,25 +86,25 @@ class SpeechRecognizer:
             print('stdout:', e.stdout.decode('utf8'))
             print('stderr:', e.stderr.decode('utf8'))
             raise
+        finally:
+            FFMPEG_SECONDS.observe(time.monotonic() - started)
 
     def transcribe(self, audio_path: str) -> str:
         """Отправляет аудиофайл на распознавание в Hugging Face"""
         with open(audio_path, "rb") as f:
             data = f.read()
+        units = self._audio_units(audio_path)
         
         for attempt in range(self.max_retries):
             try:
-                response = requests.post(
-                    self.API_URL,
-                    headers=self.headers,
-                    data=data,
-                    timeout=30
-                )
+                # Если автомат разомкнулся во время повторов, _post сразу бросит CircuitOpenError
+                response = self._post(data, units)
                 
                 # Проверяем специфичные ошибки Hugging Face
                 if response.status_code == 503:
                     if attempt < self.max_retries - 1:
                         print(f"Сервис временно недоступен. Попытка {attempt + 1} из {self.max_retries}")
+                        ASR_RETRIES.inc(reason='unavailable')
                         time.sleep(self.retry_delay)
                         continue
                     else:
@@ -63,17 +128,22 @@ class SpeechRecognizer:
             except requests.exceptions.Timeout:
                 if attempt < self.max_retries - 1:
                     print(f"Таймаут запроса. Попытка {attempt + 1} из {self.max_retries}")
+                    ASR_RETRIES.inc(reason='timeout')
                     time.sleep(self.retry_delay)
                     continue
+                ASR_FAILURES.inc()
                 raise Exception("Превышено время ожидания ответа от сервера. Пожалуйста, попробуйте позже.")
                 
             except requests.exceptions.RequestException as e:
                 if attempt < self.max_retries - 1:
                     print(f"Ошибка запроса: {str(e)}. Попытка {attempt + 1} из {self.max_retries}")
+                    ASR_RETRIES.inc(reason='request_error')
                     time.sleep(self.retry_delay)
                     continue
+                ASR_FAILURES.inc()
                 raise Exception(f"Ошибка при распознавании речи: {str(e)}")
                 
             except Exception as e:
                 print(f"Неожиданная ошибка: {str(e)}")
+                ASR_FAILURES.inc()
                 raise
\ No newline at end of file
@@ -0,0 +1,44 @@
+from datetime import datetime
+import pytest
+import pytz
+from time_parser import parse_event
+
+# Вторник, 10.03.2026 15:00 по Москве (12:00 UTC)
+NOW = pytz.UTC.localize(datetime(2026, 3, 10, 12, 0))
+TZ = 'Europe/Moscow'
+
+
+@pytest.mark.parametrize('text, description, expected', [
+    # Формулировки из описания модуля
+    ("Через 2 часа позвонить маме", "Позвонить маме", "2026-03-10 14:00"),
+    ("Завтра в 15:00 встреча", "Встреча", "2026-03-11 12:00"),
+    ("В пятницу в 9 утра отчет", "Отчет", "2026-03-13 06:00"),
+    ("25 марта в 14:30 стоматолог", "Стоматолог", "2026-03-25 11:30"),
+    ("Футбол 12.05 в 18", "Футбол", "2026-05-12 15:00"),
+    # Голое "в N" в конце фразы - время
+    ("Созвон завтра в 15", "Созвон", "2026-03-11 12:00"),
+    ("Послезавтра в 10, забрать документы", "Забрать документы", "2026-03-12 07:00"),
+    ("Напомни в 7 вечера полить цветы", "Полить цветы", "2026-03-10 16:00"),
+    ("В 3 часа дня забрать посылку", "Забрать посылку", "2026-03-11 12:00"),
+    ("Через полчаса выключить плиту", "Выключить плиту", "2026-03-10 12:30"),
+])
+def test_parses(text, description, expected):
+    assert parse_event(text, TZ, NOW) == {"description": description, "datetime": expected}
+
+
+@pytest.mark.parametrize('text', [
+    # Число после "в" без признаков времени - не время
+    "Купить 5 яблок в 5 магазинах",
+    "Завтра в 15 созвон",
+    # Составные и неоднозначные формулировки остаются модели
+    "Через 2 часа 30 минут выйти",
+    "В 10 и в 12 созвоны",
+    "Завтра в 10:00 и в пятницу в 12:00 встречи",
+    # Без времени суток
+    "Завтра купить хлеб",
+    # Несуществующее время и дата
+    "Завтра в 25:00 встреча",
+    "31.02 в 10:00 встреча",
+])
+def test_leaves_to_model(text):
+    assert parse_event(text, TZ, NOW) is None
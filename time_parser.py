@@ -0,0 +1,168 @@
+"""Локальный разбор напоминаний без обращения к модели.
+
+Понимает самые частые формулировки: "через 2 часа", "завтра в 15:00",
+"в пятницу в 9 утра", "25 марта в 14:30", "12.05 в 18". Голое "в N" считается
+временем, только если им заканчивается фраза ("в 5 магазинах" - не время). Если в тексте нет
+времени или формулировка неоднозначна (несколько указаний времени), возвращает
+None - такой текст нужно отдать модели."""
+import re
+from datetime import datetime, timedelta
+import pytz
+
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+WEEKDAYS = {
+    'понедельник': 0, 'вторник': 1, 'среду': 2, 'четверг': 3,
+    'пятницу': 4, 'субботу': 5, 'воскресенье': 6,
+}
+DAY_OFFSETS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+# Единица -> минут; ключ - начало слова ("минут", "минуту", "мин")
+UNITS = {'мин': 1, 'час': 60, 'дн': 1440, 'ден': 1440, 'недел': 10080}
+NUMBER_WORDS = {
+    'одну': 1, 'один': 1, 'два': 2, 'две': 2, 'три': 3, 'четыре': 4, 'пять': 5,
+    'шесть': 6, 'десять': 10, 'пятнадцать': 15, 'двадцать': 20, 'тридцать': 30,
+}
+# Сдвиг часа для "в 3 дня", "в 7 вечера" и т.п.
+DAY_PARTS = {'утра': 0, 'дня': 12, 'вечера': 12, 'ночи': 0}
+
+RELATIVE_RE = re.compile(
+    r'\bчерез\s+(?:(\d+|' + '|'.join(NUMBER_WORDS) + r')\s+)?(пол\s*часа|'
+    r'минут[уы]?|мин\.?|час(?:а|ов)?|дн(?:я|ей)|день|недел[юиь])(?=\s|$|[.,!?])'
+)
+DAY_RE = re.compile(r'\b(' + '|'.join(DAY_OFFSETS) + r')\b')
+WEEKDAY_RE = re.compile(r'\bв[о]?\s+(' + '|'.join(WEEKDAYS) + r')\b')
+DATE_RE = re.compile(
+    r'\b(\d{1,2})\s+(' + '|'.join(MONTHS) + r')\b|\b(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?(?=\s|$|[,!?])'
+)
+TIME_RE = re.compile(
+    r'\bв\s+(?P<hour>\d{1,2})(?:[:.](?P<minute>\d{2}))?(?:\s*(?P<unit>час(?:а|ов)?|ч\.?))?'
+    r'(?:\s+(?P<part>' + '|'.join(DAY_PARTS) + r'))?(?=\s|$|[.,!?])'
+    r'|\b(?P<clock_hour>\d{1,2}):(?P<clock_minute>\d{2})\b'
+)
+# Конец фразы после голого "в N": "завтра в 15", "в 9, не забыть"
+CLAUSE_END_RE = re.compile(r'\s*(?:$|[.,!?;])')
+# Слова, которые не относятся к сути события
+FILLER_RE = re.compile(r'\b(напомни(?:те)?|напоминание|пожалуйста|мне|нам|надо|нужно|не забыть)\b')
+
+
+def _is_time_of_day(match, text: str) -> bool:
+    """Совпадение TIME_RE - время суток: есть минуты, "час", часть суток или
+    за голым "в N" заканчивается фраза ("в 5 магазинах" - не время)"""
+    if any(match.group(name) for name in ('clock_hour', 'minute', 'unit', 'part')):
+        return True
+    return CLAUSE_END_RE.match(text, match.end()) is not None
+
+
+def _time_of_day(match) -> tuple:
+    """(час, минута) из совпадения TIME_RE"""
+    if match.group('clock_hour') is not None:
+        return int(match.group('clock_hour')), int(match.group('clock_minute'))
+    hour, minute = int(match.group('hour')), int(match.group('minute') or 0)
+    part = match.group('part')
+    if part and hour < 12:
+        hour += DAY_PARTS[part]
+    elif part == 'ночи' and hour == 12:
+        hour = 0
+    return hour, minute
+
+
+def parse_event(text: str, user_timezone: str = 'UTC', now: datetime = None):
+    """Событие {"description", "datetime" (UTC, "YYYY-MM-DD HH:MM")} или None"""
+    local_tz = pytz.timezone(user_timezone)
+    now = (now or datetime.now(pytz.UTC)).astimezone(local_tz).replace(second=0, microsecond=0)
+    lowered = text.lower().replace('ё', 'е')
+
+    relative = list(RELATIVE_RE.finditer(lowered))
+    days = list(DAY_RE.finditer(lowered))
+    weekdays = list(WEEKDAY_RE.finditer(lowered))
+    dates = list(DATE_RE.finditer(lowered))
+    times = [m for m in TIME_RE.finditer(lowered)
+             if _is_time_of_day(m, lowered)
+             and not any(m.start() < d.end() and d.start() < m.end() for d in dates)]
+
+    # Несколько указаний одного вида - вероятно, несколько событий
+    if any(len(found) > 1 for found in (relative, days, weekdays, dates, times)):
+        return None
+    date_matches = days + weekdays + dates
+    if len(date_matches) > 1 or (relative and (date_matches or times)):
+        return None
+
+    if relative:
+        match = relative[0]
+        if re.match(r'\s+(?:и\s+)?\d+\s+мин', lowered[match.end():]):
+            # "через 2 часа 30 минут" - составные интервалы оставляем модели
+            return None
+        amount, unit = match.group(1), match.group(2)
+        if unit.startswith('пол'):
+            minutes = 30
+        else:
+            count = int(amount) if amount and amount.isdigit() else NUMBER_WORDS.get(amount, 1)
+            minutes = count * next(value for prefix, value in UNITS.items() if unit.startswith(prefix))
+        event_time = now + timedelta(minutes=minutes)
+        spans = [match.span()]
+    else:
+        if not times:
+            # Без времени суток модель подставит его по контексту лучше
+            return None
+        hour, minute = _time_of_day(times[0])
+        if hour > 23 or minute > 59:
+            return None
+        spans = [times[0].span()]
+        day = now.date()
+        explicit_year = False
+        if days:
+            day += timedelta(days=DAY_OFFSETS[days[0].group(1)])
+            spans.append(days[0].span())
+        elif weekdays:
+            ahead = (WEEKDAYS[weekdays[0].group(1)] - day.weekday()) % 7
+            day += timedelta(days=ahead)
+            spans.append(weekdays[0].span())
+        elif dates:
+            match = dates[0]
+            try:
+                if match.group(2):
+                    day = day.replace(month=MONTHS[match.group(2)], day=int(match.group(1)))
+                else:
+                    explicit_year = match.group(5) is not None
+                    day = day.replace(year=int(match.group(5) or day.year),
+                                      month=int(match.group(4)), day=int(match.group(3)))
+            except ValueError:
+                return None
+            spans.append(match.span())
+
+        event_time = local_tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+        if event_time <= now:
+            if dates and not explicit_year:
+                # Дата в этом году уже прошла - имеется в виду следующий год
+                try:
+                    event_time = local_tz.localize(event_time.replace(tzinfo=None, year=day.year + 1))
+                except ValueError:
+                    return None
+            elif weekdays:
+                event_time = local_tz.localize(event_time.replace(tzinfo=None) + timedelta(days=7))
+            elif not days and not dates:
+                # Только время, и оно уже прошло сегодня - значит, завтра
+                event_time = local_tz.localize(event_time.replace(tzinfo=None) + timedelta(days=1))
+            else:
+                return None
+
+    # Описание - текст без указаний времени и служебных слов
+    description = lowered
+    for start, end in sorted(spans, reverse=True):
+        description = description[:start] + ' ' + description[end:]
+    description = FILLER_RE.sub(' ', description)
+    description = re.sub(r'\s+', ' ', description).strip(' ,.!?-—')
+    if not description:
+        return None
+    # Регистр берем из исходного текста, если описание в нем встречается целиком
+    position = text.lower().replace('ё', 'е').find(description)
+    if position >= 0:
+        description = text[position:position + len(description)]
+    description = description[0].upper() + description[1:]
+
+    return {
+        "description": description,
+        "datetime": event_time.astimezone(pytz.UTC).strftime('%Y-%m-%d %H:%M'),
+    }
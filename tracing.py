@@ -0,0 +1,210 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import (
+    TRACE_ENABLED, TRACE_SAMPLE_RATE, TRACE_SLOW_THRESHOLD, TRACE_SINK, TRACE_SLOW_LOG,
+    TRACE_MAX_MB, TRACE_BACKUPS
+)
+
+logger = logging.getLogger('Tracing')
+
+# Текущий спан; asyncio.to_thread копирует контекст, так что спаны работают и в потоках
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """Участок обработки: имя, время начала и длительность, атрибуты и родитель"""
+
+    def __init__(self, trace, name: str, parent_id: str = None, attributes: dict = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException = None):
+        if self.duration is None:
+            self.duration = time.time() - self.start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'offset_ms': round((self.start - self.trace.root.start) * 1000, 2),
+            'duration_ms': None if self.duration is None else round(self.duration * 1000, 2),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    """Дерево спанов одного обновления"""
+
+    def __init__(self, name: str, attributes: dict = None):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.root = self.add(name, None, attributes)
+
+    def add(self, name: str, parent_id: str, attributes: dict = None) -> Span:
+        span = Span(self, name, parent_id, attributes)
+        self.spans.append(span)
+        return span
+
+
+class _NoopSpan:
+    """Спан вне трассировки: вызовы ничего не делают"""
+
+    def set(self, **attributes):
+        pass
+
+
+class Tracer:
+    """Трассировка обработки обновлений.
+
+    Спаны собираются в памяти для каждого обновления и по его завершении
+    записываются одной строкой JSON в sink_path: все трассы с вероятностью
+    sample_rate, а трассы дольше slow_threshold секунд - всегда, причем
+    дополнительно в slow_log_path. Файл больше max_bytes ротируется с
+    хранением backups (не меньше одной) старых копий, так что место на диске
+    ограничено даже при перегрузке, когда медленных трасс много.
+
+    finish вызывается в цикле событий, поэтому запись в файлы и ротацию
+    выполняет отдельный поток: finish только кладет строку в очередь."""
+
+    def __init__(self, sink_path: str, slow_log_path: str = None, sample_rate: float = 0.01,
+                 slow_threshold: float = 5.0, enabled: bool = True,
+                 max_bytes: int = 50 * 1024 * 1024, backups: int = 2):
+        self.sink_path = sink_path
+        self.slow_log_path = slow_log_path
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = queue.SimpleQueue()
+        self._handlers = []
+        self._sink = self._file_logger('sink', sink_path)
+        self._slow_log = self._file_logger('slow', slow_log_path)
+        self._listener = None
+        if enabled and self._handlers:
+            # Один поток пишет во все файлы; файл выбирается фильтром по имени логгера
+            self._listener = QueueListener(self._queue, *self._handlers)
+            self._listener.start()
+
+    def _file_logger(self, name: str, path: str):
+        """Логгер, строки которого через общую очередь попадают в ротируемый файл path"""
+        if not path:
+            return None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        file_logger = logging.getLogger(f'Tracing.{name}')
+        file_logger.propagate = False
+        file_logger.setLevel(logging.INFO)
+        file_logger.handlers = [QueueHandler(self._queue)]
+        # RotatingFileHandler без резервных копий не ротирует файл вовсе
+        handler = RotatingFileHandler(path, maxBytes=self.max_bytes, backupCount=max(1, self.backups),
+                                      encoding='utf-8', delay=True)
+        handler.addFilter(lambda record: record.name == file_logger.name)
+        self._handlers.append(handler)
+        return file_logger
+
+    def close(self):
+        """Дописывает трассы из очереди и закрывает файлы"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        for handler in self._handlers:
+            handler.close()
+
+    def start_trace(self, name: str, **attributes):
+        """Корневой спан новой трассы; завершается вызовом finish"""
+        if not self.enabled:
+            return None
+        return Trace(name, attributes).root
+
+    @contextmanager
+    def activate(self, span):
+        """Делает span текущим: спаны внутри блока станут его потомками"""
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Дочерний спан текущего; вне трассы - пустышка"""
+        parent = _current_span.get()
+        if parent is None:
+            yield _NoopSpan()
+            return
+        span = parent.trace.add(name, parent.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+
+    def current(self):
+        """Текущий спан (для добавления атрибутов) или пустышка"""
+        return _current_span.get() or _NoopSpan()
+
+    def finish(self, root: Span, error: BaseException = None):
+        """Завершает трассу и решает, записывать ли ее"""
+        if root is None:
+            return
+        root.end(error)
+        slow = root.duration >= self.slow_threshold
+        if not slow and random.random() >= self.sample_rate:
+            return
+        record = {
+            'trace_id': root.trace.trace_id,
+            'name': root.name,
+            'timestamp': root.start,
+            'duration_ms': round(root.duration * 1000, 2),
+            'slow': slow,
+            'spans': [span.to_dict() for span in root.trace.spans],
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        if self._sink:
+            self._sink.info(line)
+        if slow and self._slow_log:
+            self._slow_log.info(line)
+        if slow:
+            stages = ', '.join(
+                f"{span.name} {span.duration:.2f} с"
+                for span in root.trace.spans
+                if span.parent_id == root.span_id and span.duration is not None
+            )
+            logger.warning(f"Медленная обработка {root.name}: {root.duration:.2f} с ({stages})")
+
+
+# Общий трассировщик процесса
+tracer = Tracer(
+    TRACE_SINK,
+    slow_log_path=TRACE_SLOW_LOG,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_threshold=TRACE_SLOW_THRESHOLD,
+    enabled=TRACE_ENABLED,
+    max_bytes=int(TRACE_MAX_MB * 1024 * 1024),
+    backups=TRACE_BACKUPS
+)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta
+from metrics import Gauge, Counter
+
+logger = logging.getLogger('VoiceStorage')
+
+VOICE_STORAGE_BYTES = Gauge('reminderbot_voice_storage_bytes', 'Объем хранимых голосовых сообщений')
+VOICE_STORAGE_FILES = Gauge('reminderbot_voice_storage_files', 'Количество хранимых голосовых сообщений')
+VOICE_FILES_DELETED = Counter('reminderbot_voice_files_deleted_total', 'Удаленные файлы голосовых сообщений')
+
+
+class VoiceStorage:
+    """Файлы голосовых сообщений: раскладка по каталогам, срок хранения и квота.
+
+    Файлы пользователя лежат в root/<ab>/<user_id>/, где ab - два hex-символа
+    хеша user_id, так что ни один каталог не разрастается. WAV нужен только для
+    распознавания и удаляется сразу после него. OGG хранятся не дольше
+    retention_days и не больше quota_bytes на пользователя: лишнее удаляет
+    фоновая очистка, начиная со старых. Расшифровка в базе остается."""
+
+    def __init__(self, db, root: str = 'voice_messages', retention_days: float = 30,
+                 quota_bytes: int = 50 * 1024 * 1024, sweep_interval: float = 3600):
+        self.db = db
+        self.root = root
+        self.retention = timedelta(days=retention_days)
+        self.quota_bytes = quota_bytes
+        self.sweep_interval = sweep_interval
+        os.makedirs(self.root, exist_ok=True)
+
+    def user_dir(self, user_id: int) -> str:
+        bucket = f"{zlib.crc32(str(user_id).encode()) & 0xff:02x}"
+        return os.path.join(self.root, bucket, str(user_id))
+
+    def paths(self, user_id: int, name: str) -> tuple:
+        """Пути (ogg, wav) для нового голосового сообщения; каталог создается"""
+        directory = self.user_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{name}.ogg"), os.path.join(directory, f"{name}.wav")
+
+    @staticmethod
+    def discard(*paths) -> int:
+        """Удаляет файлы, если они есть; возвращает освобожденный объем"""
+        freed = 0
+        for path in paths:
+            if path and os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+                VOICE_FILES_DELETED.inc()
+        return freed
+
+    def usage(self, user_id: int) -> tuple:
+        """(количество, байт) хранимых голосовых сообщений пользователя"""
+        return self.db.get_voice_usage(user_id)
+
+    async def _clear(self, rows_by_user: dict) -> int:
+        freed = 0
+        for user_id, rows in rows_by_user.items():
+            freed += await asyncio.to_thread(
+                lambda: sum(self.discard(ogg_path, wav_path) for _, ogg_path, wav_path in rows)
+            )
+            await self.db.clear_voice_files(user_id, [voice_id for voice_id, _, _ in rows])
+        return freed
+
+    async def sweep(self) -> int:
+        """Удаляет файлы старше срока хранения и сверх квоты; возвращает освобожденный объем"""
+        freed = 0
+
+        # Срок хранения - пачками, пока есть просроченные
+        before = (datetime.utcnow() - self.retention).strftime('%Y-%m-%d %H:%M:%S')
+        while True:
+            expired = await asyncio.to_thread(self.db.get_expired_voice_files, before)
+            if not expired:
+                break
+            by_user = {}
+            for user_id, voice_id, ogg_path, wav_path in expired:
+                by_user.setdefault(user_id, []).append((voice_id, ogg_path, wav_path))
+            freed += await self._clear(by_user)
+
+        # Квота - удаляем самые старые файлы пользователя, пока он не уложится
+        for user_id, used in await asyncio.to_thread(self.db.get_voice_quota_excess, self.quota_bytes):
+            files = await asyncio.to_thread(self.db.get_user_voice_files, user_id)
+            victims = []
+            for voice_id, ogg_path, wav_path, file_size in files:
+                if used <= self.quota_bytes:
+                    break
+                victims.append((voice_id, ogg_path, wav_path))
+                used -= file_size
+            freed += await self._clear({user_id: victims})
+            logger.info(f"Пользователь {user_id} превысил квоту, удалено файлов: {len(victims)}")
+
+        count, total = await asyncio.to_thread(self.db.get_voice_usage)
+        VOICE_STORAGE_FILES.set(count)
+        VOICE_STORAGE_BYTES.set(total)
+        if freed:
+            logger.info(f"Очистка голосовых: освобождено {freed / 1024 / 1024:.1f} МБ, "
+                        f"хранится {count} файлов, {total / 1024 / 1024:.1f} МБ")
+        return freed
+
+    async def run_sweeper(self):
+        """Периодическая очистка; работает до отмены задачи"""
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Ошибка очистки голосовых сообщений")
+            await asyncio.sleep(self.sweep_interval)
@@ -0,0 +1,77 @@
+import asyncio
+import hmac
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger('Webhook')
+
+
+class WebhookServer:
+    """Прием обновлений Telegram через вебхук - альтернатива long polling.
+
+    Каждое обновление передается диспетчеру в отдельной задаче; число
+    одновременно обрабатываемых обновлений ограничено max_concurrency.
+    Когда лимит исчерпан, ответ Telegram задерживается до освобождения места."""
+
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = '/webhook',
+                 secret_token: str = None, max_concurrency: int = 32):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._runner = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token:
+            received = request.headers.get(self.SECRET_HEADER, '')
+            if not hmac.compare_digest(received, self.secret_token):
+                logger.warning(f"Отклонен запрос с неверным секретом от {request.remote}")
+                return web.Response(status=403)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        # Ждем свободного места до ответа: так перегрузка тормозит Telegram, а не память процесса
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: dict):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            logger.exception(f"Ошибка обработки обновления {update.get('update_id')}")
+        finally:
+            self._semaphore.release()
+
+    async def start(self, host: str, port: int, url: str = None):
+        """Запускает HTTP-сервер; если задан публичный url, регистрирует вебхук в Telegram"""
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Вебхук слушает http://{host}:{port}{self.path}")
+
+        if url:
+            await self.bot.set_webhook(url, secret_token=self.secret_token)
+            logger.info(f"Вебхук зарегистрирован: {url}")
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None